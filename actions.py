@@ -0,0 +1,216 @@
+import json
+import string
+
+
+def parse_action_settings(spec):
+    # Parses "interpret_command=model:gpt-4o-mini,max_tokens:256;generate_code=temperature:0.2"
+    # into {'interpret_command': {'model': 'gpt-4o-mini', 'max_tokens': 256}, ...}
+    settings = {}
+    for entry in (spec or '').split(';'):
+        entry = entry.strip()
+        if not entry or '=' not in entry:
+            continue
+        action, value = entry.split('=', 1)
+        knobs = {}
+        for part in value.split(','):
+            name, sep, raw = part.partition(':')
+            if not sep:
+                continue
+            raw = raw.strip()
+            try:
+                knobs[name.strip()] = int(raw)
+            except ValueError:
+                try:
+                    knobs[name.strip()] = float(raw)
+                except ValueError:
+                    knobs[name.strip()] = raw
+        settings[action.strip()] = knobs
+    return settings
+
+
+class ActionTable:
+    # Action name -> action spec or handler function, for O(1) dispatch.
+    # Actions are added with add() or the register() decorator, so a new
+    # action never needs an edit to the code that dispatches it.
+
+    def __init__(self, name):
+        self.name = name
+        self._entries = {}
+
+    def add(self, action, entry):
+        self._entries[action] = entry
+        return entry
+
+    def register(self, action):
+        def decorate(fn):
+            return self.add(action, fn)
+        return decorate
+
+    def get(self, action):
+        return self._entries.get(action) if isinstance(action, str) else None
+
+    def names(self):
+        return list(self._entries)
+
+    def configure(self, settings):
+        # Applies {action: {knob: value}} to the specs that exist
+        for action, knobs in settings.items():
+            entry = self.get(action)
+            if entry is not None:
+                entry.configure(**knobs)
+
+
+class ChatAction:
+    # One ChatGPT action. The prompt template is parsed once, here, into
+    # its bound format method and the request fields it reads (with their
+    # defaults); model, max_tokens and temperature are per-action knobs.
+    # budget_field names the input held to the token budget (see
+    # tokens.py); the results for its chunks are joined with joiner.
+    # semantic_field names the input a near-duplicate may differ in and
+    # still be served from the semantic cache (see semantic.py).
+
+    KNOBS = ('model', 'max_tokens', 'temperature')
+
+    def __init__(self, name, template, defaults=None, result_field=None, model='gpt-3.5-turbo',
+                 max_tokens=None, temperature=None, cacheable=False, streamable=False,
+                 budget_field=None, budget_kind='text', joiner='\n\n', semantic_field=None):
+        self.name = name
+        self.template = template
+        self.result_field = result_field
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.cacheable = cacheable
+        self.streamable = streamable
+        self.budget_field = budget_field
+        self.budget_kind = budget_kind
+        self.joiner = joiner
+        self.semantic_field = semantic_field
+        self.message = f"{name.replace('_', ' ').capitalize()} completed"
+        defaults = defaults or {}
+        self._fields = [(field, defaults.get(field, '')) for _, field, _, _ in string.Formatter().parse(template) if field]
+        self._render = template.format
+
+    def configure(self, **knobs):
+        for knob, value in knobs.items():
+            if knob not in self.KNOBS:
+                raise ValueError(f"Unknown setting {knob} for {self.name}")
+            setattr(self, knob, value)
+
+    def prompt(self, data):
+        return self._render(**{field: data.get(field, default) for field, default in self._fields})
+
+    def semantic_scope(self, data):
+        # Everything but the semantic field that shapes the completion; a
+        # cached result is only reused within the same scope
+        fields = {field: data.get(field, default) for field, default in self._fields if field != self.semantic_field}
+        return json.dumps([self.name, self.model, self.max_tokens, self.temperature, fields], sort_keys=True, default=str)
+
+    def payload(self, data):
+        payload = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": self.prompt(data)}]
+        }
+        if self.max_tokens is not None:
+            payload["max_tokens"] = int(self.max_tokens)
+        if self.temperature is not None:
+            payload["temperature"] = self.temperature
+        return payload
+
+    def result(self, content):
+        result = {"status": "OK", "message": self.message, "content": content}
+        if self.result_field:
+            result[self.result_field] = content
+        return result, 200
+
+    def merge(self, results):
+        # One result from the (result, status_code) of each chunk, in order
+        return self.result(self.joiner.join(result['content'].strip('\n') for result, _ in results))
+
+
+class BlackboxAction:
+    # One Blackbox action: its API endpoint, the request fields it sends
+    # (with defaults), and the response field that carries its result.
+    # budget_field and joiner are as for ChatAction.
+
+    def __init__(self, name, endpoint, fields, response_field, result_field, message, empty_message,
+                 empty_status=500, cacheable=False, budget_field=None, budget_kind='text', joiner='\n\n'):
+        self.name = name
+        self.endpoint = endpoint
+        self.fields = fields
+        self.response_field = response_field
+        self.result_field = result_field
+        self.message = message
+        self.empty_message = empty_message
+        self.empty_status = empty_status
+        self.cacheable = cacheable
+        self.budget_field = budget_field
+        self.budget_kind = budget_kind
+        self.joiner = joiner
+
+    def configure(self, **knobs):
+        raise ValueError(f"{self.name} has no settings")
+
+    def payload(self, data):
+        return {field: data.get(field, default) for field, default in self.fields.items()}
+
+    def result(self, response_data):
+        value = response_data.get(self.response_field, '')
+        if not value:
+            return {"status": "Error", "message": self.empty_message}, self.empty_status
+        return {"status": "OK", "message": self.message, self.result_field: value}, 200
+
+    def join(self, pieces):
+        # Pieces of one input processed separately, as a single value
+        return self.joiner.join(piece.strip('\n') for piece in pieces)
+
+    def merge(self, results):
+        # One result from the (result, status_code) of each chunk, in order;
+        # the first failed chunk fails the whole request
+        for result, status_code in results:
+            if status_code != 200:
+                return result, status_code
+        return self.result({self.response_field: self.join(result[self.result_field] for result, _ in results)})
+
+
+CHATGPT_ACTIONS = ActionTable('chatgpt')
+CHATGPT_ACTIONS.add('generate_code', ChatAction(
+    'generate_code', "Generate {language} code for: {description}", defaults={'language': 'python'},
+    result_field='code', cacheable=True, streamable=True, semantic_field='description'))
+CHATGPT_ACTIONS.add('generate_documentation', ChatAction(
+    'generate_documentation', "Generate documentation for the following project description:\n{description}",
+    result_field='documentation', cacheable=True, streamable=True, budget_field='description'))
+CHATGPT_ACTIONS.add('answer_query', ChatAction('answer_query', "{query}", result_field='answer', semantic_field='query'))
+CHATGPT_ACTIONS.add('interpret_command', ChatAction(
+    'interpret_command',
+    "Interpret the following project management command and convert it into structured data for task "
+    "creation or update:\n{command}",
+    result_field='interpretation'))
+
+BLACKBOX_ACTIONS = ActionTable('blackbox')
+BLACKBOX_ACTIONS.add('search_code', BlackboxAction(
+    'search_code', 'search', {'query': '', 'language': 'python'}, 'code', 'snippet',
+    "Code found", "No code found", empty_status=404))
+BLACKBOX_ACTIONS.add('optimize_code', BlackboxAction(
+    'optimize_code', 'optimize', {'code': '', 'optimization_level': 'medium'}, 'optimized_code', 'optimized_code',
+    "Code optimized", "Failed to optimize code", cacheable=True,
+    budget_field='code', budget_kind='code', joiner='\n\n\n'))
+BLACKBOX_ACTIONS.add('analyze_complexity', BlackboxAction(
+    'analyze_complexity', 'analyze', {'code': ''}, 'analysis', 'analysis',
+    "Code analyzed", "Failed to analyze code complexity", cacheable=True,
+    budget_field='code', budget_kind='code'))
+
+UPSTREAM_ACTIONS = {'chatgpt': CHATGPT_ACTIONS, 'blackbox': BLACKBOX_ACTIONS}
+
+
+def cacheable(upstream, action):
+    # Whether the upstream result of an action depends only on its payload
+    table = UPSTREAM_ACTIONS.get(upstream)
+    spec = table.get(action) if table is not None else None
+    return spec is not None and spec.cacheable
+
+
+def streamable(action):
+    # Whether a ChatGPT action's completion can be forwarded token by token
+    spec = CHATGPT_ACTIONS.get(action)
+    return spec is not None and spec.streamable
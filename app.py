@@ -1,22 +1,264 @@
-from flask import Flask, jsonify, request
-import uuid
-import git
-import json
+from flask import Flask, Response, g, jsonify, request
+import contextvars
+import hashlib
+import threading
 import os
 import requests
 from dotenv import load_dotenv
-from functools import wraps
-
-load_dotenv()
+from functools import partial, wraps
+import atexit
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from upstream import UpstreamClient
+from cache import ResponseCache, make_cache_key
+from semantic import SemanticCache
+from singleflight import SingleFlight
+from streaming import encode_event, openai_deltas, stream_format
+from pipeline import StagedExecutor, StageTimings
+from codeblocks import CodeBlockSplitter
+from tokens import OversizeError, TokenBudget
+from store import VersionConflict, open_project_store
+from jobs import JobQueueFull, JobRunner
+from jobqueue import JobQueue, JobWorker, webhook_url_error
+from repos import MirrorCache, clone_options, clone_repository
+from resilience import CircuitOpenError
+import actions
+import jsoncodec
+import metrics
+import tracing
+from jsoncodec import provider_for
+from compress import Compressor
+from tracing import Tracer, traced
 
 app = Flask(__name__)
 
-# Configuration
-CHATGPT_API_KEY = os.getenv('CHATGPT_API_KEY')
-BLACKBOX_API_KEY = os.getenv('BLACKBOX_API_KEY')
+# orjson-backed JSON for request bodies and responses (see jsoncodec.py)
+app.json = provider_for(app)
+
+# Coalesces identical concurrent upstream requests into one call
+inflight = SingleFlight()
+
+# Stops the inline job worker threads
+job_workers_stop = threading.Event()
+_job_threads = []
+_job_threads_lock = threading.Lock()
+
+# Configuration, clients, caches, pools, the project store and the job
+# queue; create_app() sets them up from the environment
+CHATGPT_API_KEY = None
+BLACKBOX_API_KEY = None
+upstream_client = None
+response_cache = None
+semantic_cache = None
+token_budget = None
+chunk_pool = None
+integrate_executor = None
+BATCH_MAX_ITEMS = None
+BATCH_DEFAULT_CONCURRENCY = None
+BATCH_MAX_CONCURRENCY = None
+batch_pool = None
+project_store = None
+TASK_PAGE_SIZE = None
+clone_jobs = None
+job_queue = None
+JOB_WEBHOOK_ALLOWED_HOSTS = None
+JOB_INLINE_WORKERS = None
+repo_mirrors = None
+response_compressor = None
+tracer = None
+_created = False
+_create_lock = threading.Lock()
+
+def create_app():
+    # Application factory: reads .env and the environment and builds the
+    # state the routes below share, once per process. Importing this module
+    # only defines the routes; servers, worker.py and tests call this, and
+    # later calls return the same app.
+    global CHATGPT_API_KEY, BLACKBOX_API_KEY, upstream_client, response_cache, semantic_cache, token_budget, \
+        chunk_pool, integrate_executor, BATCH_MAX_ITEMS, BATCH_DEFAULT_CONCURRENCY, BATCH_MAX_CONCURRENCY, batch_pool, \
+        project_store, TASK_PAGE_SIZE, clone_jobs, job_queue, JOB_WEBHOOK_ALLOWED_HOSTS, JOB_INLINE_WORKERS, \
+        repo_mirrors, response_compressor, tracer
+    global _created
+    with _create_lock:
+        if _created:
+            return app
+        load_dotenv()
+
+        # Configuration
+        CHATGPT_API_KEY = os.getenv('CHATGPT_API_KEY')
+        BLACKBOX_API_KEY = os.getenv('BLACKBOX_API_KEY')
+
+        # Per-action model and token settings for ChatGPT actions (see actions.py), e.g.
+        # CHATGPT_ACTION_SETTINGS="interpret_command=model:gpt-4o-mini,max_tokens:256"
+        actions.CHATGPT_ACTIONS.configure(actions.parse_action_settings(os.getenv('CHATGPT_ACTION_SETTINGS')))
+
+        # Shared, pooled keep-alive client for all outbound AI calls
+        upstream_client = UpstreamClient.from_env()
+
+        # Content-addressed cache for deterministic upstream actions
+        response_cache = ResponseCache.from_env()
+
+        # Near-duplicate lookups for answer_query and generate_code (off by default)
+        semantic_cache = SemanticCache.from_env()
+
+        # Token budget for large code and description inputs (see tokens.py); the
+        # chunks of a split input are sent concurrently on their own pool
+        token_budget = TokenBudget.from_env()
+        chunk_pool = ThreadPoolExecutor(max_workers=int(os.getenv('PROMPT_CHUNK_WORKERS', '8')),
+                                        thread_name_prefix='chunk')
+
+        # Bounded worker pools for the /integrate generate and optimize stages
+        integrate_executor = StagedExecutor({
+            'generate': int(os.getenv('INTEGRATE_GENERATE_WORKERS', '16')),
+            'optimize': int(os.getenv('INTEGRATE_OPTIMIZE_WORKERS', '16')),
+        }, context=app.app_context)
+
+        # Limits for the /batch endpoint. Every batch runs its items on one shared
+        # pool, at most its own concurrency at a time.
+        BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '500'))
+        BATCH_DEFAULT_CONCURRENCY = int(os.getenv('BATCH_DEFAULT_CONCURRENCY', '8'))
+        BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', '32'))
+        batch_pool = ThreadPoolExecutor(max_workers=int(os.getenv('BATCH_WORKERS', '32')), thread_name_prefix='batch')
 
-# In-memory storage for projects and their details
-projects = {}
+        # Storage for projects and their details (memory or SQLite, see store.py)
+        project_store = open_project_store()
+
+        # Default page size for the list_tasks action
+        TASK_PAGE_SIZE = int(os.getenv('TASK_PAGE_SIZE', '100'))
+
+        # Repository clones run on their own small pool, off the request threads
+        clone_jobs = JobRunner(
+            'clone',
+            workers=int(os.getenv('CLONE_WORKERS', '2')),
+            max_queued=int(os.getenv('CLONE_MAX_QUEUED', '100')),
+            retention=float(os.getenv('CLONE_JOB_RETENTION', '3600'))
+        )
+
+        # Durable queue for background /integrate and generate_documentation
+        # requests. JOB_INLINE_WORKERS threads in this process work it; worker.py
+        # runs more in separate processes (with JOB_QUEUE_PATH and a SQLite
+        # project store shared between them).
+        job_queue = JobQueue.from_env()
+        # Hosts that may receive job webhooks even though they resolve to private
+        # or loopback addresses; any other host must be public
+        JOB_WEBHOOK_ALLOWED_HOSTS = tuple(host.strip().lower()
+                                          for host in os.getenv('JOB_WEBHOOK_ALLOWED_HOSTS', '').split(',')
+                                          if host.strip())
+        JOB_INLINE_WORKERS = int(os.getenv('JOB_INLINE_WORKERS', '2'))
+
+        # Bare mirrors that project checkouts are cloned from (None when disabled)
+        repo_mirrors = MirrorCache.from_env()
+
+        # Negotiated zstd/brotli/gzip compression of large responses
+        response_compressor = Compressor.from_env()
+
+        # Spans for routes, in-process sub-calls and upstream requests
+        tracer = Tracer.from_env()
+        if tracer.exporter is not None:
+            atexit.register(tracer.flush)
+        _created = True
+    return app
+
+def metric_action(data):
+    # Registered actions are reported as metric labels; any other value is
+    # reported as "other" so clients cannot grow the number of series
+    action = data.get('action') if isinstance(data, dict) else None
+    if action is None:
+        return ''
+    tables = (PROJECT_ACTIONS, DEVIN_ACTIONS, actions.CHATGPT_ACTIONS, actions.BLACKBOX_ACTIONS)
+    return action if any(table.get(action) is not None for table in tables) else 'other'
+
+def request_route():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+@app.before_request
+def start_request_timer():
+    g.request_timer = metrics.RequestTimer(request_route(), metric_action(request.get_json(silent=True))).start()
+
+@app.before_request
+def start_request_span():
+    route = request_route()
+    span = tracer.start_span(f"{request.method} {route}", 'server', request.headers.get('traceparent'), {
+        'http.request.method': request.method,
+        'http.route': route,
+        'fusion.action': metric_action(request.get_json(silent=True)) or None
+    })
+    g.request_span = span
+    g.request_span_token = tracing.activate(span)
+
+@app.after_request
+def finish_request_timer(response):
+    timer = g.pop('request_timer', None)
+    if timer is not None and response.is_streamed:
+        # Deferred until the body has been sent, so streams are timed in full
+        response.call_on_close(partial(timer.finish, response.status_code))
+    elif timer is not None:
+        timer.finish(response.status_code)
+    return response
+
+@app.teardown_request
+def abandon_request_timer(exc):
+    # after_request is skipped when an exception escapes the view
+    timer = g.pop('request_timer', None)
+    if timer is not None:
+        timer.finish(500)
+
+@app.after_request
+def finish_request_span(response):
+    span = g.pop('request_span', None)
+    if span is None:
+        return response
+    response.headers[tracing.TRACE_HEADER] = span.trace_id
+    span.set_attribute('http.response.status_code', response.status_code)
+    if response.status_code >= 500:
+        span.set_error(f"HTTP {response.status_code}")
+    if response.is_streamed:
+        response.call_on_close(span.end)
+    else:
+        span.end()
+    return response
+
+@app.after_request
+def compress_response(response):
+    # Streamed responses are sent as they are produced and left as is
+    if response.is_streamed or response.direct_passthrough:
+        return response
+    return response_compressor.encode(response, response.get_data(), request.headers.get('Accept-Encoding'))
+
+@app.teardown_request
+def close_request_span(exc):
+    token = g.pop('request_span_token', None)
+    if token is not None:
+        tracing.deactivate(token)
+    span = g.pop('request_span', None)
+    if span is not None:
+        span.set_error(f"{type(exc).__name__}: {exc}" if exc is not None else "Request aborted")
+        span.end()
+
+def state_metrics():
+    # Scrape-time gauges for state kept by the limiter, breakers and caches
+    limits = upstream_client.limits()
+    policies = upstream_client.resilience_stats()
+    cache = response_cache.stats()
+    semantic = semantic_cache.stats()
+    return [
+        ('fusion_upstream_concurrency_limit', 'gauge', 'Adaptive concurrency limit per upstream and API key',
+         [({'limiter': key}, stats['concurrency_limit']) for key, stats in limits.items()]),
+        ('fusion_upstream_queue_depth', 'gauge', 'Calls waiting for rate limit budget',
+         [({'limiter': key}, stats['queue_depth']) for key, stats in limits.items()]),
+        ('fusion_upstream_circuit_open', 'gauge', '1 while the upstream circuit is open or half open',
+         [({'upstream': upstream}, int(stats['circuit'] != 'closed')) for upstream, stats in policies.items()]),
+        ('fusion_cache_entries', 'gauge', 'Entries in the response cache',
+         [({}, cache['entries'])] if cache['entries'] is not None else []),
+        ('fusion_cache_bytes', 'gauge', 'Size of the response cache',
+         [({}, cache['bytes'])] if cache['bytes'] is not None else []),
+        ('fusion_semantic_cache_entries', 'gauge', 'Entries in the semantic cache', [({}, semantic['entries'])]),
+        ('fusion_clone_jobs', 'gauge', 'Clone jobs by status',
+         [({'status': status}, count) for status, count in clone_jobs.stats()['jobs'].items()]),
+        ('fusion_queued_jobs', 'gauge', 'Durable queue jobs by status',
+         [({'status': status}, count) for status, count in job_queue.stats()['jobs'].items()]),
+    ]
+
+metrics.registry.add_collector(state_metrics)
 
 def api_key_required(f):
     @wraps(f)
@@ -26,92 +268,465 @@ def api_key_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def cached_call(upstream, action, payload, fetch, near_match=None):
+    # Returns (result, status_code, headers). Only successful results are
+    # cached; identical concurrent calls share one in-flight upstream request.
+    # near_match, if given, is tried after an exact cache miss (it is the
+    # slower semantic lookup) and returns a (result, status_code, headers)
+    # hit or None.
+    key = make_cache_key(upstream, action, payload, payload.get('model'))
+    cacheable = response_cache.enabled and actions.cacheable(upstream, action)
+    headers = {}
+    if cacheable:
+        cached = response_cache.get(key)
+        if cached is not None:
+            metrics.CACHE_REQUESTS.inc(upstream, action, 'hit')
+            return cached, 200, {"X-Cache": "HIT"}
+        metrics.CACHE_REQUESTS.inc(upstream, action, 'miss')
+        headers["X-Cache"] = "MISS"
+    if near_match is not None:
+        hit = near_match()
+        if hit is not None:
+            return hit
+
+    def fetch_and_store():
+        result, status_code = fetch()
+        if cacheable and status_code == 200:
+            response_cache.set(key, result)
+        return result, status_code
+
+    (result, status_code), shared = inflight.do(key, fetch_and_store)
+    if shared:
+        metrics.COALESCED_REQUESTS.inc(upstream, action)
+        headers["X-Coalesced"] = "true"
+    return result, status_code, headers
+
+def budget_input(spec, data, stream=False):
+    # Returns (inputs, error): the request data to send upstream for an
+    # action, one per chunk when its budgeted field is split, or error as
+    # (result, status_code) when the input is rejected. A stream forwards a
+    # single completion, so a streamed input is truncated instead of split.
+    if spec.budget_field is None:
+        return [data], None
+    mode = data.get('oversize')
+    if stream and (mode or token_budget.mode) == 'chunk':
+        mode = 'truncate'
+    text = data.get(spec.budget_field)
+    try:
+        parts = token_budget.plan(text, kind=spec.budget_kind, mode=mode)
+    except OversizeError as e:
+        return None, ({"status": "Error", "message": f"Input too large: {e}"}, 413)
+    except ValueError as e:
+        return None, ({"status": "Error", "message": str(e)}, 400)
+    if len(parts) == 1 and parts[0] is text:
+        return [data], None
+    return [{**data, spec.budget_field: part} for part in parts], None
+
+def budget_headers(inputs, data):
+    if len(inputs) > 1:
+        return {"X-Input-Chunks": str(len(inputs))}
+    if inputs[0] is not data:
+        return {"X-Input-Truncated": "true"}
+    return {}
+
+def map_chunks(call, inputs):
+    # Runs call over the chunks of one input concurrently, so latency
+    # follows the largest chunk; returns the results in chunk order
+    futures = [chunk_pool.submit(contextvars.copy_context().run, call, part) for part in inputs]
+    return [future.result() for future in futures]
+
+def semantic_text(spec, data):
+    text = data.get(spec.semantic_field) if spec.semantic_field and semantic_cache.enabled else None
+    return text if isinstance(text, str) and text.strip() else None
+
+def semantic_lookup(spec, data):
+    # (result, status_code, headers) from the semantic cache when the
+    # request is a near-duplicate of an earlier one, otherwise None
+    text = semantic_text(spec, data)
+    if text is None:
+        return None
+    match = semantic_cache.get(spec.semantic_scope(data), text)
+    metrics.CACHE_REQUESTS.inc('chatgpt', spec.name, 'semantic_hit' if match is not None else 'semantic_miss')
+    if match is None:
+        return None
+    result, similarity = match
+    return result, 200, {"X-Cache": "HIT", "X-Cache-Match": "semantic", "X-Cache-Similarity": f"{similarity:.3f}"}
+
+def semantic_store(spec, data, result, status_code, headers):
+    text = semantic_text(spec, data)
+    if text is not None and status_code == 200 and headers.get('X-Cache') != 'HIT':
+        semantic_cache.set(spec.semantic_scope(data), text, result)
+
+def internal_result(response):
+    # View functions called in-process return Flask responses or
+    # (response, status[, headers]) tuples; unwrap them to the JSON body
+    if isinstance(response, tuple):
+        response = response[0]
+    if isinstance(response, Response):
+        return response.get_json()
+    return response
+
 @app.route('/')
 def health_check():
     return jsonify({"status": "OK", "message": "AI Fusion API is running"})
 
+@app.route('/upstream/pools')
+def upstream_pools():
+    return jsonify({"status": "OK", "pools": upstream_client.stats()})
+
+@app.route('/upstream/limits')
+def upstream_limits():
+    return jsonify({"status": "OK", "limits": upstream_client.limits(), "resilience": upstream_client.resilience_stats()})
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify({
+        "status": "OK",
+        "cache": response_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "inflight": inflight.stats(),
+        "mirrors": repo_mirrors.stats() if repo_mirrors is not None else None
+    })
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+def etag_for(body):
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+def matching_etag(if_none_match, tag):
+    # The ETag the client already holds for `tag`, in any content encoding
+    if if_none_match.star_tag:
+        return tag
+    return next((t for t in response_compressor.etag_variants(tag) if if_none_match.contains_weak(t)), None)
+
+def conditional_json(payload):
+    # JSON response with a strong ETag over its body, or a 304 when the
+    # client already has it
+    response = jsonify(payload)
+    tag = etag_for(response.get_data())
+    matched = matching_etag(request.if_none_match, tag)
+    if matched is not None:
+        response = Response(status=304)
+        response.vary.add('Accept-Encoding')
+        tag = matched
+    response.set_etag(tag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def project_state(project_id):
+    # Read model for GET /projects/<id>; documentation is served separately
+    project = project_store.get(project_id)
+    if project is None:
+        return None
+    project.pop('documentation', None)
+    return {"status": "OK", "project_id": project_id, "project": project}
+
+def project_documentation(project_id):
+    project = project_store.get(project_id)
+    if project is None:
+        return None
+    return {"status": "OK", "project_id": project_id, "documentation": project.get('documentation', '')}
+
+@app.route('/projects/<project_id>')
+def get_project(project_id):
+    payload = project_state(project_id)
+    if payload is None:
+        return jsonify({"status": "Error", "message": "Project not found"}), 404
+    return conditional_json(payload)
+
+@app.route('/projects/<project_id>/documentation')
+def get_project_documentation(project_id):
+    payload = project_documentation(project_id)
+    if payload is None:
+        return jsonify({"status": "Error", "message": "Project not found"}), 404
+    return conditional_json(payload)
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = clone_jobs.status(job_id) or job_queue.get(job_id)
+    if job is None:
+        return jsonify({"status": "Error", "message": "Job not found"}), 404
+    return jsonify({"status": "OK", "job": job})
+
+def submit_clone(project_id, data):
+    # Queues a clone of data['repo_url'] for the project. Returns
+    # (job_id, None) or (None, (error_result, status_code)).
+    options, error = clone_options(data)
+    if error:
+        return None, ({"status": "Error", "message": error}, 400)
+    try:
+        job_id = clone_jobs.submit('clone', clone_repository, data.get('repo_url'), f"/tmp/{project_id}",
+                                   mirrors=repo_mirrors, **options)
+    except JobQueueFull:
+        return None, ({"status": "Error", "message": "Too many clones in progress"}, 503)
+    return job_id, None
+
+def clone_result(job):
+    if job['status'] == 'succeeded':
+        return {"status": "OK", "message": "Git repository integrated successfully"}
+    return {"status": "Error", "message": "Failed to clone Git repository"}
+
+def clone_accepted(job_id):
+    return {"status": "OK", "message": "Git clone queued", "job_id": job_id, "status_url": f"/jobs/{job_id}"}, 202
+
+def job_options(data):
+    # Returns (options, error) for JobQueue.enqueue from a background request:
+    # priority (higher runs first) and webhook_url (POSTed the finished job)
+    webhook_url = data.get('webhook_url')
+    if webhook_url is not None:
+        error = webhook_url_error(webhook_url, JOB_WEBHOOK_ALLOWED_HOSTS)
+        if error is not None:
+            return None, error
+    try:
+        priority = int(data.get('priority', 0))
+    except (TypeError, ValueError):
+        return None, "Invalid priority"
+    return {'priority': priority, 'webhook_url': webhook_url}, None
+
+def enqueue_job(kind, payload, options):
+    job_id = job_queue.enqueue(kind, payload, **options)
+    start_job_workers()
+    return {"status": "OK", "message": "Job queued", "job_id": job_id, "status_url": f"/jobs/{job_id}"}, 202
+
+def job_worker():
+    return JobWorker(job_queue, JOB_HANDLERS, context=app.app_context, webhook_secret=os.getenv('JOB_WEBHOOK_SECRET'),
+                     webhook_hosts=JOB_WEBHOOK_ALLOWED_HOSTS)
+
+def start_job_workers():
+    # Starts the inline job workers on first use
+    with _job_threads_lock:
+        if _job_threads:
+            return
+        for i in range(JOB_INLINE_WORKERS):
+            thread = threading.Thread(target=job_worker().run, args=(job_workers_stop,), name=f"jobs-{i}", daemon=True)
+            thread.start()
+            _job_threads.append(thread)
+
+# Devin actions that only touch local project state: action -> handler(data)
+# returning (result, status_code). The ASGI app dispatches through it too.
+PROJECT_ACTIONS = actions.ActionTable('project')
+
+@PROJECT_ACTIONS.register('create_project')
+def create_project(data):
+    project_id = project_store.create(data.get('name', 'Untitled Project'))
+    return {"status": "OK", "message": "New project created", "project_id": project_id}, 200
+
+def update_project(data, message, **fields):
+    # With a "version" from an earlier read the update is a compare-and-swap:
+    # it is rejected with 409 and the current version if the project changed
+    expected_version = data.get('version')
+    if expected_version is not None and (isinstance(expected_version, bool) or not isinstance(expected_version, int)):
+        return {"status": "Error", "message": "Invalid version"}, 400
+    try:
+        version = project_store.update(data.get('project_id'), expected_version=expected_version, **fields)
+    except VersionConflict as e:
+        return {"status": "Error", "message": "Project was modified concurrently", "version": e.version}, 409
+    if version is not None:
+        return {"status": "OK", "message": message, "version": version}, 200
+    return {"status": "Error", "message": "Project not found"}, 200
+
+@PROJECT_ACTIONS.register('update_status')
+def update_status(data):
+    return update_project(data, "Project status updated", status=data.get('status'))
+
+@PROJECT_ACTIONS.register('update_progress')
+def update_progress(data):
+    return update_project(data, "Project progress updated", progress=data.get('progress'))
+
+@PROJECT_ACTIONS.register('add_task')
+def add_task(data):
+    project_id = data.get('project_id')
+    task = data.get('task')
+    task_id = project_store.append_task(project_id, task)
+    if task_id is not None:
+        return {"status": "OK", "message": "Task added to project", "task_id": task_id}, 200
+    return {"status": "Error", "message": "Project not found"}, 200
+
+@PROJECT_ACTIONS.register('list_tasks')
+def list_tasks(data):
+    # Cursor-paginated read of the task log; pass the returned
+    # next_cursor back to read only the tasks added since
+    project_id = data.get('project_id')
+    try:
+        cursor = int(data.get('cursor') or 0)
+        limit = int(data.get('limit', TASK_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return {"status": "Error", "message": "Invalid cursor or limit"}, 400
+    page = project_store.list_tasks(project_id, cursor=cursor, limit=limit)
+    if page is not None:
+        return {"status": "OK", **page}, 200
+    return {"status": "Error", "message": "Project not found"}, 404
+
+@PROJECT_ACTIONS.register('list_projects')
+def list_projects(data):
+    return {"status": "OK", "projects": project_store.list_projects(data.get('status'))}, 200
+
+def project_action(action, data):
+    # Returns (result, status_code), or None for actions handled by the caller
+    handler = PROJECT_ACTIONS.get(action)
+    return handler(data) if handler is not None else None
+
+# The remaining Devin actions: action -> view function taking the request data
+DEVIN_ACTIONS = actions.ActionTable('devin')
+
+@DEVIN_ACTIONS.register('integrate_git')
+def devin_integrate_git(data):
+    project_id = data.get('project_id')
+    if project_store.exists(project_id):
+        job_id, error = submit_clone(project_id, data)
+        if error:
+            return jsonify(error[0]), error[1]
+        if data.get('background'):
+            result, status_code = clone_accepted(job_id)
+            return jsonify(result), status_code
+        return jsonify(clone_result(clone_jobs.wait(job_id)))
+    return jsonify({"status": "Error", "message": "Project not found"})
+
+@DEVIN_ACTIONS.register('interpret_command')
+def devin_interpret_command(data):
+    project_id = data.get('project_id')
+    command = data.get('command')
+    if project_store.exists(project_id):
+        try:
+            # Use ChatGPT to interpret the command
+            interpreted_action = internal_result(chatgpt({"action": "interpret_command", "command": command}))
+            return jsonify({"status": "OK", "message": "Command interpreted", "action": interpreted_action})
+        except Exception as e:
+            return jsonify({"status": "Error", "message": f"Failed to interpret command: {str(e)}"})
+    return jsonify({"status": "Error", "message": "Project not found"})
+
+@DEVIN_ACTIONS.register('generate_documentation')
+def devin_generate_documentation(data):
+    project_id = data.get('project_id')
+    description = data.get('description')
+    if project_store.exists(project_id):
+        if data.get('background'):
+            options, error = job_options(data)
+            if error:
+                return jsonify({"status": "Error", "message": error}), 400
+            result, status_code = enqueue_job(
+                'generate_documentation', {'project_id': project_id, 'description': description}, options)
+            return jsonify(result), status_code
+        if data.get('stream'):
+            return chatgpt({
+                'action': 'generate_documentation',
+                'description': description,
+                'project_id': project_id,
+                'stream': True
+            })
+        try:
+            result, status_code = document_project(project_id, description)
+            return jsonify(result), status_code
+        except Exception as e:
+            app.logger.error(f"Error generating documentation: {str(e)}")
+            return jsonify({"status": "Error", "message": "An unexpected error occurred while generating documentation"}), 500
+    return jsonify({"status": "Error", "message": "Project not found"}), 404
+
 @app.route('/devin', methods=['POST'])
 def devin_ai():
     data = request.json
     action = data.get('action')
 
-    if action == 'create_project':
-        project_id = str(uuid.uuid4())
-        projects[project_id] = {
-            'name': data.get('name', 'Untitled Project'),
-            'status': 'Created',
-            'progress': 0,
-            'tasks': [],
-            'documentation': ''
-        }
-        return jsonify({"status": "OK", "message": "New project created", "project_id": project_id})
-
-    elif action == 'update_status':
-        project_id = data.get('project_id')
-        new_status = data.get('status')
-        if project_id in projects:
-            projects[project_id]['status'] = new_status
-            return jsonify({"status": "OK", "message": "Project status updated"})
-        return jsonify({"status": "Error", "message": "Project not found"})
-
-    elif action == 'update_progress':
-        project_id = data.get('project_id')
-        progress = data.get('progress')
-        if project_id in projects:
-            projects[project_id]['progress'] = progress
-            return jsonify({"status": "OK", "message": "Project progress updated"})
-        return jsonify({"status": "Error", "message": "Project not found"})
-
-    elif action == 'add_task':
-        project_id = data.get('project_id')
-        task = data.get('task')
-        if project_id in projects:
-            projects[project_id]['tasks'].append(task)
-            return jsonify({"status": "OK", "message": "Task added to project"})
-        return jsonify({"status": "Error", "message": "Project not found"})
-
-    elif action == 'integrate_git':
-        project_id = data.get('project_id')
-        repo_url = data.get('repo_url')
-        if project_id in projects:
-            try:
-                git.Repo.clone_from(repo_url, f"/tmp/{project_id}")
-                return jsonify({"status": "OK", "message": "Git repository integrated successfully"})
-            except git.GitCommandError:
-                return jsonify({"status": "Error", "message": "Failed to clone Git repository"})
-        return jsonify({"status": "Error", "message": "Project not found"})
-
-    elif action == 'interpret_command':
-        project_id = data.get('project_id')
-        command = data.get('command')
-        if project_id in projects:
-            try:
-                # Use ChatGPT to interpret the command
-                prompt = f"Interpret the following project management command and convert it into structured data for task creation or update:\n{command}"
-                interpreted_action = chatgpt({"action": "interpret_command", "command": command})
-                return jsonify({"status": "OK", "message": "Command interpreted", "action": interpreted_action})
-            except Exception as e:
-                return jsonify({"status": "Error", "message": f"Failed to interpret command: {str(e)}"})
-        return jsonify({"status": "Error", "message": "Project not found"})
-
-    elif action == 'generate_documentation':
-        project_id = data.get('project_id')
-        description = data.get('description')
-        if project_id in projects:
-            try:
-                result, status_code = generate_documentation(description, project_id)
-                if result['status'] == 'OK':
-                    projects[project_id]['documentation'] = result['documentation']
-                return jsonify(result), status_code
-            except Exception as e:
-                app.logger.error(f"Error generating documentation: {str(e)}")
-                return jsonify({"status": "Error", "message": "An unexpected error occurred while generating documentation"}), 500
-        return jsonify({"status": "Error", "message": "Project not found"}), 404
+    local = project_action(action, data)
+    if local is not None:
+        result, status_code = local
+        return jsonify(result), status_code
 
-    else:
+    handler = DEVIN_ACTIONS.get(action)
+    if handler is None:
         return jsonify({"status": "Error", "message": "Invalid action for Devin AI"})
+    return handler(data)
+
+def upstream_failure(name, e):
+    # Maps upstream failures that have a more useful status than 500 to
+    # (result, status_code, headers); returns None for everything else
+    if isinstance(e, CircuitOpenError):
+        return ({"status": "Error", "message": f"{name} API is temporarily unavailable"}, 503,
+                {"Retry-After": str(int(e.retry_after + 0.999))})
+    if isinstance(e, requests.exceptions.Timeout):
+        return {"status": "Error", "message": f"{name} API timed out"}, 504, {}
+    if isinstance(e, requests.exceptions.HTTPError) and e.response.status_code == 429:
+        retry_after = e.response.headers.get('Retry-After')
+        return ({"status": "Error", "message": "API rate limit exceeded. Please try again later."}, 429,
+                {"Retry-After": retry_after} if isinstance(retry_after, str) else {})
+    return None
+
+def upstream_headers(api_key):
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+def build_chatgpt_payload(action, data):
+    # Returns the chat completion payload, or None for an unknown action
+    spec = actions.CHATGPT_ACTIONS.get(action)
+    return spec.payload(data) if spec is not None else None
+
+def chatgpt_result(action, response_data):
+    content = response_data['choices'][0]['message']['content']
+    return actions.CHATGPT_ACTIONS.get(action).result(content)
+
+def store_documentation(project_id, documentation):
+    project_store.update(project_id, documentation={
+        "status": "OK",
+        "message": "Documentation generated",
+        "documentation": documentation
+    })
+
+def open_chatgpt_stream(action, payload, api_url, headers):
+    response = upstream_client.post('chatgpt', action, api_url, headers=headers,
+                                    json={**payload, "stream": True}, stream=True)
+    response.raise_for_status()
+    return response
+
+def stream_chatgpt(action, data, payload, api_url, headers):
+    # Forwards completion tokens as they arrive, then sends the assembled
+    # result (same shape as the non-streaming response) as the final event.
+    mimetype = stream_format(request.headers.get('Accept'))
+    project_id = data.get('project_id') if action == 'generate_documentation' else None
+    key = make_cache_key('chatgpt', action, payload, payload.get('model'))
+    cacheable = response_cache.enabled and actions.cacheable('chatgpt', action)
+
+    cached = response_cache.get(key) if cacheable else None
+    if cacheable:
+        metrics.CACHE_REQUESTS.inc('chatgpt', action, 'hit' if cached is not None else 'miss')
+    if cached is not None:
+        def replay():
+            yield encode_event(mimetype, {"type": "delta", "content": cached['content']})
+            if project_id:
+                store_documentation(project_id, cached['documentation'])
+            yield encode_event(mimetype, {"type": "done", "result": cached})
+        return Response(replay(), mimetype=mimetype, headers={"X-Cache": "HIT"})
+
+    response = open_chatgpt_stream(action, payload, api_url, headers)
+
+    def generate():
+        parts = []
+        try:
+            for content in openai_deltas(response.iter_lines()):
+                parts.append(content)
+                yield encode_event(mimetype, {"type": "delta", "content": content})
+        except Exception as e:
+            app.logger.error(f"ChatGPT stream interrupted: {str(e)}")
+            yield encode_event(mimetype, {"type": "error", "message": "Upstream stream interrupted"})
+            return
+        finally:
+            response.close()
+
+        result, _ = chatgpt_result(action, {'choices': [{'message': {'content': ''.join(parts)}}]})
+        if cacheable:
+            response_cache.set(key, result)
+        if project_id:
+            store_documentation(project_id, result['documentation'])
+        yield encode_event(mimetype, {"type": "done", "result": result})
+
+    cache_headers = {"X-Cache": "MISS"} if cacheable else {}
+    return Response(generate(), mimetype=mimetype, headers=cache_headers)
 
 @app.route('/chatgpt', methods=['POST'])
+@traced('chatgpt')
 def chatgpt(data=None):
     try:
         if data is None:
@@ -125,57 +740,50 @@ def chatgpt(data=None):
         if not CHATGPT_API_KEY:
             return jsonify({"status": "Error", "message": "ChatGPT API key not configured"}), 500
 
-        headers = {
-            "Authorization": f"Bearer {CHATGPT_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        api_url = "https://api.openai.com/v1/chat/completions"
-
-        if action == 'generate_code':
-            language = data.get('language', 'python')
-            description = data.get('description', '')
-            prompt = f"Generate {language} code for: {description}"
-        elif action == 'generate_documentation':
-            description = data.get('description', '')
-            prompt = f"Generate documentation for the following project description:\n{description}"
-        elif action == 'answer_query':
-            prompt = data.get('query', '')
-        elif action == 'interpret_command':
-            command = data.get('command', '')
-            prompt = f"Interpret the following project management command and convert it into structured data for task creation or update:\n{command}"
-        else:
+        headers = upstream_headers(CHATGPT_API_KEY)
+        api_url = os.getenv('CHATGPT_API_URL', 'https://api.openai.com/v1/chat/completions')
+
+        spec = actions.CHATGPT_ACTIONS.get(action)
+        if spec is None:
             return jsonify({"status": "Error", "message": "Invalid action for ChatGPT"}), 400
 
-        payload = {
-            "model": "gpt-3.5-turbo",
-            "messages": [{"role": "user", "content": prompt}]
-        }
+        stream = bool(data.get('stream')) and spec.streamable
+        inputs, error = budget_input(spec, data, stream=stream)
+        if error:
+            return jsonify(error[0]), error[1]
+        input_headers = budget_headers(inputs, data)
 
-        response = requests.post(api_url, headers=headers, json=payload)
-        response.raise_for_status()
-        content = response.json()['choices'][0]['message']['content']
+        if stream:
+            response = stream_chatgpt(action, inputs[0], spec.payload(inputs[0]), api_url, headers)
+            response.headers.update(input_headers)
+            return response
 
-        result = {
-            "status": "OK",
-            "message": f"{action.replace('_', ' ').capitalize()} completed",
-            "content": content
-        }
+        def call(part):
+            payload = spec.payload(part)
+
+            def fetch():
+                response = upstream_client.post('chatgpt', action, api_url, headers=headers, json=payload)
+                response.raise_for_status()
+                return chatgpt_result(action, response.json())
 
-        if action == 'generate_code':
-            result["code"] = content
-        elif action == 'generate_documentation':
-            result["documentation"] = content
-        elif action == 'answer_query':
-            result["answer"] = content
-        elif action == 'interpret_command':
-            result["interpretation"] = content
+            result, status_code, cache_headers = cached_call('chatgpt', action, payload, fetch,
+                                                             near_match=partial(semantic_lookup, spec, part))
+            semantic_store(spec, part, result, status_code, cache_headers)
+            return result, status_code, cache_headers
 
-        return jsonify(result), 200
+        if len(inputs) == 1:
+            result, status_code, cache_headers = call(inputs[0])
+        else:
+            result, status_code = spec.merge([(r, s) for r, s, _ in map_chunks(call, inputs)])
+            cache_headers = {}
+        return jsonify(result), status_code, {**cache_headers, **input_headers}
 
     except requests.exceptions.RequestException as e:
         app.logger.error(f"Error in ChatGPT API request: {str(e)}")
-        if isinstance(e, requests.exceptions.HTTPError) and e.response.status_code == 429:
-            return jsonify({"status": "Error", "message": "API rate limit exceeded. Please try again later."}), 429
+        failure = upstream_failure('ChatGPT', e)
+        if failure is not None:
+            result, status_code, headers = failure
+            return jsonify(result), status_code, headers
         return jsonify({"status": "Error", "message": "An error occurred while processing your request"}), 500
     except KeyError as e:
         app.logger.error(f"Unexpected response format from ChatGPT API: {str(e)}")
@@ -184,153 +792,403 @@ def chatgpt(data=None):
         app.logger.error(f"Unexpected error in ChatGPT API: {str(e)}")
         return jsonify({"status": "Error", "message": "An unexpected error occurred"}), 500
 
+def blackbox_url(api_url, action):
+    return f"{api_url}/{actions.BLACKBOX_ACTIONS.get(action).endpoint}"
+
+def blackbox_result(action, response_data):
+    return actions.BLACKBOX_ACTIONS.get(action).result(response_data)
+
 @app.route('/blackbox', methods=['POST'])
 @api_key_required
-def blackbox_ai():
-    data = request.json
+@traced('blackbox')
+def blackbox_ai(data=None):
+    if data is None:
+        data = request.json
     action = data.get('action')
 
     if not BLACKBOX_API_KEY:
         return jsonify({"status": "Error", "message": "Blackbox API key not configured"}), 500
 
     try:
-        headers = {
-            "Authorization": f"Bearer {BLACKBOX_API_KEY}",
-            "Content-Type": "application/json"
-        }
+        headers = upstream_headers(BLACKBOX_API_KEY)
         api_url = os.getenv('BLACKBOX_API_URL', 'https://www.useblackbox.io/api/v1')
 
-        if action == 'search_code':
-            query = data.get('query', '')
-            language = data.get('language', 'python')
-            payload = {
-                "query": query,
-                "language": language
-            }
-            response = requests.post(f"{api_url}/search", headers=headers, json=payload)
-            response.raise_for_status()
-            response_data = response.json()
-            found_code = response_data.get('code', '')
-            if not found_code:
-                return jsonify({"status": "Error", "message": "No code found"}), 404
-            return jsonify({"status": "OK", "message": "Code found", "snippet": found_code}), 200
-
-        elif action == 'optimize_code':
-            code = data.get('code', '')
-            optimization_level = data.get('optimization_level', 'medium')
-            payload = {
-                "code": code,
-                "optimization_level": optimization_level
-            }
-            response = requests.post(f"{api_url}/optimize", headers=headers, json=payload)
-            response.raise_for_status()
-            response_data = response.json()
-            optimized_code = response_data.get('optimized_code', '')
-            if not optimized_code:
-                return jsonify({"status": "Error", "message": "Failed to optimize code"}), 500
-            return jsonify({"status": "OK", "message": "Code optimized", "optimized_code": optimized_code}), 200
-
-        elif action == 'analyze_complexity':
-            code = data.get('code', '')
-            payload = {
-                "code": code
-            }
-            response = requests.post(f"{api_url}/analyze", headers=headers, json=payload)
-            response.raise_for_status()
-            response_data = response.json()
-            analysis = response_data.get('analysis', '')
-            if not analysis:
-                return jsonify({"status": "Error", "message": "Failed to analyze code complexity"}), 500
-            return jsonify({"status": "OK", "message": "Code analyzed", "analysis": analysis}), 200
+        spec = actions.BLACKBOX_ACTIONS.get(action)
+        if spec is None:
+            return jsonify({"status": "Error", "message": "Invalid action for Blackbox AI"}), 400
 
+        inputs, error = budget_input(spec, data)
+        if error:
+            return jsonify(error[0]), error[1]
+
+        def call(part):
+            payload = spec.payload(part)
+
+            def fetch():
+                response = upstream_client.post('blackbox', action, blackbox_url(api_url, action), headers=headers, json=payload)
+                response.raise_for_status()
+                return blackbox_result(action, response.json())
+
+            return cached_call('blackbox', action, payload, fetch)
+
+        if len(inputs) == 1:
+            result, status_code, cache_headers = call(inputs[0])
         else:
-            return jsonify({"status": "Error", "message": "Invalid action for Blackbox AI"}), 400
+            result, status_code = spec.merge([(r, s) for r, s, _ in map_chunks(call, inputs)])
+            cache_headers = {}
+        return jsonify(result), status_code, {**cache_headers, **budget_headers(inputs, data)}
 
     except requests.exceptions.RequestException as e:
         app.logger.error(f"Error in Blackbox API request: {str(e)}")
+        failure = upstream_failure('Blackbox', e)
+        if failure is not None:
+            result, status_code, headers = failure
+            return jsonify(result), status_code, headers
         if isinstance(e, requests.exceptions.HTTPError):
-            if e.response.status_code == 429:
-                return jsonify({"status": "Error", "message": "API rate limit exceeded. Please try again later."}), 429
             return jsonify({"status": "Error", "message": f"Blackbox API error: {e.response.status_code}"}), e.response.status_code
         return jsonify({"status": "Error", "message": "An error occurred while processing your request"}), 500
     except Exception as e:
         app.logger.error(f"Unexpected error in Blackbox AI endpoint: {str(e)}")
         return jsonify({"status": "Error", "message": "An unexpected error occurred"}), 500
 
-@app.route('/integrate', methods=['POST'])
-def integrate_ai():
-    data = request.json
-    project_id = data.get('project_id')
-    code_description = data.get('code_description')
+@traced('integrate.generate')
+def generate_code_stage(code_description):
+    return internal_result(chatgpt({
+        'action': 'generate_code',
+        'language': 'python',
+        'description': code_description
+    }))
 
-    if not project_id or not code_description:
-        return jsonify({"status": "Error", "message": "Missing project_id or code_description"}), 400
+@traced('integrate.optimize')
+def optimize_code_stage(generated_code):
+    # Returns (code, error). Falls back to the unoptimized code when
+    # Blackbox fails, with the reason in error so callers can report it.
+    try:
+        blackbox_data = internal_result(blackbox_ai({
+            'action': 'optimize_code',
+            'code': generated_code,
+            'optimization_level': 'medium'
+        }))
+        if not isinstance(blackbox_data, dict) or blackbox_data.get('status') != 'OK':
+            app.logger.warning(f"Blackbox AI optimization failed: {blackbox_data}")
+            message = blackbox_data.get('message') if isinstance(blackbox_data, dict) else None
+            return generated_code, message or "Blackbox AI optimization failed"
+        return blackbox_data.get('optimized_code', generated_code), None
+    except Exception as e:
+        app.logger.error(f"Error in Blackbox AI optimization: {str(e)}")
+        return generated_code, "Blackbox AI optimization failed"
 
-    if project_id not in projects:
-        return jsonify({"status": "Error", "message": "Project not found"}), 404
+@traced('integrate.generate_streaming')
+def speculative_generate_stage(code_description, timings):
+    # Streams the completion and hands each finished top-level block to the
+    # optimize stage while the rest of the code is still being generated.
+    # Returns the generated code and the per-block optimize futures in order.
+    if not CHATGPT_API_KEY:
+        raise RuntimeError("ChatGPT API key not configured")
+    api_url = os.getenv('CHATGPT_API_URL', 'https://api.openai.com/v1/chat/completions')
+    payload = build_chatgpt_payload('generate_code', {'language': 'python', 'description': code_description})
+    response = open_chatgpt_stream('generate_code', payload, api_url, upstream_headers(CHATGPT_API_KEY))
 
+    splitter = CodeBlockSplitter()
+    parts = []
+    futures = []
     try:
-        # Step 1: Use Devin AI to create a new task
-        projects[project_id]['tasks'].append(f"Implement: {code_description}")
+        for fragment in openai_deltas(response.iter_lines()):
+            parts.append(fragment)
+            for block in splitter.feed(fragment):
+                futures.append(integrate_executor.submit('optimize', optimize_code_stage, block, timings=timings))
+    finally:
+        response.close()
+    for block in splitter.close():
+        futures.append(integrate_executor.submit('optimize', optimize_code_stage, block, timings=timings))
+    return ''.join(parts), futures
 
+@traced('integrate_code')
+def integrate_code(code_description, speculative=False):
+    # Steps 2 and 3 of /integrate for one description, without touching
+    # project state. Returns (result, status_code); on success the result
+    # holds generated_code, optimized_code, optimization_error (None unless
+    # Blackbox failed and some code is unoptimized) and timings.
+    timings = StageTimings()
+
+    if speculative:
+        # Steps 2 and 3 overlapped: optimize each generated block as soon as it is complete
+        try:
+            generated_code, block_futures = integrate_executor.run(
+                'generate', speculative_generate_stage, code_description, timings, timings=timings)
+        except Exception as e:
+            app.logger.error(f"Error streaming code from ChatGPT: {str(e)}")
+            return {"status": "Error", "message": "Failed to generate code"}, 500
+        if not generated_code:
+            app.logger.error("No code generated by ChatGPT")
+            return {"status": "Error", "message": "No code generated by ChatGPT"}, 500
+        with timings.measure('optimize_wait'):
+            blocks = [future.result() for future in block_futures]
+        optimized_code = actions.BLACKBOX_ACTIONS.get('optimize_code').join(code for code, _ in blocks)
+        errors = [error for _, error in blocks if error]
+        optimization_error = f"{len(errors)} of {len(blocks)} blocks not optimized: {errors[0]}" if errors else None
+    else:
         # Step 2: Use ChatGPT to generate code
-        chatgpt_data = chatgpt({
-            'action': 'generate_code',
-            'language': 'python',
-            'description': code_description
-        })
+        chatgpt_data = integrate_executor.run('generate', generate_code_stage, code_description, timings=timings)
         if not isinstance(chatgpt_data, dict):
             app.logger.error(f"Invalid response from ChatGPT: {chatgpt_data}")
-            return jsonify({"status": "Error", "message": "Failed to generate code"}), 500
+            return {"status": "Error", "message": "Failed to generate code"}, 500
         if chatgpt_data.get('status') != 'OK':
             app.logger.error(f"ChatGPT error: {chatgpt_data.get('message')}")
-            return jsonify({"status": "Error", "message": "Failed to generate code"}), 500
+            return {"status": "Error", "message": "Failed to generate code"}, 500
         generated_code = chatgpt_data.get('code')
         if not generated_code:
             app.logger.error("No code generated by ChatGPT")
-            return jsonify({"status": "Error", "message": "No code generated by ChatGPT"}), 500
+            return {"status": "Error", "message": "No code generated by ChatGPT"}, 500
 
         # Step 3: Use Blackbox AI to optimize the generated code
-        try:
-            blackbox_data = blackbox_ai({
-                'action': 'optimize_code',
-                'code': generated_code,
-                'optimization_level': 'medium'
-            })
-            if not isinstance(blackbox_data, dict) or blackbox_data.get('status') != 'OK':
-                app.logger.warning(f"Blackbox AI optimization failed: {blackbox_data}")
-                optimized_code = generated_code
-            else:
-                optimized_code = blackbox_data.get('optimized_code', generated_code)
-        except Exception as e:
-            app.logger.error(f"Error in Blackbox AI optimization: {str(e)}")
-            optimized_code = generated_code
+        optimized_code, optimization_error = integrate_executor.run(
+            'optimize', optimize_code_stage, generated_code, timings=timings)
 
-        # Step 4: Update project progress
-        projects[project_id]['progress'] = min(100, projects[project_id]['progress'] + 10)
+    return {
+        "generated_code": generated_code,
+        "optimized_code": optimized_code,
+        "optimization_error": optimization_error,
+        "timings": timings.as_dict()
+    }, 200
 
-        return jsonify({
-            "status": "OK",
-            "message": "Integrated AI task completed",
-            "generated_code": generated_code,
-            "optimized_code": optimized_code,
-            "project_progress": projects[project_id]['progress'],
-            "project_tasks": projects[project_id]['tasks']
-        }), 200
+def finish_integration(project_id, task_id, code_description, speculative=False, progress_key=None):
+    # Steps 2 to 4 of /integrate once the task exists; returns (result, status_code).
+    # progress_key makes the progress update apply once per key; only jobs,
+    # which can be retried, pass one, so synchronous requests store nothing.
+    result, status_code = integrate_code(code_description, speculative=speculative)
+    if status_code != 200:
+        return result, status_code
+
+    # Step 4: Update project progress
+    progress = project_store.increment_progress(project_id, 10, key=progress_key)
+
+    return {
+        "status": "OK",
+        "message": "Integrated AI task completed",
+        "generated_code": result['generated_code'],
+        "optimized_code": result['optimized_code'],
+        "optimization_error": result['optimization_error'],
+        "project_progress": progress,
+        "task_count": project_store.get(project_id)['task_count'],
+        "task_id": task_id,
+        "timings": result['timings']
+    }, 200
+
+def document_project(project_id, description):
+    result, status_code = generate_documentation(description, project_id)
+    if result['status'] == 'OK':
+        project_store.update(project_id, documentation=result['documentation'])
+    return result, status_code
+
+# Long-running actions the job workers run: kind -> handler(payload)
+# returning (result, status_code)
+JOB_HANDLERS = actions.ActionTable('jobs')
+
+# A project deleted (or lost with an in-memory store) after the job was
+# queued fails the job with a 404, which is not retried, before any upstream
+# call is paid for
+@JOB_HANDLERS.register('integrate')
+def integrate_job(payload):
+    if not project_store.exists(payload['project_id']):
+        return {"status": "Error", "message": "Project not found"}, 404
+    # Keyed by task, so a job retried after its worker died between the
+    # progress update and completion does not count twice
+    return finish_integration(payload['project_id'], payload['task_id'], payload['code_description'],
+                              payload.get('speculative', False), progress_key=str(payload['task_id']))
+
+@JOB_HANDLERS.register('generate_documentation')
+def documentation_job(payload):
+    if not project_store.exists(payload['project_id']):
+        return {"status": "Error", "message": "Project not found"}, 404
+    return document_project(payload['project_id'], payload['description'])
+
+@app.route('/integrate', methods=['POST'])
+def integrate_ai():
+    data = request.json
+    project_id = data.get('project_id')
+    code_description = data.get('code_description')
+
+    if not project_id or not code_description:
+        return jsonify({"status": "Error", "message": "Missing project_id or code_description"}), 400
+
+    options = None
+    if data.get('background'):
+        options, error = job_options(data)
+        if error:
+            return jsonify({"status": "Error", "message": error}), 400
+
+    try:
+        # Step 1: Use Devin AI to create a new task
+        task_id = project_store.append_task(project_id, f"Implement: {code_description}")
+        if task_id is None:
+            return jsonify({"status": "Error", "message": "Project not found"}), 404
+
+        if options is not None:
+            # Steps 2 to 4 run on a job worker; the task id is part of the job
+            # so a retried job never adds the task twice
+            result, status_code = enqueue_job('integrate', {
+                'project_id': project_id,
+                'task_id': task_id,
+                'code_description': code_description,
+                'speculative': bool(data.get('speculative', False))
+            }, options)
+            return jsonify({**result, "task_id": task_id}), status_code
+
+        result, status_code = finish_integration(project_id, task_id, code_description,
+                                                 speculative=data.get('speculative', False))
+        return jsonify(result), status_code
     except Exception as e:
         app.logger.error(f"Error in integrate_ai: {str(e)}")
         return jsonify({"status": "Error", "message": "An unexpected error occurred"}), 500
 
+def run_batch_item(kind, item, speculative):
+    # Returns (result, status_code) for one batch item; never raises
+    try:
+        if kind == 'integrate':
+            return integrate_code(item, speculative=speculative)
+        response = chatgpt({**item, 'stream': False})
+        status_code = response[1] if isinstance(response, tuple) else 200
+        return internal_result(response), status_code
+    except Exception as e:
+        app.logger.error(f"Error in batch item: {str(e)}")
+        return {"status": "Error", "message": "An unexpected error occurred"}, 500
+
+def apply_batch_to_project(project_id, descriptions, outcomes):
+    # Applies every task append and progress bump of an integrate batch in
+    # one step, so readers never observe a half-applied batch
+    completed = sum(1 for _, status_code in outcomes if status_code == 200)
+    return project_store.append_tasks(
+        project_id, [f"Implement: {description}" for description in descriptions], progress_delta=10 * completed)
+
+def run_bounded(pool, fn, items, limit):
+    # Runs fn over items on pool with at most limit running at once and
+    # returns one future per item. Each of the limit lanes takes the next
+    # item when it finishes one, so a batch never holds more than limit
+    # pool threads and the pool stays shared between batches.
+    futures = [Future() for _ in items]
+    indices = iter(range(len(items)))
+    lock = threading.Lock()
+
+    def lane():
+        while True:
+            with lock:
+                index = next(indices, None)
+            if index is None:
+                return
+            if not futures[index].set_running_or_notify_cancel():
+                continue
+            try:
+                futures[index].set_result(fn(items[index]))
+            except BaseException as e:
+                futures[index].set_exception(e)
+
+    for _ in range(min(limit, len(items))):
+        pool.submit(contextvars.copy_context().run, lane)
+    return futures
+
+def when_all_done(futures, fn):
+    # Future of fn(results) run on the thread that completes the last of
+    # futures, whether or not anyone is still waiting for the batch
+    done = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        try:
+            done.set_result(fn([future.result() for future in futures]))
+        except Exception as e:
+            app.logger.error(f"Error finishing batch: {str(e)}")
+            done.set_exception(e)
+
+    for future in futures:
+        future.add_done_callback(on_done)
+    return done
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    data = request.json
+    kind = data.get('kind', 'integrate')
+    items = data.get('items')
+    speculative = data.get('speculative', False)
+
+    if kind not in ('integrate', 'chatgpt'):
+        return jsonify({"status": "Error", "message": "Invalid batch kind"}), 400
+    if not isinstance(items, list) or not items:
+        return jsonify({"status": "Error", "message": "Missing items"}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"status": "Error", "message": f"Too many items (max {BATCH_MAX_ITEMS})"}), 400
+
+    project_id = data.get('project_id')
+    if kind == 'integrate':
+        if not project_store.exists(project_id):
+            return jsonify({"status": "Error", "message": "Project not found"}), 404
+        items = [item.get('code_description') if isinstance(item, dict) else item for item in items]
+        if not all(isinstance(item, str) and item for item in items):
+            return jsonify({"status": "Error", "message": "Missing code_description"}), 400
+    elif not all(isinstance(item, dict) for item in items):
+        return jsonify({"status": "Error", "message": "Invalid input data"}), 400
+
+    try:
+        concurrency = int(data.get('concurrency', BATCH_DEFAULT_CONCURRENCY))
+    except (TypeError, ValueError):
+        return jsonify({"status": "Error", "message": "Invalid concurrency"}), 400
+    concurrency = max(1, min(concurrency, BATCH_MAX_CONCURRENCY, len(items)))
+
+    def run(item):
+        with app.app_context():
+            return run_batch_item(kind, item, speculative)
+
+    def finish(outcomes):
+        summary = {
+            "status": "OK",
+            "message": "Batch completed",
+            "completed": sum(1 for _, status_code in outcomes if status_code == 200),
+            "failed": sum(1 for _, status_code in outcomes if status_code != 200)
+        }
+        if kind == 'integrate':
+            summary["project_progress"] = apply_batch_to_project(project_id, items, outcomes)
+        return summary
+
+    futures = run_bounded(batch_pool, run, items, concurrency)
+    # The project is updated once every item is done, on the worker side, so
+    # a streaming client that disconnects early does not lose the batch
+    summary = when_all_done(futures, finish)
+
+    if data.get('stream'):
+        # NDJSON, one line per item in completion order, then the summary
+        indices = {future: index for index, future in enumerate(futures)}
+
+        def generate():
+            for future in as_completed(futures):
+                result, status_code = future.result()
+                yield jsoncodec.dumps_bytes({"index": indices[future], "status_code": status_code, "result": result}) + b"\n"
+            yield jsoncodec.dumps_bytes({"done": True, **summary.result()}) + b"\n"
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    outcomes = [future.result() for future in futures]
+    summary = summary.result()
+    summary["results"] = [
+        {"index": index, "status_code": status_code, "result": result}
+        for index, (result, status_code) in enumerate(outcomes)
+    ]
+    return jsonify(summary), 200
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
 
+@traced('generate_documentation')
 def generate_documentation(description, project_id):
     # Use ChatGPT to generate documentation based on the description
     try:
-        chatgpt_response = chatgpt({
+        chatgpt_response = internal_result(chatgpt({
             'action': 'generate_documentation',
             'description': description
-        })
+        }))
 
         if not isinstance(chatgpt_response, dict) or chatgpt_response.get('status') != 'OK':
             app.logger.error(f"Invalid response from ChatGPT: {chatgpt_response}")
@@ -0,0 +1,550 @@
+import asyncio
+import os
+import threading
+from functools import partial
+
+import requests
+from quart import Quart, Response, g, jsonify, request
+from quart.wrappers.response import DataBody
+
+import actions
+import app as fusion
+import metrics
+import tracing
+from tracing import traced
+from actions import ActionTable
+from cache import make_cache_key
+from jsoncodec import provider_for
+from pipeline import StageTimings
+from singleflight import AsyncSingleFlight
+from streaming import encode_event, parse_openai_line, stream_format
+from upstream import AsyncUpstreamClient
+
+# asyncio-native serving mode for the fusion endpoints. Shares project
+# state, the response cache and the request/response shaping with the
+# Flask app in app.py; only the I/O differs. Run with e.g.
+#   hypercorn 'asgi:create_asgi_app()' --workers 1
+#
+# The shared pieces are synchronous and may block: the project store and
+# job queue wait on SQLite locks or Redis round trips, the caches may be on
+# Redis, and budgeting tokenizes the input. They are called through
+# asyncio.to_thread so that one slow call never stalls the event loop and
+# every other request in flight.
+asgi_app = Quart(__name__)
+asgi_app.json = provider_for(asgi_app)
+
+inflight = AsyncSingleFlight()
+# Set by create_asgi_app()
+upstream_client = None
+_create_lock = threading.Lock()
+
+def create_asgi_app():
+    # Application factory: sets up the shared state (see app.create_app) and
+    # this mode's own upstream client, once per process
+    global upstream_client
+    fusion.create_app()
+    with _create_lock:
+        if upstream_client is None:
+            upstream_client = AsyncUpstreamClient.from_env()
+    return asgi_app
+
+@asgi_app.after_serving
+async def close_upstream_client():
+    await upstream_client.aclose()
+
+@asgi_app.before_request
+async def start_request_timer():
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    data = await request.get_json(silent=True)
+    g.request_timer = metrics.RequestTimer(route, fusion.metric_action(data)).start()
+    span = fusion.tracer.start_span(f"{request.method} {route}", 'server', request.headers.get('traceparent'), {
+        'http.request.method': request.method,
+        'http.route': route,
+        'fusion.action': fusion.metric_action(data) or None
+    })
+    g.request_span = span
+    g.request_span_token = tracing.activate(span)
+
+@asgi_app.after_request
+async def finish_request_timer(response):
+    # Streamed bodies are still being sent here; their time is not included
+    # in the timer or the span
+    timer = g.pop('request_timer', None)
+    if timer is not None:
+        timer.finish(response.status_code)
+    span = g.pop('request_span', None)
+    if span is not None:
+        response.headers[tracing.TRACE_HEADER] = span.trace_id
+        span.set_attribute('http.response.status_code', response.status_code)
+        if response.status_code >= 500:
+            span.set_error(f"HTTP {response.status_code}")
+        span.end()
+    return response
+
+@asgi_app.after_request
+async def compress_response(response):
+    # Only buffered bodies; streamed ones are sent as they are produced
+    if not isinstance(response.response, DataBody):
+        return response
+    data = await response.get_data()
+    return fusion.response_compressor.encode(response, data, request.headers.get('Accept-Encoding'))
+
+@asgi_app.teardown_request
+async def abandon_request_timer(exc):
+    timer = g.pop('request_timer', None)
+    if timer is not None:
+        timer.finish(500)
+    token = g.pop('request_span_token', None)
+    if token is not None:
+        tracing.deactivate(token)
+    span = g.pop('request_span', None)
+    if span is not None:
+        span.set_error(f"{type(exc).__name__}: {exc}" if exc is not None else "Request aborted")
+        span.end()
+
+async def cached_call(upstream, action, payload, fetch, near_match=None):
+    # See app.cached_call; near_match is a coroutine function here
+    key = make_cache_key(upstream, action, payload, payload.get('model'))
+    cacheable = fusion.response_cache.enabled and actions.cacheable(upstream, action)
+    headers = {}
+    if cacheable:
+        cached = await asyncio.to_thread(fusion.response_cache.get, key)
+        if cached is not None:
+            metrics.CACHE_REQUESTS.inc(upstream, action, 'hit')
+            return cached, 200, {"X-Cache": "HIT"}
+        metrics.CACHE_REQUESTS.inc(upstream, action, 'miss')
+        headers["X-Cache"] = "MISS"
+    if near_match is not None:
+        hit = await near_match()
+        if hit is not None:
+            return hit
+
+    async def fetch_and_store():
+        result, status_code = await fetch()
+        if cacheable and status_code == 200:
+            await asyncio.to_thread(fusion.response_cache.set, key, result)
+        return result, status_code
+
+    (result, status_code), shared = await inflight.do(key, fetch_and_store)
+    if shared:
+        metrics.COALESCED_REQUESTS.inc(upstream, action)
+        headers["X-Coalesced"] = "true"
+    return result, status_code, headers
+
+async def map_chunks(spec, call, inputs, data):
+    # Runs call over each input chunk concurrently and merges the results
+    # in order; see app.budget_input
+    if len(inputs) == 1:
+        result, status_code, headers = await call(inputs[0])
+        return result, status_code, {**headers, **fusion.budget_headers(inputs, data)}
+    results = await asyncio.gather(*(call(part) for part in inputs))
+    result, status_code = spec.merge([(r, s) for r, s, _ in results])
+    return result, status_code, fusion.budget_headers(inputs, data)
+
+@traced('chatgpt')
+async def run_chatgpt(data):
+    # Returns (result, status_code, headers) with the same contract as app.chatgpt
+    try:
+        if not isinstance(data, dict):
+            return {"status": "Error", "message": "Invalid input data"}, 400, {}
+
+        action = data.get('action')
+
+        if not fusion.CHATGPT_API_KEY:
+            return {"status": "Error", "message": "ChatGPT API key not configured"}, 500, {}
+
+        headers = fusion.upstream_headers(fusion.CHATGPT_API_KEY)
+        api_url = os.getenv('CHATGPT_API_URL', 'https://api.openai.com/v1/chat/completions')
+
+        spec = actions.CHATGPT_ACTIONS.get(action)
+        if spec is None:
+            return {"status": "Error", "message": "Invalid action for ChatGPT"}, 400, {}
+
+        inputs, error = await asyncio.to_thread(fusion.budget_input, spec, data)
+        if error:
+            return (*error, {})
+
+        async def call(part):
+            payload = spec.payload(part)
+
+            async def fetch():
+                response = await upstream_client.post('chatgpt', action, api_url, headers=headers, json=payload)
+                response.raise_for_status()
+                return fusion.chatgpt_result(action, response.json())
+
+            result, status_code, cache_headers = await cached_call(
+                'chatgpt', action, payload, fetch,
+                near_match=partial(asyncio.to_thread, fusion.semantic_lookup, spec, part))
+            await asyncio.to_thread(fusion.semantic_store, spec, part, result, status_code, cache_headers)
+            return result, status_code, cache_headers
+
+        return await map_chunks(spec, call, inputs, data)
+
+    except requests.exceptions.RequestException as e:
+        asgi_app.logger.error(f"Error in ChatGPT API request: {str(e)}")
+        failure = fusion.upstream_failure('ChatGPT', e)
+        if failure is not None:
+            return failure
+        return {"status": "Error", "message": "An error occurred while processing your request"}, 500, {}
+    except KeyError as e:
+        asgi_app.logger.error(f"Unexpected response format from ChatGPT API: {str(e)}")
+        return {"status": "Error", "message": "Unexpected response from ChatGPT API"}, 500, {}
+    except Exception as e:
+        asgi_app.logger.error(f"Unexpected error in ChatGPT API: {str(e)}")
+        return {"status": "Error", "message": "An unexpected error occurred"}, 500, {}
+
+async def stream_chatgpt(data):
+    # Token-streaming variant of run_chatgpt; see app.stream_chatgpt
+    action = data.get('action')
+    if not fusion.CHATGPT_API_KEY:
+        return jsonify({"status": "Error", "message": "ChatGPT API key not configured"}), 500
+
+    spec = actions.CHATGPT_ACTIONS.get(action)
+    inputs, error = await asyncio.to_thread(fusion.budget_input, spec, data, stream=True)
+    if error:
+        return jsonify(error[0]), error[1]
+    input_headers = fusion.budget_headers(inputs, data)
+    data = inputs[0]
+
+    headers = fusion.upstream_headers(fusion.CHATGPT_API_KEY)
+    api_url = os.getenv('CHATGPT_API_URL', 'https://api.openai.com/v1/chat/completions')
+    payload = spec.payload(data)
+    mimetype = stream_format(request.headers.get('Accept'))
+    project_id = data.get('project_id') if action == 'generate_documentation' else None
+    key = make_cache_key('chatgpt', action, payload, payload.get('model'))
+    cacheable = fusion.response_cache.enabled and actions.cacheable('chatgpt', action)
+
+    cached = await asyncio.to_thread(fusion.response_cache.get, key) if cacheable else None
+    if cacheable:
+        metrics.CACHE_REQUESTS.inc('chatgpt', action, 'hit' if cached is not None else 'miss')
+    if cached is not None:
+        async def replay():
+            yield encode_event(mimetype, {"type": "delta", "content": cached['content']})
+            if project_id:
+                await asyncio.to_thread(fusion.store_documentation, project_id, cached['documentation'])
+            yield encode_event(mimetype, {"type": "done", "result": cached})
+        return Response(replay(), mimetype=mimetype, headers={"X-Cache": "HIT", **input_headers})
+
+    try:
+        stream = await upstream_client.stream('chatgpt', action, api_url, headers=headers,
+                                              json={**payload, "stream": True})
+        stream.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        asgi_app.logger.error(f"Error in ChatGPT API request: {str(e)}")
+        failure = fusion.upstream_failure('ChatGPT', e)
+        if failure is not None:
+            result, status_code, headers = failure
+            return jsonify(result), status_code, headers
+        return jsonify({"status": "Error", "message": "An error occurred while processing your request"}), 500
+
+    async def generate():
+        parts = []
+        try:
+            async for line in stream.iter_lines():
+                done, content = parse_openai_line(line)
+                if done:
+                    break
+                if content:
+                    parts.append(content)
+                    yield encode_event(mimetype, {"type": "delta", "content": content})
+        except Exception as e:
+            asgi_app.logger.error(f"ChatGPT stream interrupted: {str(e)}")
+            yield encode_event(mimetype, {"type": "error", "message": "Upstream stream interrupted"})
+            return
+        finally:
+            stream.close()
+
+        result, _ = fusion.chatgpt_result(action, {'choices': [{'message': {'content': ''.join(parts)}}]})
+        if cacheable:
+            await asyncio.to_thread(fusion.response_cache.set, key, result)
+        if project_id:
+            await asyncio.to_thread(fusion.store_documentation, project_id, result['documentation'])
+        yield encode_event(mimetype, {"type": "done", "result": result})
+
+    cache_headers = {"X-Cache": "MISS"} if cacheable else {}
+    return Response(generate(), mimetype=mimetype, headers={**cache_headers, **input_headers})
+
+@traced('blackbox')
+async def run_blackbox(data):
+    # Returns (result, status_code, headers) with the same contract as app.blackbox_ai
+    if not fusion.CHATGPT_API_KEY or not fusion.BLACKBOX_API_KEY:
+        return {"status": "Error", "message": "API keys are not configured"}, 500, {}
+
+    action = data.get('action')
+
+    try:
+        headers = fusion.upstream_headers(fusion.BLACKBOX_API_KEY)
+        api_url = os.getenv('BLACKBOX_API_URL', 'https://www.useblackbox.io/api/v1')
+
+        spec = actions.BLACKBOX_ACTIONS.get(action)
+        if spec is None:
+            return {"status": "Error", "message": "Invalid action for Blackbox AI"}, 400, {}
+
+        inputs, error = await asyncio.to_thread(fusion.budget_input, spec, data)
+        if error:
+            return (*error, {})
+
+        async def call(part):
+            payload = spec.payload(part)
+
+            async def fetch():
+                url = fusion.blackbox_url(api_url, action)
+                response = await upstream_client.post('blackbox', action, url, headers=headers, json=payload)
+                response.raise_for_status()
+                return fusion.blackbox_result(action, response.json())
+
+            return await cached_call('blackbox', action, payload, fetch)
+
+        return await map_chunks(spec, call, inputs, data)
+
+    except requests.exceptions.RequestException as e:
+        asgi_app.logger.error(f"Error in Blackbox API request: {str(e)}")
+        failure = fusion.upstream_failure('Blackbox', e)
+        if failure is not None:
+            return failure
+        if isinstance(e, requests.exceptions.HTTPError):
+            return {"status": "Error", "message": f"Blackbox API error: {e.response.status_code}"}, e.response.status_code, {}
+        return {"status": "Error", "message": "An error occurred while processing your request"}, 500, {}
+    except Exception as e:
+        asgi_app.logger.error(f"Unexpected error in Blackbox AI endpoint: {str(e)}")
+        return {"status": "Error", "message": "An unexpected error occurred"}, 500, {}
+
+@asgi_app.route('/')
+async def health_check():
+    return jsonify({"status": "OK", "message": "AI Fusion API is running"})
+
+@asgi_app.route('/upstream/pools')
+async def upstream_pools():
+    return jsonify({"status": "OK", "pools": upstream_client.stats()})
+
+@asgi_app.route('/upstream/limits')
+async def upstream_limits():
+    return jsonify({"status": "OK", "limits": upstream_client.limits(), "resilience": upstream_client.resilience_stats()})
+
+@asgi_app.route('/metrics')
+async def metrics_endpoint():
+    return Response(await asyncio.to_thread(metrics.registry.render), content_type=metrics.CONTENT_TYPE)
+
+async def conditional_json(payload):
+    # Same contract as app.conditional_json
+    response = jsonify(payload)
+    tag = fusion.etag_for(await response.get_data())
+    matched = fusion.matching_etag(request.if_none_match, tag)
+    if matched is not None:
+        response = Response('', status=304)
+        response.vary.add('Accept-Encoding')
+        tag = matched
+    response.set_etag(tag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@asgi_app.route('/projects/<project_id>')
+async def get_project(project_id):
+    payload = await asyncio.to_thread(fusion.project_state, project_id)
+    if payload is None:
+        return jsonify({"status": "Error", "message": "Project not found"}), 404
+    return await conditional_json(payload)
+
+@asgi_app.route('/projects/<project_id>/documentation')
+async def get_project_documentation(project_id):
+    payload = await asyncio.to_thread(fusion.project_documentation, project_id)
+    if payload is None:
+        return jsonify({"status": "Error", "message": "Project not found"}), 404
+    return await conditional_json(payload)
+
+@asgi_app.route('/jobs/<job_id>')
+async def job_status(job_id):
+    job = fusion.clone_jobs.status(job_id) or await asyncio.to_thread(fusion.job_queue.get, job_id)
+    if job is None:
+        return jsonify({"status": "Error", "message": "Job not found"}), 404
+    return jsonify({"status": "OK", "job": job})
+
+@asgi_app.route('/chatgpt', methods=['POST'])
+async def chatgpt():
+    data = await request.get_json(force=True)
+    if isinstance(data, dict) and data.get('stream') and actions.streamable(data.get('action')):
+        return await stream_chatgpt(data)
+    result, status_code, headers = await run_chatgpt(data)
+    return jsonify(result), status_code, headers
+
+@asgi_app.route('/blackbox', methods=['POST'])
+async def blackbox_ai():
+    data = await request.get_json()
+    result, status_code, headers = await run_blackbox(data)
+    return jsonify(result), status_code, headers
+
+# Devin actions beyond fusion.PROJECT_ACTIONS: action -> coroutine taking
+# the request data
+DEVIN_ACTIONS = ActionTable('devin')
+
+@DEVIN_ACTIONS.register('integrate_git')
+async def devin_integrate_git(data):
+    project_id = data.get('project_id')
+    if await asyncio.to_thread(fusion.project_store.exists, project_id):
+        job_id, error = fusion.submit_clone(project_id, data)
+        if error:
+            return jsonify(error[0]), error[1]
+        if data.get('background'):
+            result, status_code = fusion.clone_accepted(job_id)
+            return jsonify(result), status_code
+        try:
+            await asyncio.wrap_future(fusion.clone_jobs.future(job_id))
+        except Exception:
+            pass
+        return jsonify(fusion.clone_result(fusion.clone_jobs.status(job_id)))
+    return jsonify({"status": "Error", "message": "Project not found"})
+
+@DEVIN_ACTIONS.register('interpret_command')
+async def devin_interpret_command(data):
+    project_id = data.get('project_id')
+    command = data.get('command')
+    if await asyncio.to_thread(fusion.project_store.exists, project_id):
+        try:
+            interpreted_action, _, _ = await run_chatgpt({"action": "interpret_command", "command": command})
+            return jsonify({"status": "OK", "message": "Command interpreted", "action": interpreted_action})
+        except Exception as e:
+            return jsonify({"status": "Error", "message": f"Failed to interpret command: {str(e)}"})
+    return jsonify({"status": "Error", "message": "Project not found"})
+
+@DEVIN_ACTIONS.register('generate_documentation')
+async def devin_generate_documentation(data):
+    project_id = data.get('project_id')
+    description = data.get('description')
+    if await asyncio.to_thread(fusion.project_store.exists, project_id):
+        if data.get('background'):
+            options, error = await asyncio.to_thread(fusion.job_options, data)
+            if error:
+                return jsonify({"status": "Error", "message": error}), 400
+            result, status_code = await asyncio.to_thread(
+                fusion.enqueue_job, 'generate_documentation', {'project_id': project_id, 'description': description},
+                options)
+            return jsonify(result), status_code
+        if data.get('stream'):
+            return await stream_chatgpt({
+                'action': 'generate_documentation',
+                'description': description,
+                'project_id': project_id
+            })
+        chatgpt_response, _, _ = await run_chatgpt({
+            'action': 'generate_documentation',
+            'description': description
+        })
+        if chatgpt_response.get('status') != 'OK' or not chatgpt_response.get('documentation'):
+            asgi_app.logger.error(f"Invalid response from ChatGPT: {chatgpt_response}")
+            return jsonify({"status": "Error", "message": "Failed to generate documentation"}), 500
+        result = {
+            "status": "OK",
+            "message": "Documentation generated",
+            "documentation": {
+                "status": "OK",
+                "message": "Documentation generated",
+                "documentation": chatgpt_response['documentation']
+            }
+        }
+        await asyncio.to_thread(fusion.project_store.update, project_id, documentation=result['documentation'])
+        return jsonify(result), 200
+    return jsonify({"status": "Error", "message": "Project not found"}), 404
+
+@asgi_app.route('/devin', methods=['POST'])
+async def devin_ai():
+    data = await request.get_json()
+    action = data.get('action')
+
+    local = await asyncio.to_thread(fusion.project_action, action, data)
+    if local is not None:
+        result, status_code = local
+        return jsonify(result), status_code
+
+    handler = DEVIN_ACTIONS.get(action)
+    if handler is None:
+        return jsonify({"status": "Error", "message": "Invalid action for Devin AI"})
+    return await handler(data)
+
+@asgi_app.route('/integrate', methods=['POST'])
+async def integrate_ai():
+    data = await request.get_json()
+    project_id = data.get('project_id')
+    code_description = data.get('code_description')
+    project_store = fusion.project_store
+
+    if not project_id or not code_description:
+        return jsonify({"status": "Error", "message": "Missing project_id or code_description"}), 400
+
+    options = None
+    if data.get('background'):
+        options, error = await asyncio.to_thread(fusion.job_options, data)
+        if error:
+            return jsonify({"status": "Error", "message": error}), 400
+
+    try:
+        timings = StageTimings()
+        task_id = await asyncio.to_thread(project_store.append_task, project_id, f"Implement: {code_description}")
+        if task_id is None:
+            return jsonify({"status": "Error", "message": "Project not found"}), 404
+
+        if options is not None:
+            result, status_code = await asyncio.to_thread(fusion.enqueue_job, 'integrate', {
+                'project_id': project_id,
+                'task_id': task_id,
+                'code_description': code_description,
+                'speculative': bool(data.get('speculative', False))
+            }, options)
+            return jsonify({**result, "task_id": task_id}), status_code
+
+        if data.get('speculative'):
+            # Streamed generation overlapped with per-block optimization runs
+            # on the Flask app's staged pools (see app.integrate_code)
+            result, status_code = await asyncio.to_thread(
+                fusion.finish_integration, project_id, task_id, code_description, True)
+            return jsonify(result), status_code
+
+        with timings.measure('generate'):
+            chatgpt_data, _, _ = await run_chatgpt({
+                'action': 'generate_code',
+                'language': 'python',
+                'description': code_description
+            })
+        if chatgpt_data.get('status') != 'OK':
+            asgi_app.logger.error(f"ChatGPT error: {chatgpt_data.get('message')}")
+            return jsonify({"status": "Error", "message": "Failed to generate code"}), 500
+        generated_code = chatgpt_data.get('code')
+        if not generated_code:
+            asgi_app.logger.error("No code generated by ChatGPT")
+            return jsonify({"status": "Error", "message": "No code generated by ChatGPT"}), 500
+
+        try:
+            with timings.measure('optimize'):
+                blackbox_data, _, _ = await run_blackbox({
+                    'action': 'optimize_code',
+                    'code': generated_code,
+                    'optimization_level': 'medium'
+                })
+            if blackbox_data.get('status') != 'OK':
+                asgi_app.logger.warning(f"Blackbox AI optimization failed: {blackbox_data}")
+                optimized_code = generated_code
+                optimization_error = blackbox_data.get('message') or "Blackbox AI optimization failed"
+            else:
+                optimized_code = blackbox_data.get('optimized_code', generated_code)
+                optimization_error = None
+        except Exception as e:
+            asgi_app.logger.error(f"Error in Blackbox AI optimization: {str(e)}")
+            optimized_code = generated_code
+            optimization_error = "Blackbox AI optimization failed"
+
+        progress = await asyncio.to_thread(project_store.increment_progress, project_id, 10)
+        project = await asyncio.to_thread(project_store.get, project_id)
+
+        return jsonify({
+            "status": "OK",
+            "message": "Integrated AI task completed",
+            "generated_code": generated_code,
+            "optimized_code": optimized_code,
+            "optimization_error": optimization_error,
+            "project_progress": progress,
+            "task_count": project['task_count'],
+            "task_id": task_id,
+            "timings": timings.as_dict()
+        }), 200
+    except Exception as e:
+        asgi_app.logger.error(f"Error in integrate_ai: {str(e)}")
+        return jsonify({"status": "Error", "message": "An unexpected error occurred"}), 500
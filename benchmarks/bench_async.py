@@ -0,0 +1,190 @@
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+
+# Compares the synchronous Flask app (app.py) with the asyncio serving mode
+# (asgi.py) against a local mock upstream with fixed latency.
+#
+#   python -m benchmarks.bench_async --latency 0.2 --concurrency 64 256 --requests 1000
+#
+# The sync server runs a bounded thread pool (--sync-threads), which is what
+# caps concurrency for a threaded WSGI worker in production.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+def serve_sync(port, threads):
+    from werkzeug.serving import BaseWSGIServer
+    from app import create_app
+    app = create_app()
+
+    class PooledWSGIServer(BaseWSGIServer):
+        request_queue_size = 4096
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.executor = ThreadPoolExecutor(max_workers=threads)
+
+        def process_request(self, request, client_address):
+            self.executor.submit(self._handle, request, client_address)
+
+        def _handle(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    PooledWSGIServer('127.0.0.1', port, app).serve_forever()
+
+
+def server_env(upstream_port, sync_threads):
+    env = dict(os.environ)
+    env.update({
+        'CHATGPT_API_KEY': 'bench',
+        'BLACKBOX_API_KEY': 'bench',
+        'CHATGPT_API_URL': f'http://127.0.0.1:{upstream_port}/v1/chat/completions',
+        'BLACKBOX_API_URL': f'http://127.0.0.1:{upstream_port}/v1',
+        'RESPONSE_CACHE_BACKEND': 'none',
+        'UPSTREAM_POOL_MAXSIZE': str(sync_threads),
+    })
+    return env
+
+
+def start_server(mode, port, env, sync_threads):
+    if mode == 'sync':
+        cmd = [sys.executable, '-m', 'benchmarks.bench_async', '--serve-sync', str(port),
+               '--sync-threads', str(sync_threads)]
+    else:
+        cmd = [sys.executable, '-m', 'hypercorn', 'asgi:create_asgi_app()', '-b', f'127.0.0.1:{port}',
+               '--backlog', '4096', '--log-level', 'warning']
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+    return proc
+
+
+def start_upstream(port, latency, *options):
+    # options are extra mock_upstream flags, e.g. '--error-rate', '0.01'
+    cmd = [sys.executable, '-m', 'benchmarks.mock_upstream', '--port', str(port), '--latency', str(latency), *options]
+    proc = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+    return proc
+
+
+def request_for(endpoint, i):
+    if endpoint == '/chatgpt':
+        return {'action': 'generate_code', 'language': 'python', 'description': f'benchmark task {i}'}
+    return {'action': 'analyze_complexity', 'code': f'def f{i}(n):\n    return n'}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def drive(base_url, endpoint, concurrency, total, payload_for=request_for):
+    # payload_for(endpoint, i) builds the JSON body of request number i
+    latencies = []
+    statuses = {}
+    errors = 0
+    counter = iter(range(total))
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=120)
+
+    async with aiohttp.ClientSession(base_url=base_url, connector=connector, timeout=timeout) as client:
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                started = time.perf_counter()
+                try:
+                    async with client.post(endpoint, json=payload_for(endpoint, i)) as response:
+                        await response.read()
+                        status = str(response.status)
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    status = 'error'
+                statuses[status] = statuses.get(status, 0) + 1
+                if status != '200':
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'rps': total / elapsed,
+        'p50': percentile(latencies, 50) * 1000,
+        'p95': percentile(latencies, 95) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+        'errors': errors,
+        'statuses': statuses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync (Flask) vs async (ASGI) serving benchmark")
+    parser.add_argument('--latency', type=float, default=0.2, help="mock upstream latency in seconds")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[32, 256])
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--sync-threads', type=int, default=32)
+    parser.add_argument('--endpoints', nargs='+', default=['/chatgpt', '/blackbox'])
+    parser.add_argument('--modes', nargs='+', default=['sync', 'async'], choices=['sync', 'async'])
+    parser.add_argument('--serve-sync', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_sync:
+        serve_sync(args.serve_sync, args.sync_threads)
+        return
+
+    upstream_port = free_port()
+    upstream = start_upstream(upstream_port, args.latency)
+    try:
+        env = server_env(upstream_port, args.sync_threads)
+        print(f"{'mode':<6} {'endpoint':<10} {'conc':>5} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>6}")
+        for mode in args.modes:
+            port = free_port()
+            server = start_server(mode, port, env, args.sync_threads)
+            try:
+                for endpoint in args.endpoints:
+                    for concurrency in args.concurrency:
+                        stats = asyncio.run(drive(f'http://127.0.0.1:{port}', endpoint, concurrency, args.requests))
+                        print(f"{mode:<6} {endpoint:<10} {concurrency:>5} {stats['rps']:>9.1f} {stats['p50']:>9.1f} "
+                              f"{stats['p95']:>9.1f} {stats['p99']:>9.1f} {stats['errors']:>6}")
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        upstream.terminate()
+        upstream.wait()
+
+
+if __name__ == '__main__':
+    main()
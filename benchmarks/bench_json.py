@@ -0,0 +1,90 @@
+import argparse
+import json
+import random
+import string
+import timeit
+
+from flask import Flask
+
+import jsoncodec
+
+# Encode/decode cost of representative large responses with Flask's stdlib
+# provider versus the jsoncodec provider the app uses.
+#
+#   python -m benchmarks.bench_json --size 1
+
+
+def _code(lines, rng):
+    body = []
+    for i in range(lines):
+        name = ''.join(rng.choices(string.ascii_lowercase, k=8))
+        body.append(f"    result_{i} = {name}(value, {i})  # step {i}: déjà vu → ✓")
+    return "def generated(value):\n" + "\n".join(body) + "\n    return value\n"
+
+
+def payloads(size, seed=1):
+    rng = random.Random(seed)
+    code = _code(800 * size, rng)
+    return {
+        'integrate': {
+            "status": "OK",
+            "message": "Integrated AI task completed",
+            "generated_code": code,
+            "optimized_code": code.replace('value', 'v'),
+            "optimization_error": None,
+            "project_progress": 40,
+            "task_count": 4,
+            "task_id": 17,
+            "timings": {"stages": {"generate": {"queued_ms": 0.2, "run_ms": 812.5},
+                                   "optimize": {"queued_ms": 0.1, "run_ms": 301.7}}, "total_ms": 1114.9}
+        },
+        'documentation': {
+            "status": "OK",
+            "message": "Documentation generated",
+            "documentation": {"status": "OK", "message": "Documentation generated",
+                              "documentation": "\n\n".join(f"## Section {i}\n" + _code(20, rng) for i in range(40 * size))}
+        },
+        'task_page': {
+            "status": "OK",
+            "tasks": [{"task_id": i, "task": {"description": f"Implement: feature {i}", "assignee": None,
+                                               "tags": ["generated", "integrate"], "estimate": rng.random() * 8}}
+                      for i in range(1000 * size)],
+            "next_cursor": 1000 * size,
+            "has_more": True
+        },
+    }
+
+
+def measure(fn, repeat=5):
+    # Best seconds per call
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON provider benchmark")
+    parser.add_argument('--size', type=int, default=1, help="payload size multiplier")
+    args = parser.parse_args()
+
+    stdlib_app = Flask('stdlib')
+    fast_app = Flask('fast')
+    fast_app.json = jsoncodec.provider_for(fast_app)
+    print(f"backend: {jsoncodec.BACKEND}")
+    print(f"{'payload':<14} {'KiB':>8} {'op':<8} {'stdlib us':>11} {'fast us':>11} {'speedup':>8}")
+    for name, payload in payloads(args.size).items():
+        encoded = json.dumps(payload).encode('utf-8')
+        cases = {
+            'response': (lambda: stdlib_app.json.response(payload), lambda: fast_app.json.response(payload)),
+            'dumps': (lambda: stdlib_app.json.dumps(payload), lambda: fast_app.json.dumps(payload)),
+            'loads': (lambda: stdlib_app.json.loads(encoded), lambda: fast_app.json.loads(encoded)),
+        }
+        with stdlib_app.app_context(), fast_app.app_context():
+            for op, (baseline, fast) in cases.items():
+                slow_s, fast_s = measure(baseline), measure(fast)
+                print(f"{name:<14} {len(encoded) / 1024:>8.1f} {op:<8} {slow_s * 1e6:>11.1f} {fast_s * 1e6:>11.1f} "
+                      f"{slow_s / fast_s:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
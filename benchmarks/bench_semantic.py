@@ -0,0 +1,68 @@
+import argparse
+import random
+import time
+
+import semantic
+from semantic import SemanticIndex, embed
+
+# Lookup cost of the semantic cache index as it grows, with the numpy matrix
+# and the pure-Python fallback.
+#
+#   python -m benchmarks.bench_semantic --sizes 1000 10000 100000 1000000
+#
+# The index is filled with random sparse unit vectors shaped like real
+# embeddings (about 40 non-zero weights); lookups use embedded questions.
+# Both backends are measured up to the largest size; --python-max caps the
+# pure-Python index, whose fill alone takes minutes at 1M entries.
+
+WORDS = ('list dict string parse sort reverse merge file json http request retry cache thread async '
+         'queue socket regex date time number float integer class function module test error').split()
+
+
+def random_vector(rng, dim, nonzero=40):
+    indices = rng.sample(range(dim), nonzero)
+    weights = [rng.gauss(0.0, 1.0) for _ in indices]
+    norm = sum(w * w for w in weights) ** 0.5
+    return {index: weight / norm for index, weight in zip(indices, weights)}
+
+
+def fill(index, size, rng):
+    # Grows index to size entries, ten scopes
+    for i in range(len(index), size):
+        index.add(random_vector(rng, index.dim), i % 10, b'{"answer":"cached"}')
+
+
+def measure(index, queries):
+    started = time.perf_counter()
+    for query in queries:
+        index.search(query, 0, 0.9)
+    return (time.perf_counter() - started) / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Semantic cache lookup benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--python-max', type=int, default=None, help="largest size to measure without numpy")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    queries = [embed(' '.join(rng.sample(WORDS, 6)), args.dim) for _ in range(args.queries)]
+    sizes = sorted(args.sizes)
+    backends = ['numpy', 'python'] if semantic.load_numpy() is not None else ['python']
+    print(f"{'backend':<8} {'entries':>9} {'fill s':>8} {'lookup ms':>10}")
+    for backend in backends:
+        index = SemanticIndex(dim=args.dim, max_entries=sizes[-1], max_bytes=1 << 40, use_numpy=backend == 'numpy')
+        for size in sizes:
+            if backend == 'python' and args.python_max is not None and size > args.python_max:
+                break
+            started = time.perf_counter()
+            fill(index, size, rng)
+            filled = time.perf_counter() - started
+            print(f"{backend:<8} {size:>9} {filled:>8.1f} {measure(index, queries) * 1e3:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
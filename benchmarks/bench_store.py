@@ -0,0 +1,100 @@
+import argparse
+import collections
+import os
+import tempfile
+import threading
+import time
+
+from store import MemoryProjectStore, SQLiteProjectStore, VersionConflict
+
+# Throughput of concurrent /devin and /integrate style writes against the
+# project store: striped per-project locks against one global lock
+# (stripes=1), and the SQLite store for reference.
+#
+#   python -m benchmarks.bench_store --threads 16 --projects 1 16 --ops 2000
+#
+# Every thread mixes task appends, progress bumps, compare-and-swap updates
+# and reads; afterwards each project is checked for lost updates.
+
+
+def cas_increment(store, project_id):
+    # Read-modify-write of a counter kept in documentation; returns the
+    # number of conflicts it retried through
+    conflicts = 0
+    while True:
+        project = store.get(project_id)
+        try:
+            store.update(project_id, expected_version=project['version'],
+                         documentation=(project['documentation'] or 0) + 1)
+            return conflicts
+        except VersionConflict:
+            conflicts += 1
+
+
+def hammer(store, threads=16, ops=500, projects=1):
+    # Runs threads x ops mixed writes spread over projects. Returns
+    # {'ops_per_sec', 'conflicts', 'lost'}; lost counts updates missing from
+    # the final state and must be 0.
+    project_ids = [store.create(f"Stress {i}") for i in range(projects)]
+    expected = collections.Counter()
+    conflicts = []
+    start = threading.Barrier(threads + 1)
+
+    def work(worker):
+        done, retried = collections.Counter(), 0
+        start.wait()
+        for i in range(ops):
+            project_id = project_ids[(worker + i) % projects]
+            store.append_task(project_id, f"{worker}-{i}")
+            store.increment_progress(project_id, 1, limit=1 << 62)
+            retried += cas_increment(store, project_id)
+            store.get(project_id)
+            done[project_id] += 1
+        conflicts.append(retried)
+        expected.update(done)
+
+    workers = [threading.Thread(target=work, args=(w,)) for w in range(threads)]
+    for worker in workers:
+        worker.start()
+    start.wait()
+    started = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    lost = 0
+    for project_id in project_ids:
+        project = store.get(project_id)
+        want = expected[project_id]
+        lost += abs(want - project['task_count']) + abs(want - project['progress'])
+        lost += abs(want - (project['documentation'] or 0))
+    # Each operation above is four store calls
+    return {'ops_per_sec': threads * ops * 4 / elapsed, 'conflicts': sum(conflicts), 'lost': lost}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Project store contention benchmark")
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--projects', type=int, nargs='+', default=[1, 16])
+    parser.add_argument('--ops', type=int, default=2000)
+    parser.add_argument('--stripes', type=int, default=64)
+    parser.add_argument('--sqlite', action='store_true', help="also measure the SQLite store")
+    args = parser.parse_args()
+
+    stores = [('global lock', lambda: MemoryProjectStore(stripes=1)),
+              (f"{args.stripes} stripes", lambda: MemoryProjectStore(stripes=args.stripes))]
+    if args.sqlite:
+        tmp = tempfile.mkdtemp()
+        stores.append(('sqlite', lambda: SQLiteProjectStore(os.path.join(tmp, f"{time.time_ns()}.sqlite3"))))
+    print(f"{'store':<12} {'projects':>8} {'ops/s':>10} {'conflicts':>10} {'lost':>5}")
+    for projects in args.projects:
+        for name, make_store in stores:
+            store = make_store()
+            result = hammer(store, args.threads, args.ops, projects)
+            store.close()
+            print(f"{name:<12} {projects:>8} {result['ops_per_sec']:>10.0f} {result['conflicts']:>10} "
+                  f"{result['lost']:>5}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+import urllib.request
+
+from benchmarks.bench_async import ROOT, free_port
+
+# Import-time budget for the serving entry points, measured with
+# python -X importtime in a fresh interpreter per module.
+#
+#   python -m benchmarks.importtime              # check budgets, exit 1 on failure
+#   python -m benchmarks.importtime --top 15 --first-health
+#
+# Besides a cumulative budget in ms, each module has imports it must not
+# pull in eagerly: integrations that only some requests need are loaded on
+# first use, and bootstrap must answer health checks before Flask loads.
+# Budgets are generous for CI noise; the forbidden lists are what catches
+# a regression deterministically.
+
+BUDGETS = {
+    'bootstrap': {'budget_ms': 60, 'forbidden': ('flask', 'quart', 'requests', 'app')},
+    'app': {'budget_ms': 600, 'forbidden': ('git', 'aiohttp', 'quart', 'hypercorn', 'numpy', 'tiktoken')},
+}
+
+_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)\s*$')
+
+
+def measure(module, env=None):
+    # Returns ([(name, self_us, cumulative_us, depth)], total_ms) for a cold
+    # import of module. Rows are module and everything it imported (which
+    # includes failed optional imports), without interpreter startup.
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT, env=env or _env(), capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            depth = (len(indent) - 1) // 2
+            if depth == 0 and name != module:
+                # Startup imports; module's own subtree comes after them
+                rows = []
+            else:
+                rows.append((name, int(self_us), int(cumulative_us), depth))
+            if depth == 0 and name == module:
+                break
+    return rows, rows[-1][2] / 1000 if rows else 0.0
+
+
+def _env():
+    env = dict(os.environ)
+    env.setdefault('CHATGPT_API_KEY', 'importtime')
+    env.setdefault('BLACKBOX_API_KEY', 'importtime')
+    return env
+
+
+def imported(rows):
+    return {name for name, _, _, _ in rows}
+
+
+def check(module, budget_ms, forbidden, rows=None, total_ms=None):
+    # Returns a list of failure messages, empty when module is within budget
+    if rows is None:
+        rows, total_ms = measure(module)
+    names = imported(rows)
+    failures = [f"{module} imports {name} eagerly" for name in forbidden if name in names]
+    if total_ms > budget_ms:
+        failures.append(f"{module} took {total_ms:.0f}ms to import (budget {budget_ms}ms)")
+    return failures
+
+
+def top(rows, count):
+    # Packages with the highest cumulative time, outermost first
+    seen, out = set(), []
+    for name, _, cumulative, _ in sorted(rows, key=lambda row: -row[2]):
+        root = name.split('.')[0]
+        if root in seen:
+            continue
+        seen.add(root)
+        out.append((name, cumulative / 1000))
+        if len(out) == count:
+            break
+    return out
+
+
+def first_health(factory, timeout=30.0):
+    # Seconds from spawning a WSGI worker serving factory() until GET /
+    # returns 200
+    port = free_port()
+    code = ("import bootstrap, wsgiref.simple_server as s; "
+            f"s.make_server('127.0.0.1', {port}, {factory}).serve_forever()")
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', code], cwd=ROOT, env=_env(),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.005)
+        raise RuntimeError(f"{factory} never became healthy")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time budget check")
+    parser.add_argument('modules', nargs='*', default=list(BUDGETS))
+    parser.add_argument('--top', type=int, default=8, help="show the slowest packages per module")
+    parser.add_argument('--first-health', action='store_true',
+                        help="also time spawn to first 200 on / for bootstrap and the plain app")
+    args = parser.parse_args()
+
+    failures = []
+    for module in args.modules:
+        rows, total_ms = measure(module)
+        limits = BUDGETS.get(module, {'budget_ms': float('inf'), 'forbidden': ()})
+        print(f"{module}: {total_ms:.1f}ms (budget {limits['budget_ms']}ms)")
+        for name, ms in top(rows, args.top):
+            print(f"  {ms:8.1f}ms  {name}")
+        failures += check(module, limits['budget_ms'], limits['forbidden'], rows, total_ms)
+
+    if args.first_health:
+        for factory in ('bootstrap.create_app()', 'bootstrap.load_flask_app()'):
+            print(f"first 200 on / with {factory}: {first_health(factory) * 1000:.0f}ms")
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
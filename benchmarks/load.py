@@ -0,0 +1,178 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+import aiohttp
+
+from benchmarks.bench_async import drive, free_port, server_env, start_server, start_upstream
+
+# Load test of the service itself against a local mock upstream, which can
+# add latency jitter, 500s and 429s. Drives /chatgpt, /blackbox, /integrate
+# and /devin at each concurrency level and reports throughput, latency
+# percentiles, non-200 responses and the server's memory.
+#
+#   python -m benchmarks.load --requests 500 --save-baseline benchmarks/baseline.json
+#   python -m benchmarks.load --requests 500 --baseline benchmarks/baseline.json
+#
+# With --baseline the run exits with status 1 when any scenario regressed by
+# more than --tolerance against the saved results. Baselines are only
+# comparable on the same machine with the same options.
+
+ENDPOINTS = ['/chatgpt', '/blackbox', '/integrate', '/devin']
+
+# Per-scenario metrics where a larger value is a regression
+LOWER_IS_BETTER = ('p50', 'p95', 'p99', 'peak_rss_mb')
+
+
+def _process_tree(pid):
+    # pid and its descendants (hypercorn serves from worker processes)
+    pids = [pid]
+    for parent in pids:
+        try:
+            for tid in os.listdir(f'/proc/{parent}/task'):
+                with open(f'/proc/{parent}/task/{tid}/children') as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def server_memory(pid):
+    # (current, peak) resident set size of a server's processes in MiB,
+    # from procfs; (None, None) where that is not available
+    totals = {}
+    for process in _process_tree(pid):
+        try:
+            with open(f'/proc/{process}/status') as f:
+                for line in f:
+                    name, _, value = line.partition(':')
+                    if name in ('VmRSS', 'VmHWM'):
+                        totals[name] = totals.get(name, 0.0) + int(value.split()[0]) / 1024
+        except OSError:
+            pass
+    return totals.get('VmRSS'), totals.get('VmHWM')
+
+
+async def create_project(base_url):
+    async with aiohttp.ClientSession() as client:
+        async with client.post(f'{base_url}/devin', json={'action': 'create_project', 'name': 'Load test'}) as response:
+            return (await response.json())['project_id']
+
+
+def payloads(project_id):
+    def payload_for(endpoint, i):
+        if endpoint == '/chatgpt':
+            return {'action': 'generate_code', 'language': 'python', 'description': f'load test task {i}'}
+        if endpoint == '/blackbox':
+            return {'action': 'analyze_complexity', 'code': f'def f{i}(n):\n    return n'}
+        if endpoint == '/integrate':
+            return {'project_id': project_id, 'code_description': f'load test function {i}'}
+        return {'action': 'add_task', 'project_id': project_id, 'task': f'load test task {i}'}
+    return payload_for
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    # Returns one message per metric that regressed against the baseline
+    regressions = []
+    for key, row in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if row['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append(f"{key}: rps {row['rps']:.1f} < baseline {base['rps']:.1f}")
+        for metric in LOWER_IS_BETTER:
+            value, reference = row.get(metric), base.get(metric)
+            if value is None or reference is None:
+                continue
+            slack = min_delta_ms if metric.startswith('p') else 0.0
+            if value > reference * (1 + tolerance) + slack:
+                regressions.append(f"{key}: {metric} {value:.1f} > baseline {reference:.1f}")
+        if row['error_rate'] > base['error_rate'] + 0.01:
+            regressions.append(f"{key}: error rate {row['error_rate']:.3f} > baseline {base['error_rate']:.3f}")
+    return regressions
+
+
+def run(args):
+    upstream_port = free_port()
+    upstream = start_upstream(
+        upstream_port, args.latency,
+        '--jitter', str(args.jitter), '--error-rate', str(args.error_rate),
+        '--throttle-rate', str(args.throttle_rate), '--seed', str(args.seed))
+    results = {}
+    try:
+        env = server_env(upstream_port, args.sync_threads)
+        for mode in args.modes:
+            port = free_port()
+            server = start_server(mode, port, env, args.sync_threads)
+            base_url = f'http://127.0.0.1:{port}'
+            try:
+                payload_for = payloads(asyncio.run(create_project(base_url)))
+                for endpoint in args.endpoints:
+                    for concurrency in args.concurrency:
+                        stats = asyncio.run(drive(base_url, endpoint, concurrency, args.requests, payload_for))
+                        rss, peak = server_memory(server.pid)
+                        stats.update(error_rate=stats['errors'] / args.requests, rss_mb=rss, peak_rss_mb=peak)
+                        results[f"{mode} {endpoint} c{concurrency}"] = stats
+                        print_row(f"{mode} {endpoint} c{concurrency}", stats)
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        upstream.terminate()
+        upstream.wait()
+    return results
+
+
+def print_row(key, stats):
+    memory = f"{stats['rss_mb']:.1f}/{stats['peak_rss_mb']:.1f}" if stats['rss_mb'] is not None else 'n/a'
+    statuses = ','.join(f"{status}:{count}" for status, count in sorted(stats['statuses'].items()) if status != '200')
+    print(f"{key:<28} {stats['rps']:>9.1f} {stats['p50']:>9.1f} {stats['p95']:>9.1f} {stats['p99']:>9.1f} "
+          f"{memory:>13} {statuses or '-'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test against a local mock upstream")
+    parser.add_argument('--latency', type=float, default=0.05, help="mock upstream latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.02, help="extra random upstream latency in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of upstream calls failing with 500")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="fraction of upstream calls answered 429")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[8, 64])
+    parser.add_argument('--requests', type=int, default=500, help="requests per scenario")
+    parser.add_argument('--sync-threads', type=int, default=32)
+    parser.add_argument('--endpoints', nargs='+', default=ENDPOINTS, choices=ENDPOINTS)
+    parser.add_argument('--modes', nargs='+', default=['sync'], choices=['sync', 'async'])
+    parser.add_argument('--baseline', help="saved results to compare against")
+    parser.add_argument('--save-baseline', metavar='PATH', help="write this run's results to PATH")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument('--min-delta-ms', type=float, default=5.0,
+                        help="latency increases smaller than this are never regressions")
+    args = parser.parse_args()
+
+    config = {name: getattr(args, name) for name in ('latency', 'jitter', 'error_rate', 'throttle_rate', 'requests')}
+    print(f"{'scenario':<28} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rss/peak MiB':>13} non-200")
+    results = run(args)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'config': config, 'results': results}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != config:
+            print(f"Warning: baseline was recorded with {baseline.get('config')}")
+        regressions = compare(results, baseline['results'], args.tolerance, args.min_delta_ms)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+
+if __name__ == '__main__':
+    main()
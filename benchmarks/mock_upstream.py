@@ -0,0 +1,129 @@
+import argparse
+import asyncio
+import json
+import random
+
+# Minimal asyncio HTTP/1.1 server that impersonates the OpenAI chat
+# completions API and the Blackbox search/optimize/analyze API with a
+# configurable response latency. Keeps connections alive so the service
+# under test can exercise its connection pools. A fraction of requests can
+# be failed with a 500 (--error-rate) or throttled with a 429 and a
+# Retry-After header (--throttle-rate).
+
+
+def _body_for(path, payload):
+    if path.endswith('/chat/completions'):
+        prompt = payload.get('messages', [{}])[-1].get('content', '')
+        return {"choices": [{"message": {"role": "assistant", "content": f"# mock completion\n# {prompt[:80]}\npass\n"}}]}
+    if path.endswith('/search'):
+        return {"code": f"def mock_search():\n    return {payload.get('query', '')!r}\n"}
+    if path.endswith('/optimize'):
+        return {"optimized_code": payload.get('code', '')}
+    if path.endswith('/analyze'):
+        return {"analysis": "O(n)"}
+    return None
+
+
+class MockUpstream:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=1, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                raw = await reader.readexactly(int(headers.get('content-length', 0)))
+                self.requests += 1
+
+                delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+                if delay:
+                    await asyncio.sleep(delay)
+                payload = json.loads(raw) if raw else {}
+                status, body, extra_headers = self.respond(method, path, payload)
+                if status.startswith('200') and payload.get('stream') and 'choices' in body:
+                    await self.write_stream(writer, body['choices'][0]['message']['content'])
+                    continue
+                data = json.dumps(body).encode('utf-8')
+                head = ''.join(f"{name}: {value}\r\n" for name, value in extra_headers.items())
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n{head}"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode('latin-1') + data
+                )
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def write_stream(self, writer, content):
+        # OpenAI-style SSE completion stream, one chunk per line of content
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+        for token in content.splitlines(keepends=True) + [None]:
+            if token is None:
+                event = b"data: [DONE]\n\n"
+            else:
+                chunk = {"choices": [{"delta": {"content": token}}]}
+                event = f"data: {json.dumps(chunk)}\n\n".encode('utf-8')
+            writer.write(f"{len(event):x}\r\n".encode('latin-1') + event + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    def respond(self, method, path, payload):
+        # Returns (status line, JSON body, extra headers)
+        body = _body_for(path, payload) if method == 'POST' else None
+        if body is None:
+            return '404 Not Found', {"error": "not found"}, {}
+        draw = self.random.random()
+        if draw < self.throttle_rate:
+            self.throttled += 1
+            return '429 Too Many Requests', {"error": {"message": "Rate limit reached"}}, {"Retry-After": str(self.retry_after)}
+        if draw < self.throttle_rate + self.error_rate:
+            self.errors += 1
+            return '500 Internal Server Error', {"error": {"message": "Injected failure"}}, {}
+        return '200 OK', body, {}
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port, backlog=4096)
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI/Blackbox upstream")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--latency', type=float, default=0.2, help="seconds per response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="extra random latency, up to this many seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with a 500")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="fraction of requests answered with a 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After seconds sent with a 429")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    upstream = MockUpstream(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                            throttle_rate=args.throttle_rate, retry_after=args.retry_after, seed=args.seed)
+    asyncio.run(upstream.serve(args.host, args.port))
+
+
+if __name__ == '__main__':
+    main()
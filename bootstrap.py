@@ -0,0 +1,149 @@
+import json
+import threading
+
+# Fast cold start for autoscaled workers. The factories below return a
+# server entry point that imports nothing heavy: the full application is
+# imported and built by app.create_app() or asgi.create_asgi_app() (Flask or
+# Quart, requests, the upstream clients, stores and pools) on a background
+# thread while the worker already answers the "/" health check. Every other
+# request waits for the load, then goes to the real app.
+#
+#   gunicorn 'bootstrap:create_app()'
+#   hypercorn 'bootstrap:create_asgi_app()'
+#
+# Call the factory in the serving process (gunicorn without --preload, or
+# any hypercorn/uvicorn worker): a load in progress does not survive fork.
+# benchmarks/importtime.py checks the import-time budgets.
+
+HEALTH_BODY = json.dumps({"status": "OK", "message": "AI Fusion API is running"}).encode('utf-8')
+LOAD_FAILED_BODY = json.dumps({"status": "Error", "message": "AI Fusion API failed to load"}).encode('utf-8')
+
+
+def is_health_check(method, path):
+    return method == 'GET' and path in ('', '/')
+
+
+def health(loader):
+    # (status, body) for a health check answered before the app is up. A
+    # failed load reports 503 so the orchestrator replaces the worker
+    # instead of routing traffic to it.
+    if loader.error is not None:
+        return 503, LOAD_FAILED_BODY
+    return 200, HEALTH_BODY
+
+
+def load_flask_app():
+    from app import create_app
+    return create_app()
+
+
+def load_quart_app():
+    from asgi import create_asgi_app
+    return create_asgi_app()
+
+
+class LazyLoader:
+    # Runs load() once on a background thread; wait() blocks until it is
+    # done and re-raises its error
+
+    def __init__(self, load):
+        self._load = load
+        self._lock = threading.Lock()
+        self._started = False
+        self._ready = threading.Event()
+        self.app = None
+        self.error = None
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._run, name='app-loader', daemon=True).start()
+
+    def _run(self):
+        try:
+            self.app = self._load()
+        except BaseException as e:
+            self.error = e
+        finally:
+            self._ready.set()
+
+    def wait(self):
+        self.start()
+        self._ready.wait()
+        if self.error is not None:
+            raise self.error
+        return self.app
+
+
+class LazyWSGIApp:
+    def __init__(self, load=load_flask_app, preload=True):
+        self.loader = LazyLoader(load)
+        if preload:
+            self.loader.start()
+
+    def __call__(self, environ, start_response):
+        app = self.loader.app
+        if app is None:
+            if is_health_check(environ.get('REQUEST_METHOD'), environ.get('PATH_INFO', '')):
+                status, body = health(self.loader)
+                start_response('200 OK' if status == 200 else '503 Service Unavailable',
+                               [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))])
+                return [body]
+            app = self.loader.wait()
+        return app(environ, start_response)
+
+
+class LazyASGIApp:
+    # The ASGI counterpart. Lifespan startup completes at once so the server
+    # starts accepting; the app's own startup hooks run once it has loaded,
+    # before its first request, and its shutdown hooks at lifespan shutdown.
+
+    def __init__(self, load=load_quart_app, preload=True):
+        self.loader = LazyLoader(load)
+        self._startup = None
+        if preload:
+            self.loader.start()
+
+    async def __call__(self, scope, receive, send):
+        import asyncio
+
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        app = self.loader.app
+        if app is None:
+            if scope['type'] == 'http' and is_health_check(scope.get('method'), scope.get('path', '')):
+                status, body = health(self.loader)
+                await send({'type': 'http.response.start', 'status': status,
+                            'headers': [(b'content-type', b'application/json'),
+                                        (b'content-length', str(len(body)).encode('ascii'))]})
+                await send({'type': 'http.response.body', 'body': body})
+                return
+            app = await asyncio.get_running_loop().run_in_executor(None, self.loader.wait)
+        if self._startup is None:
+            self._startup = asyncio.ensure_future(app.startup())
+        await asyncio.shield(self._startup)
+        await app(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._startup is not None:
+                    await self._startup
+                    await self.loader.app.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def create_app(preload=True):
+    # WSGI app factory; preload=False defers the load to the first request
+    return LazyWSGIApp(load_flask_app, preload=preload)
+
+
+def create_asgi_app(preload=True):
+    return LazyASGIApp(load_quart_app, preload=preload)
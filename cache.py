@@ -0,0 +1,251 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import jsoncodec
+from redisclient import NearCache, shared_client
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return '\n'.join(line.rstrip() for line in value.strip().replace('\r\n', '\n').split('\n'))
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def make_cache_key(upstream, action, payload, model=None):
+    canonical = json.dumps([upstream, action, model, _normalize(payload)],
+                           sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class MemoryBackend:
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        if len(value) > self.max_bytes:
+            return
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, expires_at)
+            self._bytes += len(value)
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._drop(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def size(self):
+        with self._lock:
+            return len(self._entries), self._bytes
+
+    def _drop(self, key):
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(value)
+
+
+class SQLiteBackend:
+    def __init__(self, path, max_entries=100000, max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS response_cache ('
+            ' key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,'
+            ' expires_at REAL, last_access REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS response_cache_lru ON response_cache (last_access)')
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT value, expires_at FROM response_cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] is not None and row[1] <= now:
+                self._conn.execute('DELETE FROM response_cache WHERE key = ?', (key,))
+                return None
+            self._conn.execute('UPDATE response_cache SET last_access = ? WHERE key = ?', (now, key))
+            return bytes(row[0])
+
+    def set(self, key, value, ttl=None):
+        if len(value) > self.max_bytes:
+            return
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO response_cache (key, value, size, expires_at, last_access)'
+                    ' VALUES (?, ?, ?, ?, ?)', (key, value, len(value), expires_at, now))
+                self._conn.execute('DELETE FROM response_cache WHERE expires_at IS NOT NULL AND expires_at <= ?', (now,))
+                # Sets only happen after an upstream miss, so an aggregate here is cheap
+                count, total = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM response_cache').fetchone()
+                while count > self.max_entries or total > self.max_bytes:
+                    oldest = self._conn.execute(
+                        'SELECT key, size FROM response_cache ORDER BY last_access LIMIT 1').fetchone()
+                    self._conn.execute('DELETE FROM response_cache WHERE key = ?', (oldest[0],))
+                    count -= 1
+                    total -= oldest[1]
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute('DELETE FROM response_cache WHERE key = ?', (key,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM response_cache')
+
+    def size(self):
+        with self._lock:
+            return tuple(self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM response_cache').fetchone())
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisBackend:
+    # Entries in a Redis server shared by every node (client is a
+    # redis.Redis). Eviction is left to the server (run it with maxmemory
+    # and an LRU policy); entries are also held in a small per-node
+    # NearCache, which deletes and clears on any node invalidate through
+    # pub/sub.
+
+    def __init__(self, client, prefix='fusion:', max_bytes=64 * 1024 * 1024, near_entries=256, near_ttl=60.0):
+        self.client = client
+        self.prefix = f"{prefix}cache:"
+        self.max_bytes = max_bytes
+        self._near = NearCache(client, f"{prefix}cache:invalidate", max_entries=near_entries, ttl=near_ttl)
+
+    def get(self, key):
+        value = self._near.get(key)
+        if value is not None:
+            return value
+        generation = self._near.generation()
+        value = self.client.get(self.prefix + key)
+        if value is not None:
+            self._near.put(key, value, generation)
+        return value
+
+    def set(self, key, value, ttl=None):
+        if len(value) > self.max_bytes:
+            return
+        self.client.set(self.prefix + key, value, px=max(1, int(ttl * 1000)) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+        self._near.invalidate(key)
+
+    def _keys(self):
+        return list(self.client.scan_iter(match=self.prefix + '*', count=1000))
+
+    def clear(self):
+        keys = self._keys()
+        for i in range(0, len(keys), 500):
+            self.client.delete(*keys[i:i + 500])
+        self._near.invalidate()
+
+    def size(self):
+        # Not tracked: entries expire and are evicted inside the server, so
+        # a client-side count would drift, and counting means a SCAN of the
+        # whole keyspace. Use the server's own INFO metrics instead.
+        return None
+
+    def close(self):
+        self._near.close()
+
+
+class ResponseCache:
+    def __init__(self, backend=None, ttl=3600):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls):
+        kind = os.getenv('RESPONSE_CACHE_BACKEND', 'memory').lower()
+        max_bytes = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+        max_entries = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '1024'))
+        ttl = int(os.getenv('RESPONSE_CACHE_TTL', '3600'))
+        if kind == 'sqlite':
+            path = os.getenv('RESPONSE_CACHE_PATH', 'response_cache.sqlite3')
+            return cls(SQLiteBackend(path, max_entries=max_entries, max_bytes=max_bytes), ttl=ttl)
+        if kind == 'memory':
+            return cls(MemoryBackend(max_entries=max_entries, max_bytes=max_bytes), ttl=ttl)
+        if kind == 'redis':
+            backend = RedisBackend(shared_client(), prefix=os.getenv('REDIS_PREFIX', 'fusion:'), max_bytes=max_bytes,
+                                   near_entries=int(os.getenv('RESPONSE_CACHE_NEAR_ENTRIES', '256')),
+                                   near_ttl=float(os.getenv('RESPONSE_CACHE_NEAR_TTL', '60')))
+            return cls(backend, ttl=ttl)
+        return cls(None, ttl=ttl)
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    def get(self, key):
+        if self.backend is None:
+            return None
+        raw = self.backend.get(key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return jsoncodec.loads(raw)
+
+    def set(self, key, value):
+        if self.backend is not None:
+            self.backend.set(key, jsoncodec.dumps_bytes(value), ttl=self.ttl)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        # entries and bytes are None when the backend does not track them
+        entries, size = (self.backend.size() or (None, None)) if self.backend is not None else (0, 0)
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
@@ -0,0 +1,56 @@
+import re
+
+# A top-level block starts at a column-0 def/class (optionally async) or at
+# the first of a run of decorators.
+_BLOCK_START = re.compile(r'(?:async\s+def|def|class)\s|@')
+
+
+class CodeBlockSplitter:
+    # Incrementally splits streamed Python source into top-level blocks. A
+    # block is only emitted once the next one has started, so every block
+    # returned by feed() is complete; close() returns whatever remains.
+
+    def __init__(self):
+        self._pending = ''
+        self._block = []
+        self._block_has_def = False
+        self._in_decorators = False
+
+    def feed(self, text):
+        self._pending += text
+        lines = self._pending.split('\n')
+        self._pending = lines.pop()
+        blocks = []
+        for line in lines:
+            block = self._add_line(line + '\n')
+            if block:
+                blocks.append(block)
+        return blocks
+
+    def close(self):
+        if self._pending:
+            self._add_line(self._pending)
+            self._pending = ''
+        block = ''.join(self._block)
+        self._block = []
+        return [block] if block.strip() else []
+
+    def _add_line(self, line):
+        finished = None
+        if line[:1] not in ('', ' ', '\t', '\n', '#') and _BLOCK_START.match(line):
+            starts_def = not line.startswith('@')
+            if not self._in_decorators and self._block_has_def:
+                finished = ''.join(self._block)
+                self._block = []
+                self._block_has_def = False
+            self._in_decorators = not starts_def
+            self._block_has_def = True
+        elif line.strip():
+            self._in_decorators = False
+        self._block.append(line)
+        return finished
+
+
+def split_blocks(code):
+    splitter = CodeBlockSplitter()
+    return splitter.feed(code) + splitter.close()
@@ -0,0 +1,107 @@
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Response types worth compressing; streamed responses are never compressed
+COMPRESSIBLE_TYPES = {'application/json', 'application/javascript', 'application/xml', 'image/svg+xml'}
+
+DEFAULT_LEVELS = {'zstd': 3, 'br': 5, 'gzip': 6}
+
+
+def _codecs():
+    codecs = {'gzip': lambda data, level: gzip.compress(data, compresslevel=level, mtime=0)}
+    if brotli is not None:
+        codecs['br'] = lambda data, level: brotli.compress(data, quality=level)
+    if zstandard is not None:
+        codecs['zstd'] = lambda data, level: zstandard.ZstdCompressor(level=level).compress(data)
+    return codecs
+
+
+def parse_accept_encoding(header):
+    # {"gzip": 1.0, "br": 0.5, ...} from an Accept-Encoding header
+    accepted = {}
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted['gzip' if coding == 'x-gzip' else coding] = q
+    return accepted
+
+
+class Compressor:
+    # Negotiated response compression. Of the encodings the client accepts,
+    # the first in `encodings` that is installed wins (zstd and brotli need
+    # the zstandard and brotli packages). Bodies under `min_size` bytes are
+    # sent as is.
+
+    def __init__(self, min_size=1024, encodings=('zstd', 'br', 'gzip'), levels=None):
+        self.min_size = min_size
+        self.levels = {**DEFAULT_LEVELS, **(levels or {})}
+        self._codecs = _codecs()
+        self.encodings = [encoding for encoding in encodings if encoding in self._codecs]
+
+    @classmethod
+    def from_env(cls):
+        encodings = [e.strip() for e in os.getenv('COMPRESSION_ENCODINGS', 'zstd,br,gzip').split(',') if e.strip()]
+        return cls(min_size=int(os.getenv('COMPRESSION_MIN_BYTES', '1024')), encodings=encodings)
+
+    def negotiate(self, accept_encoding):
+        accepted = parse_accept_encoding(accept_encoding)
+        default = accepted.get('*', 0.0)
+        for encoding in self.encodings:
+            if accepted.get(encoding, default) > 0:
+                return encoding
+        return None
+
+    def eligible(self, response, size):
+        # Whether the response would be compressed for a client accepting it
+        mimetype = response.mimetype or ''
+        return (
+            bool(self.encodings)
+            and 200 <= response.status_code < 300 and response.status_code not in (204, 206)
+            and 'Content-Encoding' not in response.headers
+            and (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES)
+            and size >= self.min_size
+        )
+
+    def compress(self, data, encoding):
+        return self._codecs[encoding](data, self.levels[encoding])
+
+    def encode(self, response, data, accept_encoding):
+        # Compresses an eligible, fully buffered body in place. Strong ETags
+        # get the encoding appended, as the compressed bytes are a different
+        # representation.
+        if not self.eligible(response, len(data)):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self.negotiate(accept_encoding)
+        if encoding is None:
+            return response
+        response.set_data(self.compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        tag, weak = response.get_etag()
+        if tag and not weak:
+            response.set_etag(f"{tag}-{encoding}")
+        return response
+
+    def etag_variants(self, tag):
+        # Every ETag a client may hold for the representation tagged `tag`
+        return [tag] + [f"{tag}-{encoding}" for encoding in self.encodings]
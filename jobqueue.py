@@ -0,0 +1,319 @@
+import hashlib
+import hmac
+import ipaddress
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+import requests
+
+import jsoncodec
+
+# Columns returned by JobQueue.get()
+JOB_FIELDS = ('job_id', 'kind', 'status', 'priority', 'attempts', 'max_attempts', 'status_code', 'result', 'error',
+              'webhook_url', 'webhook_status', 'created_at', 'started_at', 'finished_at')
+
+
+class JobQueue:
+    # Durable queue of long-running actions in SQLite. Web processes
+    # enqueue; worker threads or processes (see worker.py) claim jobs in
+    # priority order. A claimed job is invisible to other workers for
+    # visibility_timeout seconds; if its worker dies without completing it,
+    # it is claimed again, up to max_attempts times. path=':memory:' keeps
+    # the queue private to this process, and loses it on restart.
+
+    def __init__(self, path=':memory:', visibility_timeout=600.0, max_attempts=3, retry_delay=5.0,
+                 retention=86400.0):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        if path != ':memory:':
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            ' job_id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL,'
+            ' priority INTEGER NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL,'
+            ' max_attempts INTEGER NOT NULL, lease TEXT, available_at REAL NOT NULL,'
+            ' status_code INTEGER, result TEXT, error TEXT, webhook_url TEXT, webhook_status TEXT,'
+            ' created_at REAL NOT NULL, started_at REAL, finished_at REAL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, priority DESC, created_at)')
+        # Set when a job is enqueued, so workers in this process wake at once
+        self.wakeup = threading.Event()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            path=os.getenv('JOB_QUEUE_PATH', ':memory:'),
+            visibility_timeout=float(os.getenv('JOB_VISIBILITY_TIMEOUT', '600')),
+            max_attempts=int(os.getenv('JOB_MAX_ATTEMPTS', '3')),
+            retention=float(os.getenv('JOB_RETENTION', '86400'))
+        )
+
+    def _transaction(self, fn):
+        # Runs fn(conn) in one immediate transaction, under self._lock
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = fn(self._conn)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return result
+
+    def enqueue(self, kind, payload, priority=0, webhook_url=None):
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO jobs (job_id, kind, payload, priority, status, attempts, max_attempts, available_at,'
+                ' webhook_url, created_at) VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?, ?)',
+                (job_id, kind, jsoncodec.dumps(payload), int(priority), 'queued', self.max_attempts, now,
+                 webhook_url, now))
+        self.wakeup.set()
+        return job_id
+
+    def claim(self, kinds=None):
+        # The next job to run as {'job_id', 'kind', 'payload', 'lease', ...},
+        # or None. Jobs whose lease expired are claimed again, or failed once
+        # they have used up their attempts.
+        now = time.time()
+
+        def claim(conn):
+            while True:
+                sql = ('SELECT job_id, kind, payload, attempts, max_attempts FROM jobs'
+                       ' WHERE status IN (?, ?) AND available_at <= ?')
+                params = ['queued', 'running', now]
+                if kinds is not None:
+                    sql += f" AND kind IN ({','.join('?' * len(kinds))})"
+                    params.extend(kinds)
+                row = conn.execute(sql + ' ORDER BY priority DESC, created_at LIMIT 1', params).fetchone()
+                if row is None:
+                    return None
+                job_id, kind, payload, attempts, max_attempts = row
+                if attempts >= max_attempts:
+                    conn.execute(
+                        'UPDATE jobs SET status = ?, lease = NULL, error = ?, finished_at = ? WHERE job_id = ?',
+                        ('failed', 'Worker did not finish the job', now, job_id))
+                    continue
+                lease = uuid.uuid4().hex
+                conn.execute(
+                    'UPDATE jobs SET status = ?, attempts = attempts + 1, lease = ?, available_at = ?,'
+                    ' started_at = COALESCE(started_at, ?) WHERE job_id = ?',
+                    ('running', lease, now + self.visibility_timeout, now, job_id))
+                return {'job_id': job_id, 'kind': kind, 'payload': jsoncodec.loads(payload), 'lease': lease,
+                        'attempt': attempts + 1}
+
+        return self._transaction(claim)
+
+    def extend(self, job_id, lease):
+        # Pushes back the visibility timeout of a job still being worked on
+        with self._lock:
+            cursor = self._conn.execute(
+                'UPDATE jobs SET available_at = ? WHERE job_id = ? AND lease = ?',
+                (time.time() + self.visibility_timeout, job_id, lease))
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, lease, result, status_code=200):
+        # Records the final result. Returns False when the lease was lost,
+        # i.e. the job timed out and was handed to another worker.
+        with self._lock:
+            cursor = self._conn.execute(
+                'UPDATE jobs SET status = ?, lease = NULL, status_code = ?, result = ?, finished_at = ?'
+                ' WHERE job_id = ? AND lease = ?',
+                ('succeeded' if status_code == 200 else 'failed', status_code, jsoncodec.dumps(result),
+                 time.time(), job_id, lease))
+        return cursor.rowcount == 1
+
+    def fail(self, job_id, lease, error, retry=True, result=None, status_code=None):
+        # Requeues the job after retry_delay, or fails it for good (keeping
+        # result and status_code) when retry is False or it has no attempts
+        # left. Returns the new status, or None when the lease was lost.
+        now = time.time()
+
+        def fail(conn):
+            row = conn.execute('SELECT attempts, max_attempts FROM jobs WHERE job_id = ? AND lease = ?',
+                               (job_id, lease)).fetchone()
+            if row is None:
+                return None
+            if retry and row[0] < row[1]:
+                conn.execute('UPDATE jobs SET status = ?, lease = NULL, error = ?, available_at = ? WHERE job_id = ?',
+                             ('queued', error, now + self.retry_delay * row[0], job_id))
+                return 'queued'
+            conn.execute(
+                'UPDATE jobs SET status = ?, lease = NULL, error = ?, status_code = ?, result = ?, finished_at = ?'
+                ' WHERE job_id = ?',
+                ('failed', error, status_code, jsoncodec.dumps(result) if result is not None else None, now, job_id))
+            return 'failed'
+
+        return self._transaction(fail)
+
+    def set_webhook_status(self, job_id, webhook_status):
+        with self._lock:
+            self._conn.execute('UPDATE jobs SET webhook_status = ? WHERE job_id = ?', (webhook_status, job_id))
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(JOB_FIELDS, row))
+        job['result'] = jsoncodec.loads(job['result']) if job['result'] is not None else None
+        return job
+
+    def prune(self):
+        # Deletes finished jobs older than the retention period
+        with self._lock:
+            cursor = self._conn.execute('DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?',
+                                        (time.time() - self.retention,))
+        return cursor.rowcount
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        return {'jobs': dict(rows)}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def sign_webhook(secret, body):
+    return 'sha256=' + hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+
+def webhook_url_error(url, allowed_hosts=()):
+    # Returns why url may not receive webhooks, or None. Hosts in
+    # allowed_hosts are always accepted; any other host must resolve only to
+    # public addresses, so a job cannot make the worker POST to loopback,
+    # link-local (cloud metadata) or private-network services.
+    if not isinstance(url, str):
+        return "Invalid webhook_url"
+    try:
+        parsed = urlsplit(url)
+        host = parsed.hostname
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+    except ValueError:
+        return "Invalid webhook_url"
+    if parsed.scheme not in ('http', 'https') or not host:
+        return "Invalid webhook_url"
+    if host.lower() in allowed_hosts:
+        return None
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)}
+    except (OSError, UnicodeError):
+        return "webhook_url host does not resolve"
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%', 1)[0])
+        if ip.version == 6 and ip.ipv4_mapped is not None:
+            ip = ip.ipv4_mapped
+        if not ip.is_global or ip.is_multicast:
+            return "webhook_url must point to a public address"
+    return None
+
+
+def deliver_webhook(url, job, secret=None, attempts=3, timeout=10.0, backoff=1.0, allowed_hosts=()):
+    # POSTs the finished job as JSON. With a secret the body is signed in
+    # X-Fusion-Signature (HMAC-SHA256). Returns True once a 2xx is received.
+    # The URL is re-checked before each attempt, since DNS may have changed
+    # since the job was accepted, and redirects are not followed.
+    body = jsoncodec.dumps_bytes({'job': job})
+    headers = {'Content-Type': 'application/json', 'X-Fusion-Job-Id': job['job_id']}
+    if secret:
+        headers['X-Fusion-Signature'] = sign_webhook(secret, body)
+    for attempt in range(attempts):
+        if webhook_url_error(url, allowed_hosts) is not None:
+            return False
+        try:
+            response = requests.post(url, data=body, headers=headers, timeout=timeout, allow_redirects=False)
+            if 200 <= response.status_code < 300:
+                return True
+        except requests.exceptions.RequestException:
+            pass
+        if attempt + 1 < attempts:
+            time.sleep(backoff * 2 ** attempt)
+    return False
+
+
+def retryable(status_code):
+    # Handler outcomes worth another attempt: upstream throttling and failures
+    return status_code == 429 or status_code >= 500
+
+
+class JobWorker:
+    # Claims jobs from a queue and runs handlers[kind](payload), which
+    # returns (result, status_code). Retryable outcomes and exceptions
+    # requeue the job; any other outcome is final and is pushed to the
+    # job's webhook, if it has one. context, if given, is entered around
+    # each job (the Flask app context). webhook_hosts are the hosts that
+    # may receive webhooks even though they resolve to private addresses.
+
+    def __init__(self, queue, handlers, poll_interval=1.0, context=None, webhook_secret=None, webhook_hosts=()):
+        self.queue = queue
+        self.handlers = handlers
+        self.poll_interval = poll_interval
+        self.context = context
+        self.webhook_secret = webhook_secret
+        self.webhook_hosts = webhook_hosts
+
+    def run_once(self):
+        # Runs one job; returns False when there was nothing to run
+        job = self.queue.claim(self.handlers.names())
+        if job is None:
+            return False
+        handler = self.handlers.get(job['kind'])
+        finished = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, finished), daemon=True)
+        heartbeat.start()
+        try:
+            if self.context is not None:
+                with self.context():
+                    result, status_code = handler(job['payload'])
+            else:
+                result, status_code = handler(job['payload'])
+        except Exception as e:
+            status = self.queue.fail(job['job_id'], job['lease'], f"{type(e).__name__}: {e}")
+        else:
+            if retryable(status_code):
+                message = result.get('message') if isinstance(result, dict) else None
+                status = self.queue.fail(job['job_id'], job['lease'], message or f"Status {status_code}",
+                                         result=result, status_code=status_code)
+            else:
+                status = 'done' if self.queue.complete(job['job_id'], job['lease'], result, status_code) else None
+        finally:
+            finished.set()
+        if status in ('done', 'failed'):
+            self.notify(job['job_id'])
+        return True
+
+    def _heartbeat(self, job, finished):
+        # Keeps the job invisible to other workers while this one is alive,
+        # so the visibility timeout only has to cover a dead worker
+        while not finished.wait(self.queue.visibility_timeout / 3):
+            if not self.queue.extend(job['job_id'], job['lease']):
+                return
+
+    def notify(self, job_id):
+        job = self.queue.get(job_id)
+        if job is None or not job['webhook_url']:
+            return
+        delivered = deliver_webhook(job['webhook_url'], job, secret=self.webhook_secret,
+                                    allowed_hosts=self.webhook_hosts)
+        self.queue.set_webhook_status(job_id, 'delivered' if delivered else 'failed')
+
+    def run(self, stop):
+        # Works until the stop event is set
+        while not stop.is_set():
+            if not self.run_once():
+                self.queue.wakeup.wait(self.poll_interval)
+                self.queue.wakeup.clear()
@@ -0,0 +1,104 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobRunner:
+    # Runs slow background work (repository clones) on its own bounded
+    # worker pool, so it can never occupy the threads serving API
+    # requests. Each job's status is kept for polling until `retention`
+    # seconds after it finishes.
+
+    def __init__(self, name, workers=2, max_queued=100, retention=3600.0):
+        self.name = name
+        self.workers = workers
+        self.max_queued = max_queued
+        self.retention = retention
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"jobs-{name}")
+        self._jobs = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, fn, *args, **kwargs):
+        # fn is called as fn(*args, report=report, **kwargs); report(**fields)
+        # publishes progress fields on the job. Returns the job id.
+        with self._lock:
+            self._prune()
+            pending = sum(1 for job in self._jobs.values() if job['status'] in ('queued', 'running'))
+            if pending >= self.workers + self.max_queued:
+                raise JobQueueFull(f"{self.name} job queue is full")
+            job_id = str(uuid.uuid4())
+            self._jobs[job_id] = {
+                'job_id': job_id,
+                'kind': kind,
+                'status': 'queued',
+                'progress': {},
+                'result': None,
+                'error': None,
+                'created_at': time.time(),
+                'started_at': None,
+                'finished_at': None
+            }
+            self._futures[job_id] = self._pool.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, fn, args, kwargs):
+        self._set(job_id, status='running', started_at=time.time())
+
+        def report(**fields):
+            with self._lock:
+                self._jobs[job_id]['progress'] = {**self._jobs[job_id]['progress'], **fields}
+
+        try:
+            result = fn(*args, report=report, **kwargs)
+        except Exception as e:
+            self._set(job_id, status='failed', error=str(e), finished_at=time.time())
+            raise
+        self._set(job_id, status='succeeded', result=result, finished_at=time.time())
+        return result
+
+    def _set(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _prune(self):
+        # Caller holds self._lock
+        cutoff = time.time() - self.retention
+        for job_id in [j for j, job in self._jobs.items() if (job['finished_at'] or cutoff + 1) < cutoff]:
+            del self._jobs[job_id]
+            del self._futures[job_id]
+
+    def status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return {**job, 'progress': dict(job['progress'])} if job is not None else None
+
+    def future(self, job_id):
+        with self._lock:
+            return self._futures.get(job_id)
+
+    def wait(self, job_id, timeout=None):
+        # Blocks until the job finishes; returns its final status
+        future = self.future(job_id)
+        if future is None:
+            return None
+        try:
+            future.result(timeout=timeout)
+        except Exception:
+            pass
+        return self.status(job_id)
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+        return {'workers': self.workers, 'max_queued': self.max_queued, 'jobs': counts}
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
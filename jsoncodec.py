@@ -0,0 +1,80 @@
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON_BACKEND=auto uses orjson when it is installed, stdlib otherwise
+_requested = os.getenv('JSON_BACKEND', 'auto').lower()
+if _requested == 'orjson' and orjson is None:
+    raise RuntimeError("JSON_BACKEND=orjson but orjson is not installed")
+BACKEND = 'orjson' if orjson is not None and _requested in ('auto', 'orjson') else 'stdlib'
+
+
+def _stdlib_dumps(obj, sort_keys, indent, default):
+    return json.dumps(obj, ensure_ascii=False, sort_keys=sort_keys, indent=2 if indent else None,
+                      separators=None if indent else (',', ':'), default=default).encode('utf-8')
+
+
+def dumps_bytes(obj, sort_keys=False, indent=False, default=None):
+    # UTF-8 encoded JSON. Values orjson rejects (integers beyond 64 bits,
+    # for one) are encoded by the stdlib instead.
+    if BACKEND == 'orjson':
+        option = orjson.OPT_NON_STR_KEYS
+        if default is not None:
+            # Let default() format dates, as Flask's provider does
+            option |= orjson.OPT_PASSTHROUGH_DATETIME
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=default, option=option)
+        except orjson.JSONEncodeError:
+            pass
+    return _stdlib_dumps(obj, sort_keys, indent, default)
+
+
+def dumps(obj, **kwargs):
+    return dumps_bytes(obj, **kwargs).decode('utf-8')
+
+
+def loads(data):
+    if BACKEND == 'orjson':
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # The stdlib also accepts NaN and Infinity, and raises the
+            # error callers expect when the document really is invalid
+            pass
+    return json.loads(data)
+
+
+class FastJSONProvider:
+    # Mixed into Flask's or Quart's DefaultJSONProvider (see provider_for).
+    # Keeps their options (sort_keys, compact, default) but encodes with
+    # dumps_bytes and writes the bytes straight into the response.
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj, sort_keys=self.sort_keys, default=self.default)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = dumps_bytes(obj, sort_keys=self.sort_keys, indent=indent, default=self.default) + b'\n'
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def provider_for(app):
+    # The fast provider for a Flask or Quart app, based on its default one
+    base = type(app.json)
+    return type(f"Fast{base.__name__}", (FastJSONProvider, base), {})(app)
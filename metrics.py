@@ -0,0 +1,242 @@
+import contextvars
+import threading
+import time
+
+# Latency histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _Metric:
+    # Values live in one shard per recording thread, so recording never
+    # takes a lock: each shard has a single writer and a scrape sums them.
+    # Shards of threads that have exited are folded into `_retired`.
+
+    kind = None
+
+    def __init__(self, registry, name, help_text, labels):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._registry = registry
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._registry.lock:
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _merged(self):
+        with self._registry.lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append(shard)
+                else:
+                    for key, value in shard.items():
+                        self._retired[key] = self._merge(self._retired.get(key), value)
+            self._shards = [(t, s) for t, s in self._shards if t.is_alive()]
+            merged = dict(self._retired)
+        for shard in live:
+            for key, value in list(shard.items()):
+                merged[key] = self._merge(merged.get(key), value)
+        return merged
+
+    def _label_text(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merge(self, total, value):
+        return (total or 0) + value
+
+    def collect(self):
+        return [f"{self.name}{self._label_text(key)} {value}" for key, value in sorted(self._merged().items())]
+
+    def value(self, *labels):
+        return self._merged().get(labels, 0)
+
+
+class Gauge(Counter):
+    # Up/down counter; a thread may decrement what another incremented
+    kind = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help_text, labels, buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, help_text, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        shard = self._shard()
+        entry = shard.get(labels)
+        if entry is None:
+            # Per-bucket counts, then sum, then count
+            entry = shard[labels] = [0] * (len(self.buckets) + 3)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[i] += 1
+                break
+        else:
+            entry[len(self.buckets)] += 1
+        entry[-2] += value
+        entry[-1] += 1
+
+    def _merge(self, total, value):
+        return list(value) if total is None else [a + b for a, b in zip(total, value)]
+
+    def collect(self):
+        lines = []
+        for key, entry in sorted(self._merged().items()):
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + ['+Inf'], entry):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self._label_text(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(key)} {entry[-2]:.6f}")
+            lines.append(f"{self.name}_count{self._label_text(key)} {entry[-1]}")
+        return lines
+
+    def count(self, *labels):
+        entry = self._merged().get(labels)
+        return entry[-1] if entry else 0
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._metrics = []
+        self._collectors = []
+
+    def _add(self, metric):
+        with self.lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(self, name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._add(Gauge(self, name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(self, name, help_text, labels, buckets))
+
+    def add_collector(self, collect):
+        # collect() returns [(name, kind, help, [(labels_dict, value), ...])]
+        # for state that is read at scrape time rather than recorded
+        with self.lock:
+            self._collectors.append(collect)
+
+    def render(self):
+        with self.lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.collect())
+        for collect in collectors:
+            for name, kind, help_text, samples in collect():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                    lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.counter(
+    'fusion_http_requests_total', 'HTTP requests by route, action and status', ('route', 'action', 'status'))
+HTTP_DURATION = registry.histogram(
+    'fusion_http_request_duration_seconds', 'Total time spent serving a request', ('route', 'action'))
+HTTP_LOCAL_DURATION = registry.histogram(
+    'fusion_http_local_duration_seconds', 'Request time not spent waiting on upstream calls', ('route', 'action'))
+HTTP_IN_FLIGHT = registry.gauge('fusion_http_in_flight', 'Requests being served', ('route',))
+UPSTREAM_REQUESTS = registry.counter(
+    'fusion_upstream_requests_total', 'Upstream calls by status code ("error" for transport errors)',
+    ('upstream', 'action', 'status'))
+UPSTREAM_DURATION = registry.histogram(
+    'fusion_upstream_duration_seconds', 'Upstream call latency, including retries', ('upstream', 'action'))
+UPSTREAM_IN_FLIGHT = registry.gauge('fusion_upstream_in_flight', 'Upstream calls in progress', ('upstream',))
+CACHE_REQUESTS = registry.counter(
+    'fusion_cache_requests_total', 'Response cache lookups by result', ('upstream', 'action', 'result'))
+COALESCED_REQUESTS = registry.counter(
+    'fusion_coalesced_requests_total', 'Calls served by an identical in-flight request', ('upstream', 'action'))
+
+# Seconds of upstream time accumulated by the request being served
+_upstream_time = contextvars.ContextVar('fusion_upstream_time', default=None)
+
+
+class RequestTimer:
+    # Times one served request and how much of it was spent upstream.
+    # start() binds the timer to the current context; upstream calls made
+    # from it (or from worker threads running a copy of it) add to it.
+
+    def __init__(self, route, action):
+        self.route = route
+        self.action = action
+        self.upstream = [0.0]
+        self.started = time.perf_counter()
+
+    def start(self):
+        _upstream_time.set(self.upstream)
+        HTTP_IN_FLIGHT.inc(self.route)
+        return self
+
+    def finish(self, status_code):
+        # May run in another thread or context than start(), e.g. once a
+        # streamed response has been fully sent
+        total = time.perf_counter() - self.started
+        HTTP_IN_FLIGHT.dec(self.route)
+        HTTP_REQUESTS.inc(self.route, self.action, str(status_code))
+        HTTP_DURATION.observe(total, self.route, self.action)
+        HTTP_LOCAL_DURATION.observe(max(0.0, total - self.upstream[0]), self.route, self.action)
+
+
+class UpstreamTimer:
+    def __init__(self, upstream, action):
+        self.upstream = upstream
+        self.action = action
+        self.status = 'error'
+
+    def __enter__(self):
+        UPSTREAM_IN_FLIGHT.inc(self.upstream)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        UPSTREAM_IN_FLIGHT.dec(self.upstream)
+        UPSTREAM_REQUESTS.inc(self.upstream, self.action, self.status)
+        UPSTREAM_DURATION.observe(elapsed, self.upstream, self.action)
+        request_upstream = _upstream_time.get()
+        if request_upstream is not None:
+            request_upstream[0] += elapsed
+
+    def record(self, response):
+        self.status = str(getattr(response, 'status_code', 'error'))
+        return response
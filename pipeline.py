@@ -0,0 +1,73 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+
+class StageTimings:
+    # Per-request record of how long each stage waited for a worker and ran
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, queued, run):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {"queued_ms": 0.0, "run_ms": 0.0})
+            entry["queued_ms"] += queued * 1000
+            entry["run_ms"] += run * 1000
+
+    def measure(self, stage):
+        timings = self
+
+        class _Measure:
+            def __enter__(self):
+                self.started = time.perf_counter()
+
+            def __exit__(self, *exc):
+                timings.record(stage, 0.0, time.perf_counter() - self.started)
+
+        return _Measure()
+
+    def as_dict(self):
+        with self._lock:
+            stages = {name: {k: round(v, 3) for k, v in entry.items()} for name, entry in self.stages.items()}
+        return {"stages": stages, "total_ms": round((time.perf_counter() - self.started) * 1000, 3)}
+
+
+class StagedExecutor:
+    # One bounded worker pool per pipeline stage. Requests hand each stage to
+    # its pool, so the stages of different requests overlap while a slow
+    # upstream can only occupy its own stage's workers.
+
+    def __init__(self, stages, context=None):
+        self.context = context or nullcontext
+        self._pools = {
+            name: ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"stage-{name}")
+            for name, workers in stages.items()
+        }
+
+    def submit(self, stage, fn, *args, timings=None, **kwargs):
+        queued_at = time.perf_counter()
+
+        def run():
+            started = time.perf_counter()
+            try:
+                with self.context():
+                    return fn(*args, **kwargs)
+            finally:
+                if timings is not None:
+                    timings.record(stage, started - queued_at, time.perf_counter() - started)
+
+        # Stage threads run in a copy of the caller's context, so work they
+        # do (upstream time, for one) is attributed to the calling request
+        return self._pools[stage].submit(contextvars.copy_context().run, run)
+
+    def run(self, stage, fn, *args, timings=None, **kwargs):
+        return self.submit(stage, fn, *args, timings=timings, **kwargs).result()
+
+    def shutdown(self, wait=True):
+        for pool in self._pools.values():
+            pool.shutdown(wait=wait)
@@ -0,0 +1,496 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+
+from redisclient import shared_client
+
+# Wait-time histogram bucket upper bounds, in milliseconds
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+def parse_rate_limits(spec):
+    # Parses "chatgpt=rpm:3500,tpm:90000,concurrency:8;blackbox=rpm:600" into
+    # {'chatgpt': {'rpm': 3500.0, 'tpm': 90000.0, 'concurrency': 8.0}, ...}.
+    # Other keys: burst, max_concurrency and latency (target, in seconds).
+    limits = {}
+    for entry in (spec or '').split(';'):
+        entry = entry.strip()
+        if not entry or '=' not in entry:
+            continue
+        upstream, value = entry.split('=', 1)
+        settings = {}
+        for part in value.split(','):
+            name, sep, number = part.partition(':')
+            if sep:
+                settings[name.strip()] = float(number)
+        limits[upstream.strip()] = settings
+    return limits
+
+
+def estimate_tokens(payload):
+    # Rough prompt size (about four characters per token) plus the
+    # completion budget the request asks for
+    if not payload:
+        return 1
+    text = json.dumps(payload, separators=(',', ':'))
+    return max(1, len(text) // 4 + int(payload.get('max_tokens') or 0))
+
+
+def api_key_id(headers):
+    # Limits are kept per API key; only a digest of the key is retained
+    auth = (headers or {}).get('Authorization', '')
+    return hashlib.sha256(auth.encode('utf-8')).hexdigest()[:12]
+
+
+class RateLimitExceeded(requests.exceptions.HTTPError):
+    # Raised when a request waited longer than max_wait for its budget.
+    # Carries a 429 response so callers relay it like an upstream 429.
+
+    def __init__(self, upstream, retry_after):
+        response = requests.Response()
+        response.status_code = 429
+        response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+        super().__init__(f"Client-side rate limit for {upstream} exceeded", response=response)
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = len(self.bounds)
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        cumulative, buckets = 0, {}
+        for bound, count in zip(list(self.bounds) + ['+Inf'], self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"buckets": buckets, "count": self.count, "sum": round(self.sum, 3)}
+
+
+class TokenBucket:
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        return 0.0 if self.level >= needed else (needed - self.level) / self.rate
+
+    def take(self, amount):
+        # May go negative when actual usage exceeds the estimate
+        self.level -= amount
+
+
+class RedisCounters:
+    # Expiring integer counters in a Redis server shared by every node
+
+    def __init__(self, client, prefix='fusion:'):
+        self.client = client
+        self.prefix = f"{prefix}ratelimit:"
+
+    def get(self, key):
+        return int(self.client.get(self.prefix + key) or 0)
+
+    def incr(self, key, amount, ttl):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.incrby(self.prefix + key, amount)
+        pipe.pexpire(self.prefix + key, max(1, int(ttl * 1000)))
+        pipe.execute()
+
+
+class SQLiteCounters:
+    # The same counters in a SQLite file, shared by the processes of one node
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS rate_counters ('
+                           ' key TEXT PRIMARY KEY, value INTEGER NOT NULL, expires_at REAL NOT NULL)')
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM rate_counters WHERE key = ? AND expires_at > ?',
+                                     (key, time.time())).fetchone()
+        return row[0] if row else 0
+
+    def incr(self, key, amount, ttl):
+        now = time.time()
+        with self._lock:
+            self._conn.execute('DELETE FROM rate_counters WHERE expires_at <= ?', (now,))
+            self._conn.execute(
+                'INSERT INTO rate_counters (key, value, expires_at) VALUES (?, ?, ?)'
+                ' ON CONFLICT (key) DO UPDATE SET value = value + excluded.value, expires_at = excluded.expires_at',
+                (key, amount, now + ttl))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class WindowCounter:
+    # Shared counterpart of TokenBucket: counts usage per one-minute
+    # wall-clock window in counters every node or process sees, so they all
+    # draw on one budget. Fixed windows allow up to twice the budget across
+    # a window boundary; a check and a take on different nodes can race by
+    # one request each.
+
+    def __init__(self, counters, key, per_minute, window=60.0):
+        self.counters = counters
+        self.key = key
+        self.capacity = per_minute
+        self.window = window
+
+    def wait_time(self, amount, now):
+        # now (monotonic) is ignored; windows follow the wall clock
+        now = time.time()
+        slot = int(now // self.window)
+        used = self.counters.get(f"{self.key}:{slot}")
+        if used + min(amount, self.capacity) <= self.capacity:
+            return 0.0
+        return (slot + 1) * self.window - now
+
+    def take(self, amount):
+        now = time.time()
+        self.counters.incr(f"{self.key}:{int(now // self.window)}", int(round(amount)), ttl=2 * self.window)
+
+
+class AIMDController:
+    # Additive-increase / multiplicative-decrease concurrency limit. Every
+    # successful call grows the limit by about one per limit's worth of
+    # calls; a 429, or latency above the target, cuts it by `decrease`, at
+    # most once per `cooldown` seconds so one burst of 429s counts once.
+
+    def __init__(self, initial=8, minimum=1, maximum=64, decrease=0.5, latency_target=None, cooldown=1.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self.cooldown = cooldown
+        self._last_decrease = 0.0
+
+    def on_result(self, throttled, latency, now):
+        if throttled or (self.latency_target and latency > self.latency_target):
+            if now - self._last_decrease >= self.cooldown:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+                self._last_decrease = now
+        else:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+
+class Permit:
+    def __init__(self, tokens, started):
+        self.tokens = tokens
+        self.started = started
+
+
+class UpstreamLimiter:
+    # Request and token budgets plus an adaptive concurrency limit for one
+    # (upstream, API key). Callers that are over budget wait in line rather
+    # than fail, up to max_wait seconds. With shared counters the request
+    # and token budgets are WindowCounters under key, shared by every node;
+    # the concurrency limit stays per process. Counter round trips are never
+    # made under self._cond, and the async methods make them off the loop.
+
+    def __init__(self, upstream, rpm=None, tpm=None, burst=None, concurrency=8, max_concurrency=64,
+                 latency_target=None, max_wait=30.0, counters=None, key=None):
+        self.upstream = upstream
+        self.max_wait = max_wait
+        self.shared = counters is not None
+        if counters is not None:
+            self.requests = WindowCounter(counters, f"{key or upstream}:requests", rpm) if rpm else None
+            self.tokens = WindowCounter(counters, f"{key or upstream}:tokens", tpm) if tpm else None
+        else:
+            self.requests = TokenBucket(rpm, burst) if rpm else None
+            self.tokens = TokenBucket(tpm) if tpm else None
+        self.aimd = AIMDController(initial=concurrency, maximum=max(concurrency, max_concurrency),
+                                   latency_target=latency_target)
+        self.in_flight = 0
+        self.waiting = 0
+        self.throttled = 0
+        self.rejected = 0
+        self.blocked_until = 0.0
+        self.wait_ms = Histogram(WAIT_BUCKETS_MS)
+        self._cond = threading.Condition()
+
+    def _shared_wait(self, tokens):
+        # How long the shared budgets say to wait; round trips to the
+        # counters are made outside self._cond so no caller waits on another
+        # caller's I/O
+        now = time.monotonic()
+        waits = [0.0]
+        if self.requests is not None:
+            waits.append(self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            waits.append(self.tokens.wait_time(tokens, now))
+        return max(waits)
+
+    def _take_shared(self, tokens):
+        try:
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(tokens)
+        except BaseException:
+            self._settle(None)
+            raise
+
+    def _admit(self, tokens):
+        # The local part of an acquire: Retry-After blocks, local budgets
+        # and the concurrency limit. Returns None once admitted, otherwise
+        # how long to wait before trying again.
+        with self._cond:
+            now = time.monotonic()
+            waits = [self.blocked_until - now]
+            if not self.shared and self.requests is not None:
+                waits.append(self.requests.wait_time(1, now))
+            if not self.shared and self.tokens is not None:
+                waits.append(self.tokens.wait_time(tokens, now))
+            wait = max(waits)
+            if wait > 0:
+                return wait
+            if self.in_flight >= int(self.aimd.limit):
+                return 0.05
+            if not self.shared and self.requests is not None:
+                self.requests.take(1)
+            if not self.shared and self.tokens is not None:
+                self.tokens.take(tokens)
+            self.in_flight += 1
+            return None
+
+    def _try_acquire(self, tokens):
+        # Returns None once the permit is taken, otherwise how long to wait
+        if self.shared:
+            wait = self._shared_wait(tokens)
+            if wait > 0:
+                return wait
+        wait = self._admit(tokens)
+        if wait is None and self.shared:
+            self._take_shared(tokens)
+        return wait
+
+    async def _try_acquire_async(self, tokens):
+        # As _try_acquire, with the shared counters' I/O off the event loop
+        if self.shared:
+            wait = await asyncio.to_thread(self._shared_wait, tokens)
+            if wait > 0:
+                return wait
+        wait = self._admit(tokens)
+        if wait is None and self.shared:
+            await asyncio.to_thread(self._take_shared, tokens)
+        return wait
+
+    def _check_deadline(self, wait, deadline):
+        if time.monotonic() + wait > deadline:
+            with self._cond:
+                self.rejected += 1
+            raise RateLimitExceeded(self.upstream, wait)
+
+    def _queue(self, delta):
+        with self._cond:
+            self.waiting += delta
+
+    def acquire(self, tokens=1):
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        self._queue(1)
+        try:
+            while True:
+                wait = self._try_acquire(tokens)
+                if wait is None:
+                    return self._granted(tokens, started)
+                self._check_deadline(wait, deadline)
+                with self._cond:
+                    self._cond.wait(wait)
+        finally:
+            self._queue(-1)
+
+    async def acquire_async(self, tokens=1):
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        self._queue(1)
+        try:
+            while True:
+                wait = await self._try_acquire_async(tokens)
+                if wait is None:
+                    return self._granted(tokens, started)
+                self._check_deadline(wait, deadline)
+                await asyncio.sleep(min(wait, 0.05))
+        finally:
+            self._queue(-1)
+
+    def _granted(self, tokens, started):
+        now = time.monotonic()
+        with self._cond:
+            self.wait_ms.observe((now - started) * 1000)
+        return Permit(tokens, now)
+
+    def _settle(self, permit, status_code=None, retry_after=None, used_tokens=None):
+        # The local part of a release. Returns the token correction still
+        # to apply to shared counters, if any. permit=None undoes an
+        # admission whose shared take failed.
+        now = time.monotonic()
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+            if permit is None:
+                return None
+            throttled = status_code == 429
+            if throttled:
+                self.throttled += 1
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, now + retry_after)
+            self.aimd.on_result(throttled, now - permit.started, now)
+            if self.tokens is None or used_tokens is None:
+                return None
+            if not self.shared:
+                self.tokens.take(used_tokens - permit.tokens)
+                return None
+            return used_tokens - permit.tokens
+
+    def release(self, permit, status_code=None, retry_after=None, used_tokens=None):
+        correction = self._settle(permit, status_code, retry_after, used_tokens)
+        if correction:
+            self.tokens.take(correction)
+
+    async def release_async(self, permit, status_code=None, retry_after=None, used_tokens=None):
+        correction = self._settle(permit, status_code, retry_after, used_tokens)
+        if correction:
+            await asyncio.to_thread(self.tokens.take, correction)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "concurrency_limit": round(self.aimd.limit, 2),
+                "in_flight": self.in_flight,
+                "queue_depth": self.waiting,
+                "throttled": self.throttled,
+                "rejected": self.rejected,
+                "wait_ms": self.wait_ms.snapshot()
+            }
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _used_tokens(response):
+    try:
+        usage = response.json().get('usage') or {}
+    except Exception:
+        return None
+    total = usage.get('total_tokens')
+    return total if isinstance(total, int) else None
+
+
+class RateLimiter:
+    # Registry of UpstreamLimiters, created lazily per (upstream, API key)
+    # for the upstreams that have limits configured. counters (RedisCounters
+    # or SQLiteCounters) makes the request and token budgets shared.
+
+    def __init__(self, limits, max_wait=30.0, counters=None):
+        self.limits = limits
+        self.max_wait = max_wait
+        self.counters = counters
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        limits = parse_rate_limits(os.getenv('UPSTREAM_RATE_LIMITS', ''))
+        if not limits:
+            return None
+        backend = os.getenv('UPSTREAM_RATE_LIMIT_BACKEND', 'local').lower()
+        counters = None
+        if backend == 'redis':
+            counters = RedisCounters(shared_client(), prefix=os.getenv('REDIS_PREFIX', 'fusion:'))
+        elif backend == 'sqlite':
+            counters = SQLiteCounters(os.getenv('UPSTREAM_RATE_LIMIT_PATH', 'ratelimit.sqlite3'))
+        return cls(limits, max_wait=float(os.getenv('UPSTREAM_RATE_LIMIT_MAX_WAIT', '30')), counters=counters)
+
+    def limiter(self, upstream, headers):
+        settings = self.limits.get(upstream)
+        if settings is None:
+            return None
+        key = (upstream, api_key_id(headers))
+        with self._lock:
+            limiter = self._limiters.get(key)
+            if limiter is None:
+                limiter = self._limiters[key] = UpstreamLimiter(
+                    upstream,
+                    rpm=settings.get('rpm'),
+                    tpm=settings.get('tpm'),
+                    burst=settings.get('burst'),
+                    concurrency=int(settings.get('concurrency', 8)),
+                    max_concurrency=int(settings.get('max_concurrency', 64)),
+                    latency_target=settings.get('latency'),
+                    max_wait=self.max_wait,
+                    counters=self.counters,
+                    key=f"{upstream}:{key[1]}"
+                )
+        return limiter
+
+    def _outcome(self, response, streamed):
+        # release() arguments for the response a permit was used for
+        if response is None:
+            return {}
+        status_code = response.status_code
+        return {
+            'status_code': status_code,
+            'retry_after': _retry_after(response) if status_code == 429 else None,
+            'used_tokens': None if streamed or status_code != 200 else _used_tokens(response)
+        }
+
+    def release(self, limiter, permit, response, streamed=False):
+        limiter.release(permit, **self._outcome(response, streamed))
+
+    async def release_async(self, limiter, permit, response, streamed=False):
+        await limiter.release_async(permit, **self._outcome(response, streamed))
+
+    def stats(self):
+        with self._lock:
+            limiters = list(self._limiters.items())
+        return {f"{upstream}:{key_id}": limiter.stats() for (upstream, key_id), limiter in limiters}
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_limiter():
+    # One RateLimiter per process (None without UPSTREAM_RATE_LIMITS). Both
+    # upstream clients use it, so under ASGI the async handlers and the sync
+    # job workers draw on the same budgets.
+    with _shared_lock:
+        if 'limiter' not in _shared:
+            _shared['limiter'] = RateLimiter.from_env()
+        return _shared['limiter']
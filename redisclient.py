@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Helpers on top of redis-py for the state that has to be shared by every
+# node behind a load balancer: the project store, the response cache and
+# rate-limit counters. Works against Redis, Valkey or KeyDB; tests use
+# fakeredis. redis is imported on first use, so only deployments with a
+# Redis backend need it installed.
+
+
+class Subscriber:
+    # Background thread delivering every message on channel to
+    # on_message(data). Reconnects when the connection drops; on_reset()
+    # is called whenever messages may have been missed, and live tells
+    # whether the subscription is currently up.
+
+    def __init__(self, client, channel, on_message, on_reset=None, retry_delay=0.5, poll_interval=0.2):
+        self.client = client
+        self.channel = channel
+        self.on_message = on_message
+        self.on_reset = on_reset
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.live = threading.Event()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"subscriber-{channel}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        from redis.exceptions import RedisError
+
+        while not self._closed.is_set():
+            pubsub = self.client.pubsub()
+            try:
+                pubsub.subscribe(self.channel)
+                while not self._closed.is_set():
+                    message = pubsub.get_message(timeout=self.poll_interval)
+                    if message is None:
+                        continue
+                    if message['type'] == 'subscribe':
+                        # Confirmed: anything published from now on arrives
+                        self.live.set()
+                    elif message['type'] == 'message':
+                        self.on_message(message['data'])
+            except (OSError, ValueError, RedisError):
+                pass
+            finally:
+                self.live.clear()
+                try:
+                    pubsub.close()
+                except (OSError, RedisError):
+                    pass
+                if self.on_reset is not None:
+                    self.on_reset()
+            self._closed.wait(self.retry_delay)
+
+    def close(self):
+        self._closed.set()
+        self._thread.join(timeout=5)
+
+
+class NearCache:
+    # Node-local copy of shared values, kept coherent through pub/sub: every
+    # write invalidates the key locally and publishes it on channel, and
+    # every node drops the keys it hears about ('*' drops everything).
+    #
+    # It only serves while the subscription is live, and a value read while
+    # any invalidation arrived is not cached (see generation()), so a slow
+    # read never re-inserts a stale value. Entries also expire after ttl
+    # seconds as a bound on staleness. The subscription starts on first
+    # use, so a process that forks after creating the cache still gets one.
+
+    def __init__(self, client, channel, max_entries=1024, ttl=None):
+        self.client = client
+        self.channel = channel
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._subscriber = None
+        self._pid = None
+
+    def _live(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._entries.clear()
+                    self._subscriber = Subscriber(self.client, self.channel, self._on_message, self._on_reset)
+                    self._pid = os.getpid()
+        return self._subscriber.live.is_set()
+
+    def _on_message(self, data):
+        self._drop(None if data == b'*' else data.decode('utf-8'))
+
+    def _on_reset(self):
+        self._drop(None)
+
+    def _drop(self, key):
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def generation(self):
+        # Take before reading the shared value and pass to put()
+        with self._lock:
+            return self._generation
+
+    def get(self, key):
+        if self.max_entries <= 0 or not self._live():
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, generation, ttl=None):
+        if self.max_entries <= 0 or not self._live():
+            return
+        ttls = [t for t in (ttl, self.ttl) if t]
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[key] = (value, time.monotonic() + min(ttls) if ttls else None)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        # After a shared write: drop locally at once, then tell the other nodes
+        self._drop(key)
+        self.client.publish(self.channel, '*' if key is None else key)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def close(self):
+        with self._lock:
+            subscriber, self._subscriber, self._pid = self._subscriber, None, None
+            self._entries.clear()
+        if subscriber is not None:
+            subscriber.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def shared_client(url=None):
+    # One redis.Redis (and so one connection pool) per URL per process,
+    # REDIS_URL by default. redis-py replaces a pool inherited across fork.
+    import redis
+
+    url = url or os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+    timeout = float(os.getenv('REDIS_TIMEOUT', '5'))
+    with _clients_lock:
+        client = _clients.get(url)
+        if client is None:
+            client = _clients[url] = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout,
+                                                          health_check_interval=30)
+        return client
@@ -0,0 +1,247 @@
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit, urlunsplit
+
+# Partial-clone filters accepted from clients
+_FILTER = re.compile(r'^(blob:none|tree:0|blob:limit=\d+[kmg]?)$')
+
+# RemoteProgress stage bits reported while a clone runs
+_STAGES = ('counting', 'compressing', 'receiving', 'resolving', 'checking_out')
+
+
+def _git():
+    # GitPython is imported on the first clone rather than with the app: it
+    # is the slowest import after Flask and most workers never clone
+    import git
+    return git
+
+
+def clone_options(data):
+    # Validates the optional shallow/partial clone settings of an
+    # integrate_git request. Returns (options, error_message).
+    options = {}
+    depth = data.get('depth')
+    if depth is not None:
+        if isinstance(depth, bool) or not isinstance(depth, int) or depth < 1:
+            return None, "depth must be a positive integer"
+        options['depth'] = depth
+    clone_filter = data.get('filter')
+    if clone_filter is not None:
+        if not isinstance(clone_filter, str) or not _FILTER.match(clone_filter):
+            return None, "filter must be blob:none, tree:0 or blob:limit=<size>"
+        options['filter'] = clone_filter
+    branch = data.get('branch')
+    if branch is not None:
+        if not isinstance(branch, str) or not branch or branch.startswith('-'):
+            return None, "Invalid branch"
+        options['branch'] = branch
+        options['single_branch'] = True
+    return options, None
+
+
+def clone_progress(report):
+    # Adapts GitPython's progress callback to a job's report(**fields)
+    progress = _git().RemoteProgress
+    stages = {getattr(progress, stage.upper()): stage for stage in _STAGES}
+
+    def update(op_code, cur_count, max_count=None, message=''):
+        stage = stages.get(op_code & progress.OP_MASK)
+        if stage is None:
+            return
+        percent = round(100.0 * cur_count / max_count, 1) if max_count else None
+        report(stage=stage, percent=percent)
+    return update
+
+
+def normalize_repo_url(repo_url):
+    # Letter case of scheme/host, trailing slashes, a trailing .git and
+    # credentials do not make a different repository
+    repo_url = repo_url.strip()
+    if '://' not in repo_url:
+        # scp-like git@host:owner/repo syntax
+        host, sep, path = repo_url.rpartition(':')
+        if sep and '/' not in host:
+            repo_url = f"ssh://{host}/{path}"
+        else:
+            return repo_url.rstrip('/').removesuffix('.git')
+    parts = urlsplit(repo_url)
+    host = parts.hostname.lower() if parts.hostname else ''
+    if parts.port:
+        host = f"{host}:{parts.port}"
+    path = parts.path.rstrip('/').removesuffix('.git')
+    return urlunsplit((parts.scheme.lower(), host, path, '', ''))
+
+
+def repo_credentials(repo_url):
+    # The user[:password] part of repo_url, '' when there is none
+    repo_url = repo_url.strip()
+    if '://' not in repo_url:
+        host = repo_url.rpartition(':')[0]
+        return '' if '/' in host else host.rpartition('@')[0]
+    return urlsplit(repo_url).netloc.rpartition('@')[0]
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return 0.0
+
+
+def _disk_usage(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class MirrorCache:
+    # Bare mirrors of upstream repositories, keyed by normalized URL and the
+    # credentials in it: a mirror cloned with one caller's token is never
+    # served to, or fetched on behalf of, a caller without that token.
+    # Project checkouts are local clones of the mirror, which hardlink its
+    # object files instead of copying them, so they keep working after the
+    # mirror is evicted. A mirror is refreshed with an incremental fetch at
+    # most once every `refresh_interval` seconds, and least recently used
+    # mirrors are deleted once their total size exceeds `max_bytes`.
+
+    def __init__(self, root, max_bytes=10 * 1024 ** 3, refresh_interval=60.0):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.refresh_interval = refresh_interval
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.evictions = 0
+        self._sizes = {}
+        self._fetched = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        max_bytes = int(os.getenv('REPO_MIRROR_MAX_BYTES', str(10 * 1024 ** 3)))
+        if max_bytes <= 0:
+            return None
+        return cls(
+            os.getenv('REPO_MIRROR_DIR', '/tmp/fusion-mirrors'),
+            max_bytes=max_bytes,
+            refresh_interval=float(os.getenv('REPO_MIRROR_REFRESH_INTERVAL', '60'))
+        )
+
+    def path_for(self, repo_url):
+        credentials = hashlib.sha256(repo_credentials(repo_url).encode('utf-8')).hexdigest()
+        key = hashlib.sha256(f"{normalize_repo_url(repo_url)}\n{credentials}".encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self.root, f"{key}.git")
+
+    def _key_lock(self, path):
+        with self._lock:
+            return self._locks.setdefault(path, threading.Lock())
+
+    def checkout(self, repo_url, path, report=None, branch=None, **options):
+        # Clones repo_url into path through the mirror. Shallow and partial
+        # clone options are not needed here: hardlinked objects cost no
+        # extra disk, so they are ignored.
+        mirror = self.path_for(repo_url)
+        with self._key_lock(mirror):
+            self._ensure(repo_url, mirror, report)
+            if report is not None:
+                report(stage='checking_out', percent=None)
+            kwargs = {'branch': branch, 'single_branch': True} if branch else {}
+            repo = _git().Repo.clone_from(mirror, path, **kwargs)
+            repo.remote('origin').set_url(repo_url)
+            os.utime(mirror)
+        self._evict(keep=mirror)
+        return {'path': path}
+
+    def _ensure(self, repo_url, mirror, report):
+        # Caller holds the mirror's lock
+        progress = clone_progress(report) if report is not None else None
+        if os.path.isdir(mirror):
+            with self._lock:
+                self.hits += 1
+                stale = time.time() - self._fetched.get(mirror, 0) >= self.refresh_interval
+            if report is not None:
+                report(mirror='hit')
+            if stale:
+                _git().Repo(mirror).remote('origin').fetch(prune=True, progress=progress)
+                with self._lock:
+                    self.fetches += 1
+                    self._fetched[mirror] = time.time()
+                    self._sizes[mirror] = _disk_usage(mirror)
+            return
+        with self._lock:
+            self.misses += 1
+        if report is not None:
+            report(mirror='miss')
+        # Clone next to the final path and rename, so an interrupted clone
+        # never leaves a half-written mirror behind
+        staging = f"{mirror}.{uuid.uuid4().hex}.tmp"
+        try:
+            _git().Repo.clone_from(repo_url, staging, mirror=True, progress=progress)
+            os.rename(staging, mirror)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        with self._lock:
+            self._fetched[mirror] = time.time()
+            self._sizes[mirror] = _disk_usage(mirror)
+
+    def _mirrors(self):
+        return [os.path.join(self.root, name) for name in os.listdir(self.root) if name.endswith('.git')]
+
+    def _evict(self, keep=None):
+        mirrors = self._mirrors()
+        with self._lock:
+            for mirror in mirrors:
+                if mirror not in self._sizes:
+                    self._sizes[mirror] = _disk_usage(mirror)
+            total = sum(self._sizes.get(mirror, 0) for mirror in mirrors)
+        if total <= self.max_bytes:
+            return
+        for mirror in sorted(mirrors, key=_mtime):
+            if total <= self.max_bytes:
+                break
+            lock = self._key_lock(mirror)
+            if mirror == keep or not lock.acquire(blocking=False):
+                continue
+            try:
+                shutil.rmtree(mirror, ignore_errors=True)
+            finally:
+                lock.release()
+            with self._lock:
+                total -= self._sizes.pop(mirror, 0)
+                self._fetched.pop(mirror, None)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "fetches": self.fetches,
+                "evictions": self.evictions,
+                "mirrors": len(self._sizes),
+                "bytes": sum(self._sizes.values())
+            }
+
+
+def clone_repository(repo_url, path, report=None, mirrors=None, **options):
+    if mirrors is not None:
+        result = mirrors.checkout(repo_url, path, report=report, **options)
+    else:
+        progress = clone_progress(report) if report is not None else None
+        _git().Repo.clone_from(repo_url, path, progress=progress, **options)
+        result = {'path': path}
+    if report is not None:
+        report(stage='done', percent=100.0)
+    return result
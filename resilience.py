@@ -0,0 +1,338 @@
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+from ratelimit import RateLimitExceeded, parse_rate_limits
+
+# Upstream statuses worth retrying; anything else is returned as is
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    # Raised without calling the upstream while its circuit is open
+
+    def __init__(self, upstream, retry_after):
+        super().__init__(f"Circuit for {upstream} is open")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    # Opens after `failure_threshold` consecutive failures and fails fast for
+    # `reset_timeout` seconds. Then one trial call per `reset_timeout` is
+    # let through: success closes the circuit, failure opens it again.
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def check(self, upstream):
+        with self._lock:
+            if self.state == 'closed':
+                return
+            now = time.monotonic()
+            remaining = self.opened_at + self.reset_timeout - now
+            if remaining <= 0:
+                # Let one trial through; opened_at now times the trial
+                self.state = 'half_open'
+                self.opened_at = now
+                return
+            raise CircuitOpenError(upstream, max(remaining, 1.0))
+
+    def record(self, ok):
+        with self._lock:
+            if ok:
+                self.state = 'closed'
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.trips += 1
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+
+class RetryBudget:
+    # Every call deposits `ratio` of a retry and every retry (or hedge)
+    # withdraws one, so retries stay a bounded fraction of traffic and can
+    # not multiply load on an upstream that is already failing.
+
+    def __init__(self, ratio=0.2, minimum=10.0):
+        self.ratio = ratio
+        self.maximum = max(minimum, 100.0)
+        self.balance = minimum
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.balance = min(self.maximum, self.balance + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.balance < 1.0:
+                return False
+            self.balance -= 1.0
+            return True
+
+
+class LatencyTracker:
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q, min_samples=20):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _close(response):
+    close = getattr(response, 'close', None)
+    if close is not None:
+        close()
+
+
+class UpstreamPolicy:
+    # Retries with capped exponential backoff and full jitter (honouring
+    # Retry-After), an optional hedged second request once a call has run
+    # longer than the upstream's p95 latency, and a circuit breaker.
+
+    def __init__(self, upstream, attempts=3, base_delay=0.2, max_delay=10.0, budget_ratio=0.2,
+                 hedge=False, hedge_min_delay=0.05, failure_threshold=5, reset_timeout=30.0):
+        self.upstream = upstream
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.budget = RetryBudget(budget_ratio)
+        self.latency = LatencyTracker()
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+
+    def backoff(self, attempt, response=None):
+        # Seconds to sleep before retry number `attempt` (1-based), or None
+        # when the upstream asks for a longer pause than max_delay
+        retry_after = _retry_after(response) if response is not None else None
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_delay else None
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def hedge_delay(self):
+        if not self.hedge:
+            return None
+        p95 = self.latency.percentile(0.95)
+        return None if p95 is None else max(p95, self.hedge_min_delay)
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _outcome(self, response=None, error=None):
+        # Returns (retryable, failure) for one attempt
+        if error is not None:
+            transport = isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+            return transport and not isinstance(error, RateLimitExceeded), transport
+        status_code = response.status_code
+        return status_code in RETRY_STATUSES, status_code >= 500
+
+    def _next_delay(self, attempt, response):
+        # Caller decided to retry; returns the backoff or None if out of
+        # attempts or budget
+        if attempt >= self.attempts:
+            return None
+        delay = self.backoff(attempt, response)
+        if delay is None or not self.budget.withdraw():
+            return None
+        self._count('retries')
+        return delay
+
+    def call(self, send, hedgeable=False, pool=None):
+        # send() performs one upstream request and returns its response
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            attempt += 1
+            self.breaker.check(self.upstream)
+            started = time.monotonic()
+            response = error = None
+            try:
+                if hedgeable and pool is not None:
+                    response = self._hedged(send, pool)
+                else:
+                    response = send()
+            except requests.exceptions.RequestException as e:
+                error = e
+            retryable, failure = self._outcome(response, error)
+            self.breaker.record(not failure)
+            if error is None and not failure:
+                self.latency.observe(time.monotonic() - started)
+            delay = self._next_delay(attempt, response) if retryable else None
+            if delay is None:
+                if error is not None:
+                    raise error
+                return response
+            if response is not None:
+                _close(response)
+            time.sleep(delay)
+
+    def _hedged(self, send, pool):
+        # Each attempt runs in a copy of the caller's context, so the active
+        # span and other context variables follow it onto the pool thread
+        delay = self.hedge_delay()
+        primary = pool.submit(contextvars.copy_context().run, send)
+        if delay is None:
+            return primary.result()
+        done, _ = wait([primary], timeout=delay)
+        if done or not self.budget.withdraw():
+            return primary.result()
+        self._count('hedges')
+        hedge = pool.submit(contextvars.copy_context().run, send)
+        done, pending = wait([primary, hedge], return_when=FIRST_COMPLETED)
+        winner = done.pop()
+        if winner.exception() is not None and pending:
+            # The first to finish failed; the other may still succeed
+            return pending.pop().result()
+        loser = pending.pop() if pending else done.pop()
+        if winner is hedge:
+            self._count('hedge_wins')
+        loser.add_done_callback(lambda f: f.exception() is None and _close(f.result()))
+        return winner.result()
+
+    async def call_async(self, send, hedgeable=False):
+        # send() returns a coroutine performing one upstream request
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            attempt += 1
+            self.breaker.check(self.upstream)
+            started = time.monotonic()
+            response = error = None
+            try:
+                response = await (self._hedged_async(send) if hedgeable else send())
+            except requests.exceptions.RequestException as e:
+                error = e
+            retryable, failure = self._outcome(response, error)
+            self.breaker.record(not failure)
+            if error is None and not failure:
+                self.latency.observe(time.monotonic() - started)
+            delay = self._next_delay(attempt, response) if retryable else None
+            if delay is None:
+                if error is not None:
+                    raise error
+                return response
+            if response is not None:
+                _close(response)
+            await asyncio.sleep(delay)
+
+    async def _hedged_async(self, send):
+        delay = self.hedge_delay()
+        primary = asyncio.ensure_future(send())
+        if delay is None:
+            return await primary
+        done, _ = await asyncio.wait([primary], timeout=delay)
+        if done or not self.budget.withdraw():
+            return await primary
+        self._count('hedges')
+        hedge = asyncio.ensure_future(send())
+        done, pending = await asyncio.wait([primary, hedge], return_when=asyncio.FIRST_COMPLETED)
+        winner = done.pop()
+        if winner.exception() is not None and pending:
+            return await pending.pop()
+        for task in pending:
+            task.cancel()
+        if winner is hedge:
+            self._count('hedge_wins')
+        return winner.result()
+
+    def stats(self):
+        p95 = self.latency.percentile(0.95)
+        return {
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "trips": self.breaker.trips,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "retry_budget": round(self.budget.balance, 2),
+            "p95_ms": round(p95 * 1000, 3) if p95 is not None else None
+        }
+
+
+class Resilience:
+    # Per-upstream policies. UPSTREAM_RESILIENCE uses the same
+    # "upstream=key:value,..." format as UPSTREAM_RATE_LIMITS, with keys
+    # attempts, base_delay, max_delay, budget, hedge (0/1), failures and
+    # reset; upstreams without an entry get the defaults.
+
+    def __init__(self, settings=None, hedge_workers=16):
+        self.settings = dict(settings or {})
+        self.hedge_workers = hedge_workers
+        self._policies = {}
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        spec = os.getenv('UPSTREAM_RESILIENCE', '')
+        if spec.strip().lower() == 'off':
+            return None
+        return cls(parse_rate_limits(spec), hedge_workers=int(os.getenv('UPSTREAM_HEDGE_WORKERS', '16')))
+
+    def policy(self, upstream):
+        with self._lock:
+            policy = self._policies.get(upstream)
+            if policy is None:
+                settings = self.settings.get(upstream, {})
+                policy = self._policies[upstream] = UpstreamPolicy(
+                    upstream,
+                    attempts=int(settings.get('attempts', 3)),
+                    base_delay=settings.get('base_delay', 0.2),
+                    max_delay=settings.get('max_delay', 10.0),
+                    budget_ratio=settings.get('budget', 0.2),
+                    hedge=bool(settings.get('hedge', 0)),
+                    failure_threshold=int(settings.get('failures', 5)),
+                    reset_timeout=settings.get('reset', 30.0)
+                )
+            return policy
+
+    def pool(self):
+        # Threads for hedged sync calls, so the caller can wait on both
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.hedge_workers, thread_name_prefix='hedge')
+            return self._pool
+
+    def stats(self):
+        with self._lock:
+            policies = list(self._policies.items())
+        return {upstream: policy.stats() for upstream, policy in policies}
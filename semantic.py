@@ -0,0 +1,253 @@
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+from itertools import repeat
+from operator import mul
+
+import jsoncodec
+
+# numpy is imported when the first index is built, not with the app: the
+# semantic cache is off by default and numpy is a slow import
+numpy = None
+_numpy_loaded = False
+
+
+def load_numpy():
+    global numpy, _numpy_loaded
+    if not _numpy_loaded:
+        try:
+            import numpy as module
+        except ImportError:
+            module = None
+        numpy, _numpy_loaded = module, True
+    return numpy
+
+_WORD = re.compile(r'[a-z0-9_]+')
+
+STOPWORDS = frozenset(
+    'a an and are as at be but by can could do does for from how i in is it me my of on or please '
+    'should so that the this to what when where which who why will with would you your'.split()
+)
+
+
+def embed(text, dim=256):
+    # A CPU-only lexical embedding: hashed content words, word bigrams and
+    # character trigrams, L2-normalised, so rephrasings that share most of
+    # their content words land close together. Returns {index: weight}.
+    words = [word for word in _WORD.findall(text.lower()) if word not in STOPWORDS]
+    features = {}
+
+    def add(feature, weight):
+        h = zlib.crc32(feature.encode('utf-8'))
+        # Signed hashing keeps collisions from adding up to similarity
+        features[h % dim] = features.get(h % dim, 0.0) + (weight if h & 0x80000000 else -weight)
+
+    for word in words:
+        add('w:' + word, 1.0)
+        if len(word) > 3:
+            padded = f'<{word}>'
+            for i in range(len(padded) - 2):
+                add('c:' + padded[i:i + 3], 0.3)
+    for first, second in zip(words, words[1:]):
+        add(f'b:{first} {second}', 0.5)
+    norm = math.sqrt(sum(weight * weight for weight in features.values()))
+    if not norm:
+        return {}
+    return {index: weight / norm for index, weight in features.items() if weight}
+
+
+def scope_id(scope):
+    # 56-bit id for a scope string, so it fits an int64 column
+    return int.from_bytes(hashlib.blake2b(scope.encode('utf-8'), digest_size=7).digest(), 'big')
+
+
+class SemanticIndex:
+    # Nearest-neighbour store of unit vectors and their cached values, with
+    # LRU eviction by entry count and value bytes. With numpy the vectors
+    # are rows of one float32 matrix and a lookup is a single matrix-vector
+    # product; without it they are kept sparse and scanned in Python, which
+    # suits indexes of a few thousand entries.
+
+    def __init__(self, dim=256, max_entries=10000, max_bytes=64 * 1024 * 1024, use_numpy=None):
+        if use_numpy is not False:
+            load_numpy()
+        if use_numpy and numpy is None:
+            raise RuntimeError("numpy is not installed")
+        self.dim = dim
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.use_numpy = numpy is not None if use_numpy is None else use_numpy
+        self._lock = threading.Lock()
+        self._lru = OrderedDict()  # slot -> None, least recently used first
+        self._free = []
+        self._values = []  # slot -> (value bytes, expires_at), None when free
+        self._bytes = 0
+        if self.use_numpy:
+            capacity = min(max_entries, 1024)
+            self._matrix = numpy.zeros((capacity, dim), dtype=numpy.float32)
+            self._scopes = numpy.full(capacity, -1, dtype=numpy.int64)
+        else:
+            self._vectors = []  # slot -> (array of indices, array of weights)
+            self._scopes = []
+
+    def __len__(self):
+        with self._lock:
+            return len(self._lru)
+
+    def add(self, vector, scope, value, expires_at=None):
+        if len(value) > self.max_bytes or not vector:
+            return
+        with self._lock:
+            while self._lru and (len(self._lru) >= self.max_entries or self._bytes + len(value) > self.max_bytes):
+                self._release(next(iter(self._lru)))
+            slot = self._free.pop() if self._free else self._grow()
+            if self.use_numpy:
+                row = self._matrix[slot]
+                row[:] = 0.0
+                row[list(vector)] = list(vector.values())
+                self._scopes[slot] = scope
+            else:
+                self._vectors[slot] = (array('H', vector), array('f', vector.values()))
+                self._scopes[slot] = scope
+            self._values[slot] = (value, expires_at)
+            self._bytes += len(value)
+            self._lru[slot] = None
+
+    def search(self, vector, scope, threshold):
+        # (value, similarity) of the most similar live entry in scope at or
+        # above threshold, or None
+        if not vector:
+            return None
+        with self._lock:
+            if not self._lru:
+                return None
+            if self.use_numpy:
+                slot, similarity = self._search_numpy(vector, scope)
+            else:
+                slot, similarity = self._search_python(vector, scope)
+            if slot is None or similarity < threshold:
+                return None
+            value, expires_at = self._values[slot]
+            if expires_at is not None and expires_at <= time.time():
+                self._release(slot)
+                return None
+            self._lru.move_to_end(slot)
+            return value, similarity
+
+    def clear(self):
+        with self._lock:
+            for slot in list(self._lru):
+                self._release(slot)
+
+    def size(self):
+        with self._lock:
+            return len(self._lru), self._bytes
+
+    def _search_numpy(self, vector, scope):
+        count = len(self._values)
+        query = numpy.zeros(self.dim, dtype=numpy.float32)
+        query[list(vector)] = list(vector.values())
+        scores = self._matrix[:count] @ query
+        scores[self._scopes[:count] != scope] = -1.0
+        slot = int(scores.argmax())
+        return (slot, float(scores[slot])) if self._scopes[slot] == scope else (None, -1.0)
+
+    def _search_python(self, vector, scope):
+        weight_of = vector.get
+        zeros = repeat(0.0)
+        best, best_score = None, -1.0
+        for slot in self._lru:
+            if self._scopes[slot] != scope:
+                continue
+            indices, weights = self._vectors[slot]
+            score = sum(map(mul, map(weight_of, indices, zeros), weights))
+            if score > best_score:
+                best, best_score = slot, score
+        return best, best_score
+
+    def _grow(self):
+        slot = len(self._values)
+        self._values.append(None)
+        if not self.use_numpy:
+            self._vectors.append(None)
+            self._scopes.append(-1)
+        elif slot == len(self._matrix):
+            capacity = min(self.max_entries, 2 * len(self._matrix))
+            self._matrix.resize((capacity, self.dim), refcheck=False)
+            scopes = numpy.full(capacity, -1, dtype=numpy.int64)
+            scopes[:slot] = self._scopes
+            self._scopes = scopes
+        return slot
+
+    def _release(self, slot):
+        del self._lru[slot]
+        value, _ = self._values[slot]
+        self._bytes -= len(value)
+        self._values[slot] = None
+        self._scopes[slot] = -1
+        if not self.use_numpy:
+            self._vectors[slot] = None
+        self._free.append(slot)
+
+
+class SemanticCache:
+    # Serves results for requests that are near-duplicates of earlier ones:
+    # the request text is embedded and matched against earlier texts in the
+    # same scope (action, model and every other prompt field), and a match
+    # with cosine similarity >= threshold is a hit.
+
+    def __init__(self, index=None, threshold=0.9, ttl=3600, embedder=embed):
+        self.index = index
+        self.threshold = threshold
+        self.ttl = ttl
+        self.embedder = embedder
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls):
+        if os.getenv('SEMANTIC_CACHE', 'off').lower() not in ('on', 'true', '1'):
+            return cls(None)
+        index = SemanticIndex(
+            dim=int(os.getenv('SEMANTIC_CACHE_DIM', '256')),
+            max_entries=int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', '10000')),
+            max_bytes=int(os.getenv('SEMANTIC_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+        )
+        return cls(index, threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.9')),
+                   ttl=int(os.getenv('SEMANTIC_CACHE_TTL', os.getenv('RESPONSE_CACHE_TTL', '3600'))))
+
+    @property
+    def enabled(self):
+        return self.index is not None
+
+    def get(self, scope, text):
+        # (value, similarity) for the closest earlier text, or None
+        if self.index is None:
+            return None
+        match = self.index.search(self.embedder(text, self.index.dim), scope_id(scope), self.threshold)
+        if match is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        raw, similarity = match
+        return jsoncodec.loads(raw), similarity
+
+    def set(self, scope, text, value):
+        if self.index is not None:
+            expires_at = time.time() + self.ttl if self.ttl else None
+            self.index.add(self.embedder(text, self.index.dim), scope_id(scope), jsoncodec.dumps_bytes(value), expires_at)
+
+    def clear(self):
+        if self.index is not None:
+            self.index.clear()
+
+    def stats(self):
+        entries, size = self.index.size() if self.index is not None else (0, 0)
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size,
+                "threshold": self.threshold, "numpy": bool(self.index is not None and self.index.use_numpy)}
@@ -0,0 +1,675 @@
+import bisect
+import collections
+import copy
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from redisclient import NearCache, shared_client
+
+# Project fields that can be set through update()
+PROJECT_FIELDS = ('name', 'status', 'progress', 'documentation')
+
+# Lock stripes of the in-memory store (see LockStripes)
+DEFAULT_LOCK_STRIPES = 64
+
+# Largest page list_tasks() returns
+MAX_TASK_PAGE = 1000
+
+
+def new_project(name):
+    return {
+        'name': name,
+        'status': 'Created',
+        'progress': 0,
+        'task_count': 0,
+        'documentation': '',
+        'version': 1
+    }
+
+
+class VersionConflict(Exception):
+    # Raised by update(expected_version=...) when the project changed since
+    # that version was read; version is the current one
+    def __init__(self, version):
+        super().__init__(f"Project is at version {version}")
+        self.version = version
+
+
+def check_version(project, expected_version):
+    if expected_version is not None and project['version'] != expected_version:
+        raise VersionConflict(project['version'])
+
+
+class LockStripes:
+    # Fixed pool of locks shared out by key hash. Writers to different
+    # projects rarely share a lock, and memory stays bounded however many
+    # projects exist. count=1 is a single global lock.
+
+    def __init__(self, count=DEFAULT_LOCK_STRIPES):
+        self._locks = [threading.Lock() for _ in range(max(1, count))]
+
+    def __len__(self):
+        return len(self._locks)
+
+    def __call__(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+
+def task_page(rows, limit):
+    # rows holds up to limit + 1 (task_id, task) pairs after the cursor
+    tasks = [{'task_id': task_id, 'task': task} for task_id, task in rows[:limit]]
+    return {
+        'tasks': tasks,
+        'next_cursor': tasks[-1]['task_id'] if tasks else None,
+        'has_more': len(rows) > limit
+    }
+
+
+class MemoryProjectStore:
+    # Process-local store; the default for single-worker deployments and
+    # tests. Every project is guarded by its lock stripe, so writes to
+    # different projects do not serialize on one lock; _index_lock only
+    # covers adding projects and listing them.
+
+    def __init__(self, stripes=DEFAULT_LOCK_STRIPES):
+        self._projects = {}
+        self._tasks = {}
+        # next() on a count is atomic, so ids are drawn under the project's
+        # stripe and each task log stays sorted by id
+        self._task_ids = itertools.count(1)
+        self._progress_keys = {}
+        self._index_lock = threading.Lock()
+        self._stripes = LockStripes(stripes)
+
+    def create(self, name):
+        project_id = str(uuid.uuid4())
+        with self._index_lock:
+            self._tasks[project_id] = []
+            self._projects[project_id] = new_project(name)
+        return project_id
+
+    def get(self, project_id):
+        with self._stripes(project_id):
+            project = self._projects.get(project_id)
+            return copy.deepcopy(project) if project is not None else None
+
+    def exists(self, project_id):
+        return project_id in self._projects
+
+    def update(self, project_id, expected_version=None, **fields):
+        # Returns the new version, or None if the project does not exist.
+        # With expected_version the update is a compare-and-swap and raises
+        # VersionConflict if the project moved on.
+        fields = {k: v for k, v in fields.items() if k in PROJECT_FIELDS}
+        with self._stripes(project_id):
+            project = self._projects.get(project_id)
+            if project is None:
+                return None
+            check_version(project, expected_version)
+            if fields:
+                project.update(fields)
+                project['version'] += 1
+            return project['version']
+
+    def increment_progress(self, project_id, delta, limit=100, key=None):
+        # Returns the new progress, or None if the project does not exist.
+        # With a key the increment is applied at most once per project, so a
+        # retried job does not bump progress twice.
+        with self._stripes(project_id):
+            project = self._projects.get(project_id)
+            if project is None:
+                return None
+            if key is not None:
+                applied = self._progress_keys.setdefault(project_id, set())
+                if key in applied:
+                    return project['progress']
+                applied.add(key)
+            project['progress'] = min(limit, (project['progress'] or 0) + delta)
+            project['version'] += 1
+            return project['progress']
+
+    def append_task(self, project_id, task):
+        # Returns the new task's id, or None if the project does not exist
+        with self._stripes(project_id):
+            if project_id not in self._projects:
+                return None
+            return self._append(project_id, [task])[-1]
+
+    def _append(self, project_id, tasks):
+        # Caller holds the project's stripe
+        log = self._tasks[project_id]
+        ids = [next(self._task_ids) for _ in tasks]
+        log.extend(zip(ids, tasks))
+        self._projects[project_id]['task_count'] = len(log)
+        return ids
+
+    def append_tasks(self, project_id, tasks, progress_delta=0):
+        # Appends all tasks and bumps progress in one step. Returns the new
+        # progress, or None if the project does not exist.
+        with self._stripes(project_id):
+            project = self._projects.get(project_id)
+            if project is None:
+                return None
+            self._append(project_id, tasks)
+            if progress_delta:
+                project['progress'] = min(100, (project['progress'] or 0) + progress_delta)
+                project['version'] += 1
+            return project['progress']
+
+    def list_tasks(self, project_id, cursor=0, limit=100):
+        # Tasks appended after cursor (a task id), oldest first. Returns
+        # None if the project does not exist.
+        limit = max(1, min(limit, MAX_TASK_PAGE))
+        with self._stripes(project_id):
+            log = self._tasks.get(project_id)
+            if log is None:
+                return None
+            start = bisect.bisect_right(log, cursor, key=lambda entry: entry[0])
+            return task_page(copy.deepcopy(log[start:start + limit + 1]), limit)
+
+    def list_projects(self, status=None):
+        with self._index_lock:
+            projects = list(self._projects.items())
+        listed = []
+        for project_id, p in projects:
+            with self._stripes(project_id):
+                if status is None or p['status'] == status:
+                    listed.append({'project_id': project_id, 'name': p['name'], 'status': p['status'],
+                                   'progress': p['progress']})
+        return listed
+
+    def close(self):
+        pass
+
+
+class SQLiteProjectStore:
+    # Embedded SQLite store shared by every worker process on a host. Runs
+    # in WAL mode so readers never block the writer. Concurrent task
+    # appends are group-committed: whichever thread gets the connection
+    # writes every pending append in one transaction. Project rows are
+    # cached in-process and the cache is dropped whenever another process
+    # commits (detected through PRAGMA data_version). Project writes bump
+    # a version column, which update() can compare-and-swap on across
+    # processes. Each project row carries its task_count, updated in the
+    # same transaction as the task inserts.
+
+    def __init__(self, path, cache_size=1024):
+        self.path = path
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending = []
+        self._cache = {}
+        self._data_version = None
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(
+            'CREATE TABLE IF NOT EXISTS projects ('
+            ' id TEXT PRIMARY KEY, name TEXT, status TEXT, progress INTEGER NOT NULL DEFAULT 0,'
+            ' documentation TEXT NOT NULL DEFAULT \'""\', created_at REAL NOT NULL,'
+            ' version INTEGER NOT NULL DEFAULT 1, task_count INTEGER NOT NULL DEFAULT 0);'
+            'CREATE INDEX IF NOT EXISTS projects_status ON projects (status);'
+            'CREATE TABLE IF NOT EXISTS tasks ('
+            ' seq INTEGER PRIMARY KEY AUTOINCREMENT, project_id TEXT NOT NULL, task TEXT);'
+            'CREATE INDEX IF NOT EXISTS tasks_project ON tasks (project_id, seq);'
+            'CREATE TABLE IF NOT EXISTS progress_keys ('
+            ' project_id TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (project_id, key));'
+        )
+        self._migrate()
+
+    def _columns(self):
+        return {row[1] for row in self._conn.execute('PRAGMA table_info(projects)')}
+
+    def _migrate(self):
+        # Adds the columns that files created by older versions lack. The
+        # columns are checked again under the write lock, so processes
+        # opening the same file at once migrate it only once.
+        if {'version', 'task_count'} <= self._columns():
+            return
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            columns = self._columns()
+            if 'version' not in columns:
+                self._conn.execute('ALTER TABLE projects ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+            if 'task_count' not in columns:
+                self._conn.execute('ALTER TABLE projects ADD COLUMN task_count INTEGER NOT NULL DEFAULT 0')
+                self._conn.execute('UPDATE projects SET task_count = (SELECT COUNT(*) FROM tasks'
+                                   ' WHERE tasks.project_id = projects.id)')
+            self._conn.execute('COMMIT')
+        except Exception:
+            self._conn.execute('ROLLBACK')
+            raise
+
+    def _check_data_version(self):
+        # Caller holds self._lock
+        version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+        if version != self._data_version:
+            self._cache.clear()
+            self._data_version = version
+
+    def _load(self, project_id):
+        # Caller holds self._lock; returns the cached row, loading it on a miss
+        self._check_data_version()
+        project = self._cache.get(project_id)
+        if project is not None:
+            return project
+        row = self._conn.execute(
+            'SELECT name, status, progress, task_count, documentation, version FROM projects WHERE id = ?',
+            (project_id,)).fetchone()
+        if row is None:
+            return None
+        project = {
+            'name': row[0],
+            'status': row[1],
+            'progress': row[2],
+            'task_count': row[3],
+            'documentation': json.loads(row[4]),
+            'version': row[5]
+        }
+        if len(self._cache) >= self.cache_size:
+            self._cache.pop(next(iter(self._cache)))
+        self._cache[project_id] = project
+        return project
+
+    def _write(self, statements):
+        # Caller holds self._lock; runs statements in one transaction
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            results = [self._conn.execute(sql, params) for sql, params in statements]
+            self._conn.execute('COMMIT')
+        except Exception:
+            self._conn.execute('ROLLBACK')
+            raise
+        # Our own commit does not change data_version for this connection
+        return results
+
+    def create(self, name):
+        project_id = str(uuid.uuid4())
+        project = new_project(name)
+        with self._lock:
+            self._write([(
+                'INSERT INTO projects (id, name, status, progress, documentation, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (project_id, project['name'], project['status'], project['progress'],
+                 json.dumps(project['documentation']), time.time())
+            )])
+            self._cache[project_id] = project
+        return project_id
+
+    def get(self, project_id):
+        self._flush_pending()
+        with self._lock:
+            project = self._load(project_id)
+            return copy.deepcopy(project) if project is not None else None
+
+    def exists(self, project_id):
+        with self._lock:
+            return self._load(project_id) is not None
+
+    def update(self, project_id, expected_version=None, **fields):
+        fields = {k: v for k, v in fields.items() if k in PROJECT_FIELDS}
+        values = [json.dumps(v) if k == 'documentation' else v for k, v in fields.items()]
+        assignments = ''.join(f'{k} = ?, ' for k in fields)
+        with self._lock:
+            if not fields:
+                project = self._load(project_id)
+                if project is None:
+                    return None
+                check_version(project, expected_version)
+                return project['version']
+            self._check_data_version()
+            sql, params = f'UPDATE projects SET {assignments}version = version + 1 WHERE id = ?', [*values, project_id]
+            if expected_version is not None:
+                sql, params = sql + ' AND version = ?', params + [expected_version]
+            cursor, = self._write([(sql, params)])
+            if cursor.rowcount == 0:
+                project = self._load(project_id)
+                if project is None:
+                    return None
+                raise VersionConflict(project['version'])
+            project = self._cache.get(project_id)
+            if project is not None:
+                project.update(copy.deepcopy(fields))
+            return self._refresh(project_id)[1]
+
+    def increment_progress(self, project_id, delta, limit=100, key=None):
+        with self._lock:
+            self._check_data_version()
+            update = ('UPDATE projects SET progress = MIN(?, progress + ?), version = version + 1 WHERE id = ?',
+                      [limit, delta, project_id])
+            if key is not None:
+                # The key is recorded in the same transaction; changes() is 0
+                # when it was already there, and the update then matches nothing
+                update = (update[0] + ' AND changes() = 1', update[1])
+                statements = [('INSERT OR IGNORE INTO progress_keys (project_id, key) SELECT id, ? FROM projects'
+                               ' WHERE id = ?', (key, project_id)), update]
+            else:
+                statements = [update]
+            cursor = self._write(statements)[-1]
+            if cursor.rowcount == 0:
+                project = self._load(project_id)
+                return project['progress'] if project is not None else None
+            return self._refresh(project_id)[0]
+
+    def _refresh(self, project_id):
+        # Caller holds self._lock; re-reads (progress, version) after a write
+        progress, version = self._conn.execute(
+            'SELECT progress, version FROM projects WHERE id = ?', (project_id,)).fetchone()
+        project = self._cache.get(project_id)
+        if project is not None:
+            project['progress'] = progress
+            project['version'] = version
+        return progress, version
+
+    def append_task(self, project_id, task):
+        # Returns the new task's id, or None if the project does not exist
+        entry = {'project_id': project_id, 'task': task, 'task_id': None}
+        with self._pending_lock:
+            self._pending.append(entry)
+        self._flush_pending()
+        return entry['task_id']
+
+    def _flush_pending(self):
+        with self._lock:
+            with self._pending_lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return
+            ids = {entry['project_id'] for entry in pending}
+            existing = {pid for pid in ids if self._load(pid) is not None}
+            accepted = [entry for entry in pending if entry['project_id'] in existing]
+            if not accepted:
+                return
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                for entry in accepted:
+                    entry['task_id'] = self._conn.execute(
+                        'INSERT INTO tasks (project_id, task) VALUES (?, ?)',
+                        (entry['project_id'], json.dumps(entry['task']))).lastrowid
+                counts = collections.Counter(entry['project_id'] for entry in accepted)
+                self._conn.executemany('UPDATE projects SET task_count = task_count + ? WHERE id = ?',
+                                       [(count, pid) for pid, count in counts.items()])
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                for entry in accepted:
+                    entry['task_id'] = None
+                raise
+            for entry in accepted:
+                self._cache[entry['project_id']]['task_count'] += 1
+
+    def append_tasks(self, project_id, tasks, progress_delta=0):
+        self._flush_pending()
+        with self._lock:
+            if self._load(project_id) is None:
+                return None
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.executemany('INSERT INTO tasks (project_id, task) VALUES (?, ?)',
+                                       [(project_id, json.dumps(task)) for task in tasks])
+                self._conn.execute('UPDATE projects SET task_count = task_count + ? WHERE id = ?',
+                                   (len(tasks), project_id))
+                if progress_delta:
+                    self._conn.execute(
+                        'UPDATE projects SET progress = MIN(100, progress + ?), version = version + 1 WHERE id = ?',
+                        (progress_delta, project_id))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._cache[project_id]['task_count'] += len(tasks)
+            return self._refresh(project_id)[0]
+
+    def list_tasks(self, project_id, cursor=0, limit=100):
+        limit = max(1, min(limit, MAX_TASK_PAGE))
+        self._flush_pending()
+        with self._lock:
+            if self._load(project_id) is None:
+                return None
+            rows = self._conn.execute(
+                'SELECT seq, task FROM tasks WHERE project_id = ? AND seq > ? ORDER BY seq LIMIT ?',
+                (project_id, cursor, limit + 1)).fetchall()
+            return task_page([(seq, json.loads(task)) for seq, task in rows], limit)
+
+    def list_projects(self, status=None):
+        with self._lock:
+            if status is None:
+                rows = self._conn.execute('SELECT id, name, status, progress FROM projects ORDER BY created_at')
+            else:
+                rows = self._conn.execute(
+                    'SELECT id, name, status, progress FROM projects WHERE status = ? ORDER BY created_at', (status,))
+            return [{'project_id': r[0], 'name': r[1], 'status': r[2], 'progress': r[3]} for r in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisProjectStore:
+    # Project state in a Redis server shared by every node, so several
+    # instances can sit behind a load balancer. A project is a hash of
+    # JSON-encoded fields plus a sorted set of its tasks scored by task id;
+    # writes are MULTI/EXEC transactions, with WATCH where they read first.
+    # Every project is in a sorted set of all projects and in one per
+    # status, both scored by creation time. Reads go through a NearCache
+    # kept coherent by pub/sub. client is a redis.Redis.
+
+    def __init__(self, client, prefix='fusion:', cache_size=1024, cache_ttl=30.0):
+        self.client = client
+        self.prefix = prefix
+        self._cache = NearCache(client, f"{prefix}projects:invalidate", max_entries=cache_size, ttl=cache_ttl)
+        self._status_indexed = False
+
+    def _key(self, project_id):
+        return f"{self.prefix}project:{project_id}"
+
+    def _tasks_key(self, project_id):
+        return f"{self.prefix}project:{project_id}:tasks"
+
+    def _status_key(self, status):
+        return f"{self.prefix}projects:status:{status}"
+
+    def create(self, name):
+        project_id = str(uuid.uuid4())
+        project = new_project(name)
+        created_at = time.time()
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hset(self._key(project_id), mapping={k: json.dumps(v) for k, v in project.items()})
+        pipe.zadd(f"{self.prefix}projects", {project_id: created_at})
+        pipe.zadd(self._status_key(project['status']), {project_id: created_at})
+        pipe.execute()
+        return project_id
+
+    def _load(self, project_id):
+        if not isinstance(project_id, str):
+            return None
+        project = self._cache.get(project_id)
+        if project is not None:
+            return project
+        generation = self._cache.generation()
+        row = self.client.hgetall(self._key(project_id))
+        if not row:
+            return None
+        project = {k.decode('utf-8'): json.loads(v) for k, v in row.items()}
+        self._cache.put(project_id, project, generation)
+        return project
+
+    def get(self, project_id):
+        project = self._load(project_id)
+        return copy.deepcopy(project) if project is not None else None
+
+    def exists(self, project_id):
+        return self._load(project_id) is not None
+
+    def _modify(self, project_id, fn):
+        # Read-modify-write of a project: fn(project) returns (fields to
+        # set, result). Returns (result, version) with the new version, or
+        # None if the project does not exist.
+        key = self._key(project_id)
+
+        def modify(pipe):
+            version, progress, status = pipe.hmget(key, 'version', 'progress', 'status')
+            if version is None:
+                pipe.unwatch()
+                return None
+            project = {'version': int(version), 'progress': json.loads(progress), 'status': json.loads(status)}
+            fields, result = fn(project)
+            if isinstance(result, VersionConflict) or not fields:
+                pipe.unwatch()
+                return result, project['version']
+            created_at = pipe.zscore(f"{self.prefix}projects", project_id) if 'status' in fields else None
+            pipe.multi()
+            pipe.hset(key, mapping={k: json.dumps(v) for k, v in fields.items()})
+            pipe.hincrby(key, 'version', 1)
+            if 'status' in fields and fields['status'] != project['status']:
+                # Move the project to its new status set
+                pipe.zrem(self._status_key(project['status']), project_id)
+                pipe.zadd(self._status_key(fields['status']), {project_id: created_at or 0})
+            return result, project['version'] + 1
+
+        if not isinstance(project_id, str):
+            return None
+        outcome = self.client.transaction(modify, key, value_from_callable=True)
+        if outcome is not None and not isinstance(outcome[0], VersionConflict):
+            self._cache.invalidate(project_id)
+        return outcome
+
+    def update(self, project_id, expected_version=None, **fields):
+        fields = {k: v for k, v in fields.items() if k in PROJECT_FIELDS}
+
+        def update(project):
+            if expected_version is not None and project['version'] != expected_version:
+                return None, VersionConflict(project['version'])
+            return fields, None
+
+        outcome = self._modify(project_id, update)
+        if outcome is None:
+            return None
+        if isinstance(outcome[0], VersionConflict):
+            raise outcome[0]
+        return outcome[1]
+
+    def increment_progress(self, project_id, delta, limit=100, key=None):
+        # Applied keys are fields of a hash next to the project's, written in
+        # the same transaction as the new progress
+        if not isinstance(project_id, str):
+            return None
+        project_key, keys_key = self._key(project_id), f"{self._key(project_id)}:progress_keys"
+
+        def increment(pipe):
+            progress = pipe.hget(project_key, 'progress')
+            if progress is None or (key is not None and pipe.hexists(keys_key, key)):
+                pipe.unwatch()
+                return json.loads(progress) if progress is not None else None
+            progress = min(limit, (json.loads(progress) or 0) + delta)
+            pipe.multi()
+            pipe.hset(project_key, 'progress', json.dumps(progress))
+            pipe.hincrby(project_key, 'version', 1)
+            if key is not None:
+                pipe.hset(keys_key, key, 1)
+            return progress
+
+        progress = self.client.transaction(increment, project_key, keys_key, value_from_callable=True)
+        self._cache.invalidate(project_id)
+        return progress
+
+    def _task_members(self, tasks):
+        # Draws ids from the shared counter; returns (ids, ZADD mapping)
+        last = self.client.incrby(f"{self.prefix}task_ids", len(tasks))
+        ids = list(range(last - len(tasks) + 1, last + 1))
+        return ids, {json.dumps([task_id, task]): task_id for task_id, task in zip(ids, tasks)}
+
+    def append_task(self, project_id, task):
+        # Returns the new task's id, or None if the project does not exist.
+        # Projects are never deleted, so once one exists this needs no WATCH.
+        if not self.exists(project_id):
+            return None
+        ids, members = self._task_members([task])
+        pipe = self.client.pipeline(transaction=True)
+        pipe.zadd(self._tasks_key(project_id), members)
+        pipe.hincrby(self._key(project_id), 'task_count', 1)
+        pipe.execute()
+        self._cache.invalidate(project_id)
+        return ids[0]
+
+    def append_tasks(self, project_id, tasks, progress_delta=0):
+        # Appends all tasks and bumps progress in one transaction. Returns
+        # the new progress, or None if the project does not exist.
+        if not self.exists(project_id):
+            return None
+        _, members = self._task_members(tasks)
+        key = self._key(project_id)
+
+        def append(pipe):
+            progress = json.loads(pipe.hget(key, 'progress'))
+            pipe.multi()
+            pipe.hincrby(key, 'task_count', len(tasks))
+            if members:
+                pipe.zadd(self._tasks_key(project_id), members)
+            if progress_delta:
+                progress = min(100, (progress or 0) + progress_delta)
+                pipe.hset(key, 'progress', json.dumps(progress))
+                pipe.hincrby(key, 'version', 1)
+            return progress
+
+        progress = self.client.transaction(append, key, value_from_callable=True)
+        self._cache.invalidate(project_id)
+        return progress
+
+    def list_tasks(self, project_id, cursor=0, limit=100):
+        limit = max(1, min(limit, MAX_TASK_PAGE))
+        if not self.exists(project_id):
+            return None
+        members = self.client.zrangebyscore(self._tasks_key(project_id), f"({int(cursor)}", '+inf',
+                                            start=0, num=limit + 1)
+        return task_page([tuple(json.loads(member)) for member in members], limit)
+
+    def _index_statuses(self):
+        # Adds projects created before the per-status sets existed. Runs once
+        # per store (SET NX), on the first listing by status.
+        if self._status_indexed:
+            return
+        if self.client.set(f"{self.prefix}projects:status_indexed", 1, nx=True):
+            projects = self.client.zrange(f"{self.prefix}projects", 0, -1, withscores=True)
+            pipe = self.client.pipeline(transaction=False)
+            for project_id, _ in projects:
+                pipe.hget(self._key(project_id.decode('utf-8')), 'status')
+            statuses = pipe.execute()
+            for (project_id, created_at), status in zip(projects, statuses):
+                pipe.zadd(self._status_key(json.loads(status)), {project_id: created_at}, nx=True)
+            pipe.execute()
+        self._status_indexed = True
+
+    def list_projects(self, status=None):
+        if status is not None:
+            self._index_statuses()
+        key = f"{self.prefix}projects" if status is None else self._status_key(status)
+        project_ids = [project_id.decode('utf-8') for project_id in self.client.zrange(key, 0, -1)]
+        pipe = self.client.pipeline(transaction=False)
+        for project_id in project_ids:
+            pipe.hmget(self._key(project_id), 'name', 'status', 'progress')
+        listed = []
+        for project_id, row in zip(project_ids, pipe.execute()):
+            name, project_status, progress = (json.loads(value) for value in row)
+            listed.append({'project_id': project_id, 'name': name, 'status': project_status, 'progress': progress})
+        return listed
+
+    def close(self):
+        self._cache.close()
+
+
+def open_project_store():
+    kind = os.getenv('PROJECT_STORE', 'memory').lower()
+    if kind == 'redis':
+        return RedisProjectStore(shared_client(), prefix=os.getenv('REDIS_PREFIX', 'fusion:'),
+                                 cache_size=int(os.getenv('PROJECT_STORE_CACHE_SIZE', '1024')),
+                                 cache_ttl=float(os.getenv('PROJECT_STORE_CACHE_TTL', '30')))
+    if kind == 'sqlite':
+        return SQLiteProjectStore(os.getenv('PROJECT_STORE_PATH', 'projects.sqlite3'),
+                                  cache_size=int(os.getenv('PROJECT_STORE_CACHE_SIZE', '1024')))
+    return MemoryProjectStore()
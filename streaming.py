@@ -0,0 +1,43 @@
+import jsoncodec
+
+SSE_MIMETYPE = 'text/event-stream'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def stream_format(accept_header):
+    # NDJSON when the client asks for it, server-sent events otherwise
+    if accept_header and NDJSON_MIMETYPE in accept_header:
+        return NDJSON_MIMETYPE
+    return SSE_MIMETYPE
+
+
+def encode_event(mimetype, event):
+    # event is a dict with a "type" of delta, done or error
+    data = jsoncodec.dumps(event)
+    if mimetype == NDJSON_MIMETYPE:
+        return data + '\n'
+    return f"event: {event['type']}\ndata: {data}\n\n"
+
+
+def parse_openai_line(line):
+    # Parses one line of an OpenAI chat completion stream ("data: {...}",
+    # terminated by "data: [DONE]"). Returns (done, content_fragment).
+    if isinstance(line, bytes):
+        line = line.decode('utf-8')
+    line = line.strip()
+    if not line.startswith('data:'):
+        return False, None
+    data = line[len('data:'):].strip()
+    if data == '[DONE]':
+        return True, None
+    choices = jsoncodec.loads(data).get('choices') or [{}]
+    return False, choices[0].get('delta', {}).get('content') or None
+
+
+def openai_deltas(lines):
+    for line in lines:
+        done, content = parse_openai_line(line)
+        if done:
+            return
+        if content:
+            yield content
@@ -0,0 +1,68 @@
+import unittest
+from actions import (BLACKBOX_ACTIONS, CHATGPT_ACTIONS, ActionTable, ChatAction, cacheable, parse_action_settings,
+                     streamable)
+
+
+class TestActions(unittest.TestCase):
+    def test_chatgpt_payloads(self):
+        payload = CHATGPT_ACTIONS.get('generate_code').payload({'description': 'a sort'})
+        self.assertEqual(payload, {"model": "gpt-3.5-turbo",
+                                   "messages": [{"role": "user", "content": "Generate python code for: a sort"}]})
+        prompt = CHATGPT_ACTIONS.get('interpret_command').prompt({'command': 'add task'})
+        self.assertTrue(prompt.endswith("creation or update:\nadd task"))
+        self.assertEqual(CHATGPT_ACTIONS.get('answer_query').prompt({'query': 'Why {x}?'}), 'Why {x}?')
+        self.assertEqual(CHATGPT_ACTIONS.get('answer_query').prompt({}), '')
+
+    def test_chatgpt_result(self):
+        result, status = CHATGPT_ACTIONS.get('generate_documentation').result('Docs')
+        self.assertEqual(status, 200)
+        self.assertEqual(result, {"status": "OK", "message": "Generate documentation completed",
+                                  "content": "Docs", "documentation": "Docs"})
+
+    def test_blackbox_actions(self):
+        search = BLACKBOX_ACTIONS.get('search_code')
+        self.assertEqual(search.endpoint, 'search')
+        self.assertEqual(search.payload({'query': 'sort'}), {'query': 'sort', 'language': 'python'})
+        self.assertEqual(search.result({}), ({"status": "Error", "message": "No code found"}, 404))
+        self.assertEqual(search.result({'code': 'x = 1'}),
+                         ({"status": "OK", "message": "Code found", "snippet": 'x = 1'}, 200))
+
+    def test_lookup(self):
+        self.assertIsNone(CHATGPT_ACTIONS.get('unknown'))
+        self.assertIsNone(CHATGPT_ACTIONS.get(['generate_code']))
+        self.assertTrue(cacheable('chatgpt', 'generate_code'))
+        self.assertFalse(cacheable('chatgpt', 'answer_query'))
+        self.assertTrue(cacheable('blackbox', 'optimize_code'))
+        self.assertFalse(cacheable('devin', 'generate_code'))
+        self.assertTrue(streamable('generate_documentation'))
+        self.assertFalse(streamable('interpret_command'))
+
+    def test_register(self):
+        table = ActionTable('test')
+
+        @table.register('ping')
+        def ping(data):
+            return data
+
+        self.assertIs(table.get('ping'), ping)
+        self.assertEqual(table.names(), ['ping'])
+
+    def test_settings(self):
+        settings = parse_action_settings("interpret_command=model:gpt-4o-mini, max_tokens:256; answer_query=temperature:0.2")
+        self.assertEqual(settings, {'interpret_command': {'model': 'gpt-4o-mini', 'max_tokens': 256},
+                                    'answer_query': {'temperature': 0.2}})
+        self.assertEqual(parse_action_settings(None), {})
+
+        table = ActionTable('test')
+        table.add('summarize', ChatAction('summarize', "Summarize: {text}", result_field='summary'))
+        table.configure({**settings, 'summarize': {'model': 'gpt-4o-mini', 'max_tokens': 64}})
+        payload = table.get('summarize').payload({'text': 'abc'})
+        self.assertEqual(payload['model'], 'gpt-4o-mini')
+        self.assertEqual(payload['max_tokens'], 64)
+        self.assertEqual(payload['messages'][0]['content'], 'Summarize: abc')
+        with self.assertRaises(ValueError):
+            table.get('summarize').configure(stream=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,20 @@
+import os
+import tempfile
 import unittest
-from unittest.mock import patch
-from app import app
+from unittest.mock import MagicMock, patch
+from app import create_app
+from cache import ResponseCache, MemoryBackend
+from semantic import SemanticCache, SemanticIndex
+from tokens import TokenBudget
 import json
-import os
 import requests
+import threading
+import time
+import git
+
+# Background jobs go to a throwaway queue file, never one in the repo
+os.environ['JOB_QUEUE_PATH'] = os.path.join(tempfile.mkdtemp(), 'jobs.sqlite3')
+app = create_app()
 
 class TestAIFusionAPI(unittest.TestCase):
     def setUp(self):
@@ -15,8 +26,12 @@ class TestAIFusionAPI(unittest.TestCase):
             'BLACKBOX_API_KEY': 'mock_blackbox_key'
         })
         self.env_patcher.start()
+        # Disable response caching so repeated payloads always reach the mocks
+        self.cache_patcher = patch('app.response_cache', ResponseCache(None))
+        self.cache_patcher.start()
 
     def tearDown(self):
+        self.cache_patcher.stop()
         self.env_patcher.stop()
 
     def test_health_check(self):
@@ -39,7 +54,7 @@ class TestAIFusionAPI(unittest.TestCase):
 
     def test_chatgpt_generate_code(self):
         # Test successful code generation
-        with patch('app.requests.post') as mock_post:
+        with patch('app.upstream_client.post') as mock_post:
             mock_post.return_value.json.return_value = {
                 'choices': [{'message': {'content': 'print("Hello, World!")'}}]
             }
@@ -71,7 +86,7 @@ class TestAIFusionAPI(unittest.TestCase):
         self.assertEqual(data['message'], 'Invalid action for ChatGPT')
 
         # Test missing description
-        with patch('app.requests.post') as mock_post:
+        with patch('app.upstream_client.post') as mock_post:
             mock_post.return_value.json.return_value = {
                 'choices': [{'message': {'content': 'print("Default code")'}}]
             }
@@ -99,7 +114,7 @@ class TestAIFusionAPI(unittest.TestCase):
             self.assertEqual(data['message'], 'ChatGPT API key not configured')
 
         # Test API error
-        with patch('app.requests.post') as mock_post:
+        with patch('app.upstream_client.post') as mock_post:
             mock_post.side_effect = requests.exceptions.RequestException("API Error")
             response = self.app.post('/chatgpt', json={
                 'action': 'generate_code',
@@ -113,7 +128,7 @@ class TestAIFusionAPI(unittest.TestCase):
 
     def test_blackbox_search_code(self):
         # Test successful code search
-        with patch('app.requests.post') as mock_post:
+        with patch('app.upstream_client.post') as mock_post:
             mock_post.return_value.json.return_value = {'code': 'def quicksort(arr): pass'}
             response = self.app.post('/blackbox', json={
                 'action': 'search_code',
@@ -127,7 +142,7 @@ class TestAIFusionAPI(unittest.TestCase):
             self.assertIn('snippet', data)
 
         # Test no code found
-        with patch('app.requests.post') as mock_post:
+        with patch('app.upstream_client.post') as mock_post:
             mock_post.return_value.json.return_value = {}
             response = self.app.post('/blackbox', json={
                 'action': 'search_code',
@@ -183,7 +198,7 @@ class TestAIFusionAPI(unittest.TestCase):
         self.assertEqual(update_data['message'], 'Project status updated')
 
     def test_chatgpt_generate_documentation(self):
-        with patch('app.requests.post') as mock_post:
+        with patch('app.upstream_client.post') as mock_post:
             mock_post.return_value.json.return_value = {
                 'choices': [{'message': {'content': 'Sample documentation'}}]
             }
@@ -203,7 +218,7 @@ class TestAIFusionAPI(unittest.TestCase):
             self.assertTrue(len(data['documentation']) > 0)
 
     def test_blackbox_optimize_code(self):
-        with patch('app.requests.post') as mock_post:
+        with patch('app.upstream_client.post') as mock_post:
             mock_post.return_value.json.return_value = {
                 'status': 'OK',
                 'message': 'Code optimized',
@@ -255,8 +270,14 @@ class TestAIFusionAPI(unittest.TestCase):
         self.assertIn('generated_code', data)
         self.assertIn('optimized_code', data)
         self.assertIn('project_progress', data)
-        self.assertIn('project_tasks', data)
-        self.assertIn('Implement: Create a function to calculate the factorial of a number', data['project_tasks'])
+        self.assertEqual(data['task_count'], 1)
+        self.assertNotIn('project_tasks', data)
+
+        page = json.loads(self.app.post('/devin', json={'action': 'list_tasks', 'project_id': project_id}).data)
+        self.assertEqual(page['tasks'], [{
+            'task_id': data['task_id'],
+            'task': 'Implement: Create a function to calculate the factorial of a number'
+        }])
 
         mock_chatgpt.assert_called_once()
         mock_blackbox.assert_called_once()
@@ -293,6 +314,7 @@ class TestAIFusionAPI(unittest.TestCase):
         self.assertEqual(data['status'], 'OK')
         self.assertEqual(data['message'], 'Integrated AI task completed')
         self.assertEqual(data['generated_code'], data['optimized_code'])
+        self.assertEqual(data['optimization_error'], 'Blackbox AI optimization failed')
 
         # Test invalid project ID
         response = self.app.post('/integrate', json={
@@ -304,12 +326,738 @@ class TestAIFusionAPI(unittest.TestCase):
         self.assertEqual(data['status'], 'Error')
         self.assertEqual(data['message'], 'Project not found')
 
+class TestResponseCaching(unittest.TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.app.testing = True
+        self.cache_patcher = patch('app.response_cache', ResponseCache(MemoryBackend()))
+        self.cache_patcher.start()
+
+    def tearDown(self):
+        self.cache_patcher.stop()
+
+    def test_chatgpt_cache_hit_and_miss(self):
+        with patch('app.upstream_client.post') as mock_post:
+            mock_post.return_value.json.return_value = {
+                'choices': [{'message': {'content': 'print("cached")'}}]
+            }
+            first = self.app.post('/chatgpt', json={'action': 'generate_code', 'description': 'cache me'})
+            second = self.app.post('/chatgpt', json={'action': 'generate_code', 'description': 'cache me  \n'})
+            self.assertEqual(first.headers['X-Cache'], 'MISS')
+            self.assertEqual(second.headers['X-Cache'], 'HIT')
+            self.assertEqual(json.loads(second.data)['code'], 'print("cached")')
+            mock_post.assert_called_once()
+
+    def test_uncacheable_action_bypasses_cache(self):
+        with patch('app.upstream_client.post') as mock_post:
+            mock_post.return_value.json.return_value = {
+                'choices': [{'message': {'content': 'An answer'}}]
+            }
+            for _ in range(2):
+                response = self.app.post('/chatgpt', json={'action': 'answer_query', 'query': 'why?'})
+                self.assertNotIn('X-Cache', response.headers)
+            self.assertEqual(mock_post.call_count, 2)
+
+    def test_blackbox_errors_are_not_cached(self):
+        with patch('app.upstream_client.post') as mock_post:
+            mock_post.return_value.json.return_value = {}
+            response = self.app.post('/blackbox', json={'action': 'analyze_complexity', 'code': 'def f(): pass'})
+            self.assertEqual(response.status_code, 500)
+            mock_post.return_value.json.return_value = {'analysis': 'O(1)'}
+            response = self.app.post('/blackbox', json={'action': 'analyze_complexity', 'code': 'def f(): pass'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers['X-Cache'], 'MISS')
+            self.assertEqual(mock_post.call_count, 2)
+
+def stream_lines(*fragments):
+    lines = [f'data: {json.dumps({"choices": [{"delta": {"content": f}}]})}'.encode() for f in fragments]
+    return lines + [b'data: [DONE]']
+
+def parse_sse(body):
+    return [json.loads(block.split('data: ', 1)[1]) for block in body.strip().split('\n\n')]
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.app.testing = True
+        self.patchers = [
+            patch('app.CHATGPT_API_KEY', 'mock_chatgpt_key'),
+            patch('app.response_cache', ResponseCache(MemoryBackend())),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def test_chatgpt_streams_tokens_and_caches_result(self):
+        with patch('app.upstream_client.post') as mock_post:
+            mock_post.return_value.iter_lines.return_value = stream_lines('def f():', '\n    pass')
+            response = self.app.post('/chatgpt', json={
+                'action': 'generate_code', 'description': 'stub', 'stream': True
+            })
+            self.assertEqual(response.mimetype, 'text/event-stream')
+            events = parse_sse(response.get_data(as_text=True))
+            self.assertEqual([e['type'] for e in events], ['delta', 'delta', 'done'])
+            self.assertEqual(events[-1]['result']['code'], 'def f():\n    pass')
+            self.assertTrue(mock_post.call_args.kwargs['json']['stream'])
+
+            # The assembled result is served from the cache by the non-streaming path
+            response = self.app.post('/chatgpt', json={'action': 'generate_code', 'description': 'stub'})
+            self.assertEqual(response.headers['X-Cache'], 'HIT')
+            self.assertEqual(json.loads(response.data)['code'], 'def f():\n    pass')
+            mock_post.assert_called_once()
+
+    def test_ndjson_stream(self):
+        with patch('app.upstream_client.post') as mock_post:
+            mock_post.return_value.iter_lines.return_value = stream_lines('answer')
+            response = self.app.post('/chatgpt', json={
+                'action': 'generate_code', 'description': 'ndjson', 'stream': True
+            }, headers={'Accept': 'application/x-ndjson'})
+            self.assertEqual(response.mimetype, 'application/x-ndjson')
+            events = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+            self.assertEqual(events[-1]['result']['content'], 'answer')
+
+    def test_streamed_documentation_is_stored_on_project(self):
+        project_id = json.loads(self.app.post('/devin', json={'action': 'create_project'}).data)['project_id']
+        with patch('app.upstream_client.post') as mock_post:
+            mock_post.return_value.iter_lines.return_value = stream_lines('# Docs', '\nBody')
+            response = self.app.post('/devin', json={
+                'action': 'generate_documentation', 'project_id': project_id,
+                'description': 'docs', 'stream': True
+            })
+            events = parse_sse(response.get_data(as_text=True))
+        self.assertEqual(events[-1]['result']['documentation'], '# Docs\nBody')
+        from app import project_store
+        self.assertEqual(project_store.get(project_id)['documentation']['documentation'], '# Docs\nBody')
+
+    def test_speculative_integrate(self):
+        project_id = json.loads(self.app.post('/devin', json={'action': 'create_project', 'name': 'Spec'}).data)['project_id']
+
+        def optimize(data):
+            # Blackbox replies without the trailing newline of the block
+            return {'status': 'OK', 'optimized_code': data['code'].strip('\n').replace('return', 'return  ')}
+
+        with patch('app.upstream_client.post') as mock_post, patch('app.blackbox_ai', side_effect=optimize) as mock_blackbox:
+            mock_post.return_value.iter_lines.return_value = stream_lines(
+                'def a():\n    return 1\n', '\ndef b():', '\n    return 2')
+            response = self.app.post('/integrate', json={
+                'project_id': project_id, 'code_description': 'two functions', 'speculative': True
+            })
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['generated_code'], 'def a():\n    return 1\n\ndef b():\n    return 2')
+        self.assertEqual(data['optimized_code'], 'def a():\n    return   1\n\n\ndef b():\n    return   2')
+        self.assertIsNone(data['optimization_error'])
+        self.assertEqual(mock_blackbox.call_count, 2)
+        self.assertTrue(mock_post.call_args.kwargs['json']['stream'])
+        self.assertEqual(data['task_count'], 1)
+
+    def test_stream_rate_limited_before_first_byte(self):
+        with patch('app.upstream_client.post') as mock_post:
+            mock_post.return_value.status_code = 429
+            mock_post.return_value.raise_for_status.side_effect = requests.exceptions.HTTPError(response=mock_post.return_value)
+            response = self.app.post('/chatgpt', json={
+                'action': 'generate_documentation', 'description': 'limited', 'stream': True
+            })
+            self.assertEqual(response.status_code, 429)
+
+class TestTaskLog(unittest.TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.app.testing = True
+        create_response = self.app.post('/devin', json={'action': 'create_project', 'name': 'Task Log'})
+        self.project_id = json.loads(create_response.data)['project_id']
+
+    def list_tasks(self, **kwargs):
+        response = self.app.post('/devin', json={'action': 'list_tasks', 'project_id': self.project_id, **kwargs})
+        return response.status_code, json.loads(response.data)
+
+    def test_cursor_pagination_and_incremental_read(self):
+        for i in range(5):
+            self.app.post('/devin', json={'action': 'add_task', 'project_id': self.project_id, 'task': f't{i}'})
+        _, first = self.list_tasks(limit=2)
+        self.assertEqual([t['task'] for t in first['tasks']], ['t0', 't1'])
+        self.assertTrue(first['has_more'])
+        _, rest = self.list_tasks(cursor=first['next_cursor'], limit=10)
+        self.assertEqual([t['task'] for t in rest['tasks']], ['t2', 't3', 't4'])
+        self.assertFalse(rest['has_more'])
+
+        # Nothing new since the last cursor until another task is added
+        _, empty = self.list_tasks(cursor=rest['next_cursor'])
+        self.assertEqual(empty['tasks'], [])
+        self.assertIsNone(empty['next_cursor'])
+        added = json.loads(self.app.post('/devin', json={
+            'action': 'add_task', 'project_id': self.project_id, 'task': 't5'}).data)
+        _, since = self.list_tasks(cursor=rest['next_cursor'])
+        self.assertEqual(since['tasks'], [{'task_id': added['task_id'], 'task': 't5'}])
+
+    def test_list_tasks_errors(self):
+        status, _ = self.list_tasks(cursor='abc')
+        self.assertEqual(status, 400)
+        response = self.app.post('/devin', json={'action': 'list_tasks', 'project_id': 'invalid_id'})
+        self.assertEqual(response.status_code, 404)
+
+class TestUpstreamFailures(unittest.TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.app.testing = True
+        self.cache_patcher = patch('app.response_cache', ResponseCache(None))
+        self.cache_patcher.start()
+
+    def tearDown(self):
+        self.cache_patcher.stop()
+
+    def test_open_circuit_returns_503(self):
+        from resilience import CircuitOpenError
+        with patch('app.upstream_client.post', side_effect=CircuitOpenError('chatgpt', 12.5)):
+            response = self.app.post('/chatgpt', json={'action': 'answer_query', 'query': 'q'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '13')
+
+    def test_timeout_returns_504(self):
+        with patch('app.upstream_client.post', side_effect=requests.exceptions.ReadTimeout()):
+            response = self.app.post('/blackbox', json={'action': 'optimize_code', 'code': 'x'})
+        self.assertEqual(response.status_code, 504)
+        self.assertEqual(json.loads(response.data)['message'], 'Blackbox API timed out')
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.app.testing = True
+        self.cache_patcher = patch('app.response_cache', ResponseCache(None))
+        self.cache_patcher.start()
+
+    def tearDown(self):
+        self.cache_patcher.stop()
+
+    def test_request_and_upstream_metrics(self):
+        import metrics
+        requests_before = metrics.HTTP_REQUESTS.value('/chatgpt', 'answer_query', '200')
+        upstream_before = metrics.UPSTREAM_REQUESTS.value('chatgpt', 'answer_query', '200')
+        upstream_response = MagicMock(status_code=200)
+        upstream_response.json.return_value = {'choices': [{'message': {'content': 'answer'}}]}
+        session = MagicMock()
+        session.post.return_value = upstream_response
+        with patch('app.upstream_client.session', return_value=session):
+            response = self.app.post('/chatgpt', json={'action': 'answer_query', 'query': 'q'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(metrics.HTTP_REQUESTS.value('/chatgpt', 'answer_query', '200'), requests_before + 1)
+        self.assertEqual(metrics.UPSTREAM_REQUESTS.value('chatgpt', 'answer_query', '200'), upstream_before + 1)
+
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        text = response.get_data(as_text=True)
+        self.assertIn('fusion_http_requests_total{route="/chatgpt",action="answer_query",status="200"}', text)
+        self.assertIn('fusion_upstream_duration_seconds_count{upstream="chatgpt",action="answer_query"}', text)
+        self.assertIn('fusion_http_local_duration_seconds_bucket{route="/chatgpt",action="answer_query",le="+Inf"}', text)
+
+    def test_unknown_actions_share_one_label(self):
+        import metrics
+        before = metrics.HTTP_REQUESTS.value('unmatched', 'other', '404')
+        # Error pages are sent as closing iterators; they are counted once closed
+        self.app.post('/health', json={'action': 'no_such_action_1'}).close()
+        self.app.post('/health', json={'action': 'no_such_action_2'}).close()
+        self.assertEqual(metrics.HTTP_REQUESTS.value('unmatched', 'other', '404'), before + 2)
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        from tracing import Tracer
+        from test_tracing import ListExporter
+        self.app = app.test_client()
+        self.app.testing = True
+        self.exporter = ListExporter()
+        self.tracer = Tracer(exporter=self.exporter)
+        self.patchers = [patch('app.response_cache', ResponseCache(None)), patch('app.tracer', self.tracer)]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def upstream_session(self):
+        def post(url, **kwargs):
+            response = MagicMock(status_code=200)
+            if url.endswith('/optimize'):
+                response.json.return_value = {'optimized_code': kwargs['json']['code']}
+            else:
+                response.json.return_value = {'choices': [{'message': {'content': 'def f():\n    pass\n'}}]}
+            return response
+        session = MagicMock()
+        session.post.side_effect = post
+        return session
+
+    def test_integrate_call_chain(self):
+        project_id = json.loads(self.app.post('/devin', json={'action': 'create_project', 'name': 'Traced'}).data)['project_id']
+        with patch('app.upstream_client.session', return_value=self.upstream_session()):
+            response = self.app.post('/integrate', json={'project_id': project_id, 'code_description': 'f'})
+        self.assertEqual(response.status_code, 200)
+        trace_id = response.headers['X-Trace-Id']
+        self.tracer.flush()
+        spans = [s for s in self.exporter.spans if s['traceId'] == trace_id]
+        by_id = {s['spanId']: s for s in spans}
+
+        def chain(leaf):
+            names = [leaf['name']]
+            while 'parentSpanId' in leaf:
+                leaf = by_id[leaf['parentSpanId']]
+                names.append(leaf['name'])
+            return names[::-1]
+
+        clients = [s for s in spans if s['kind'] == 3]
+        self.assertEqual(sorted(chain(s)[-1] for s in clients), ['POST blackbox', 'POST chatgpt'])
+        chatgpt_call = next(s for s in clients if s['name'] == 'POST chatgpt')
+        self.assertEqual(chain(chatgpt_call), ['POST /integrate', 'integrate_code', 'integrate.generate', 'chatgpt',
+                                               'POST chatgpt'])
+
+    def test_incoming_traceparent_is_continued(self):
+        trace_id = '4bf92f3577b34da6a3ce929d0e0e4736'
+        response = self.app.get('/', headers={'traceparent': f'00-{trace_id}-00f067aa0ba902b7-01'})
+        self.assertEqual(response.headers['X-Trace-Id'], trace_id)
+        self.tracer.flush()
+        self.assertEqual(self.exporter.spans[0]['parentSpanId'], '00f067aa0ba902b7')
+
+class TestProjectReads(unittest.TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.app.testing = True
+        create_response = self.app.post('/devin', json={'action': 'create_project', 'name': 'Read Project'})
+        self.project_id = json.loads(create_response.data)['project_id']
+
+    def test_project_state(self):
+        response = self.app.get(f'/projects/{self.project_id}')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['project']['name'], 'Read Project')
+        self.assertNotIn('documentation', data['project'])
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        self.assertEqual(self.app.get('/projects/missing').status_code, 404)
+        self.assertEqual(self.app.get('/projects/missing/documentation').status_code, 404)
+
+    def test_conditional_get(self):
+        first = self.app.get(f'/projects/{self.project_id}')
+        etag = first.headers['ETag']
+        cached = self.app.get(f'/projects/{self.project_id}', headers={'If-None-Match': etag})
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.data, b'')
+        self.assertEqual(cached.headers['ETag'], etag)
+
+        self.app.post('/devin', json={'action': 'update_progress', 'project_id': self.project_id, 'progress': 50})
+        changed = self.app.get(f'/projects/{self.project_id}', headers={'If-None-Match': etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers['ETag'], etag)
+
+    def test_versioned_update(self):
+        version = json.loads(self.app.get(f'/projects/{self.project_id}').data)['project']['version']
+        update = {'action': 'update_status', 'project_id': self.project_id, 'status': 'Active', 'version': version}
+        response = self.app.post('/devin', json=update)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['version'], version + 1)
+
+        # A second writer holding the same read loses the race
+        stale = self.app.post('/devin', json={**update, 'status': 'Stale'})
+        self.assertEqual(stale.status_code, 409)
+        self.assertEqual(json.loads(stale.data)['version'], version + 1)
+        self.assertEqual(self.app.post('/devin', json={**update, 'version': 'x'}).status_code, 400)
+        self.assertEqual(json.loads(self.app.get(f'/projects/{self.project_id}').data)['project']['status'], 'Active')
+
+    def test_documentation_is_compressed(self):
+        import gzip
+        import app as fusion
+        fusion.store_documentation(self.project_id, '## Usage\nCall the function.\n' * 200)
+        response = self.app.get(f'/projects/{self.project_id}/documentation', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        data = json.loads(gzip.decompress(response.data))
+        self.assertTrue(data['documentation']['documentation'].startswith('## Usage'))
+        self.assertTrue(response.headers['ETag'].endswith('-gzip"'))
+
+        # The ETag of the compressed representation revalidates too
+        cached = self.app.get(f'/projects/{self.project_id}/documentation',
+                              headers={'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']})
+        self.assertEqual(cached.status_code, 304)
+
+        plain = self.app.get(f'/projects/{self.project_id}/documentation')
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(json.loads(plain.data), data)
+
+class TestCloneJobs(unittest.TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.app.testing = True
+        create_response = self.app.post('/devin', json={'action': 'create_project', 'name': 'Clone Project'})
+        self.project_id = json.loads(create_response.data)['project_id']
+
+    @patch('app.clone_repository')
+    def test_background_clone_returns_job_id(self, mock_clone):
+        release = threading.Event()
+
+        def clone(repo_url, path, report, **options):
+            report(stage='receiving', percent=40.0)
+            release.wait(5)
+            return {'path': path}
+
+        mock_clone.side_effect = clone
+        response = self.app.post('/devin', json={
+            'action': 'integrate_git', 'project_id': self.project_id,
+            'repo_url': 'https://example.com/repo.git', 'depth': 1, 'filter': 'blob:none', 'background': True
+        })
+        self.assertEqual(response.status_code, 202)
+        data = json.loads(response.data)
+        self.assertEqual(data['status_url'], f"/jobs/{data['job_id']}")
+
+        from app import clone_jobs
+        release.set()
+        clone_jobs.wait(data['job_id'], timeout=5)
+        mock_clone.assert_called_once()
+        self.assertEqual(mock_clone.call_args.kwargs['depth'], 1)
+        self.assertEqual(mock_clone.call_args.kwargs['filter'], 'blob:none')
+        job = json.loads(self.app.get(data['status_url']).data)['job']
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(job['progress'], {'stage': 'receiving', 'percent': 40.0})
+        self.assertEqual(self.app.get('/jobs/missing').status_code, 404)
+
+    @patch('app.clone_repository')
+    def test_foreground_clone_waits_for_job(self, mock_clone):
+        mock_clone.side_effect = git.GitCommandError('clone', 128)
+        response = self.app.post('/devin', json={
+            'action': 'integrate_git', 'project_id': self.project_id, 'repo_url': 'https://example.com/repo.git'
+        })
+        self.assertEqual(json.loads(response.data)['message'], 'Failed to clone Git repository')
+
+    def test_invalid_clone_options(self):
+        response = self.app.post('/devin', json={
+            'action': 'integrate_git', 'project_id': self.project_id,
+            'repo_url': 'https://example.com/repo.git', 'depth': -1
+        })
+        self.assertEqual(response.status_code, 400)
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.app.testing = True
+        self.cache_patcher = patch('app.response_cache', ResponseCache(None))
+        self.cache_patcher.start()
+        create_response = self.app.post('/devin', json={'action': 'create_project', 'name': 'Batch Project'})
+        self.project_id = json.loads(create_response.data)['project_id']
+
+    def tearDown(self):
+        self.cache_patcher.stop()
+
+    @patch('app.blackbox_ai')
+    @patch('app.chatgpt')
+    def test_integrate_batch_in_order_with_single_project_update(self, mock_chatgpt, mock_blackbox):
+        mock_chatgpt.side_effect = lambda data: (
+            {'status': 'Error', 'message': 'Failed'} if data['description'] == 'broken'
+            else {'status': 'OK', 'code': f"# {data['description']}"})
+        mock_blackbox.side_effect = lambda data: {'status': 'OK', 'optimized_code': data['code'] + ' (optimized)'}
+
+        response = self.app.post('/batch', json={
+            'kind': 'integrate',
+            'project_id': self.project_id,
+            'items': ['one', {'code_description': 'two'}, 'broken', 'four'],
+            'concurrency': 3
+        })
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['index'] for r in data['results']], [0, 1, 2, 3])
+        self.assertEqual(data['results'][1]['result']['optimized_code'], '# two (optimized)')
+        self.assertEqual(data['results'][2]['status_code'], 500)
+        self.assertEqual((data['completed'], data['failed']), (3, 1))
+        self.assertEqual(data['project_progress'], 30)
+
+        from app import project_store
+        tasks = project_store.list_tasks(self.project_id)['tasks']
+        self.assertEqual([t['task'] for t in tasks],
+                         ['Implement: one', 'Implement: two', 'Implement: broken', 'Implement: four'])
+
+    @patch('app.chatgpt')
+    def test_chatgpt_batch_stream(self, mock_chatgpt):
+        mock_chatgpt.side_effect = lambda data: {'status': 'OK', 'answer': data['query'].upper()}
+        response = self.app.post('/batch', json={
+            'kind': 'chatgpt',
+            'items': [{'action': 'answer_query', 'query': q} for q in ('a', 'b', 'c')],
+            'stream': True
+        })
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(sorted(line['result']['answer'] for line in lines[:-1]), ['A', 'B', 'C'])
+        self.assertTrue(lines[-1]['done'])
+        self.assertEqual(lines[-1]['completed'], 3)
+        self.assertNotIn('project_progress', lines[-1])
+
+    @patch('app.blackbox_ai')
+    @patch('app.chatgpt')
+    def test_stream_disconnect_still_updates_project(self, mock_chatgpt, mock_blackbox):
+        release = threading.Event()
+
+        def generate(data):
+            if data['description'] != 'first':
+                release.wait(5)
+            return {'status': 'OK', 'code': 'x = 1'}
+
+        mock_chatgpt.side_effect = generate
+        mock_blackbox.return_value = {'status': 'OK', 'optimized_code': 'x = 1'}
+        response = self.app.post('/batch', json={
+            'kind': 'integrate', 'project_id': self.project_id, 'items': ['first', 'second', 'third'], 'stream': True
+        }, buffered=False)
+        first = json.loads(next(iter(response.response)))
+        self.assertEqual(first['index'], 0)
+        # The client goes away before the batch is done
+        response.close()
+        release.set()
+
+        from app import project_store
+        deadline = time.monotonic() + 5
+        while project_store.get(self.project_id)['task_count'] != 3:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        self.assertEqual(project_store.get(self.project_id)['progress'], 30)
+
+    def test_batch_concurrency_is_bounded_on_the_shared_pool(self):
+        running, peak, lock = [0], [0], threading.Lock()
+
+        def item(data):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+            return {'status': 'OK', 'answer': data['query']}
+
+        with patch('app.chatgpt', side_effect=item):
+            response = self.app.post('/batch', json={
+                'kind': 'chatgpt', 'items': [{'action': 'answer_query', 'query': str(i)} for i in range(12)],
+                'concurrency': 3
+            })
+        data = json.loads(response.data)
+        self.assertEqual([r['result']['answer'] for r in data['results']], [str(i) for i in range(12)])
+        self.assertEqual(peak[0], 3)
+
+    def test_batch_validation(self):
+        response = self.app.post('/batch', json={'kind': 'integrate', 'project_id': 'invalid_id', 'items': ['x']})
+        self.assertEqual(response.status_code, 404)
+        response = self.app.post('/batch', json={'kind': 'integrate', 'project_id': self.project_id, 'items': []})
+        self.assertEqual(response.status_code, 400)
+        response = self.app.post('/batch', json={'kind': 'unknown', 'items': ['x']})
+        self.assertEqual(json.loads(response.data)['message'], 'Invalid batch kind')
+        with patch('app.BATCH_MAX_ITEMS', 2):
+            response = self.app.post('/batch', json={'kind': 'chatgpt', 'items': [{}, {}, {}]})
+            self.assertEqual(response.status_code, 400)
+
+class TestInputBudget(unittest.TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.app.testing = True
+        self.patchers = [
+            patch('app.CHATGPT_API_KEY', 'mock_chatgpt_key'),
+            patch('app.BLACKBOX_API_KEY', 'mock_blackbox_key'),
+            patch('app.response_cache', ResponseCache(None)),
+            patch('app.token_budget', TokenBudget(max_tokens=60, max_chunks=100)),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+        self.code = "".join(f"def f{i}(value):\n    return value * {i} + len(str(value))\n\n\n" for i in range(12))
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def test_large_code_is_chunked_and_merged_in_order(self):
+        def optimize(upstream, action, url, headers=None, json=None, **kwargs):
+            response = MagicMock()
+            response.json.return_value = {'optimized_code': json['code'].replace('value', 'v')}
+            return response
+
+        with patch('app.upstream_client.post', side_effect=optimize) as mock_post:
+            response = self.app.post('/blackbox', headers={'Authorization': 'Bearer mock_blackbox_key'},
+                                     json={'action': 'optimize_code', 'code': self.code})
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        chunks = int(response.headers['X-Input-Chunks'])
+        self.assertGreater(chunks, 1)
+        self.assertEqual(mock_post.call_count, chunks)
+        self.assertEqual(data['optimized_code'].split('\n\n\n'), self.code.replace('value', 'v').strip().split('\n\n\n'))
+
+    def test_failed_chunk_fails_request(self):
+        with patch('app.upstream_client.post') as mock_post:
+            mock_post.return_value.json.side_effect = [{'analysis': 'O(1)'}, {}] + [{'analysis': 'O(1)'}] * 20
+            response = self.app.post('/blackbox', headers={'Authorization': 'Bearer mock_blackbox_key'},
+                                     json={'action': 'analyze_complexity', 'code': self.code})
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(json.loads(response.data)['message'], 'Failed to analyze code complexity')
+
+    def test_oversize_modes(self):
+        description = "Describe the service. " * 50
+        with patch('app.upstream_client.post') as mock_post:
+            mock_post.return_value.json.return_value = {'choices': [{'message': {'content': 'Docs'}}]}
+            response = self.app.post('/chatgpt', json={'action': 'generate_documentation', 'description': description,
+                                                       'oversize': 'truncate'})
+            self.assertEqual(response.headers['X-Input-Truncated'], 'true')
+            prompt = mock_post.call_args.kwargs['json']['messages'][0]['content']
+            self.assertLess(len(prompt), len(description))
+
+            response = self.app.post('/chatgpt', json={'action': 'generate_documentation', 'description': description,
+                                                       'oversize': 'reject'})
+            self.assertEqual(response.status_code, 413)
+            response = self.app.post('/chatgpt', json={'action': 'generate_documentation', 'description': description,
+                                                       'oversize': 'shrink'})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(mock_post.call_count, 1)
+
+            response = self.app.post('/chatgpt', json={'action': 'generate_documentation', 'description': description})
+            self.assertEqual(json.loads(response.data)['documentation'], '\n\n'.join(
+                ['Docs'] * int(response.headers['X-Input-Chunks'])))
+
+class TestSemanticCaching(unittest.TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.app.testing = True
+        self.patchers = [
+            patch('app.CHATGPT_API_KEY', 'mock_chatgpt_key'),
+            patch('app.response_cache', ResponseCache(None)),
+            patch('app.semantic_cache', SemanticCache(SemanticIndex(use_numpy=False), threshold=0.8)),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def test_paraphrase_is_served_from_semantic_cache(self):
+        with patch('app.upstream_client.post') as mock_post:
+            mock_post.return_value.json.return_value = {'choices': [{'message': {'content': 'Use reversed()'}}]}
+            first = self.app.post('/chatgpt', json={'action': 'answer_query', 'query': 'How do I reverse a list in Python?'})
+            second = self.app.post('/chatgpt', json={'action': 'answer_query', 'query': 'how can I reverse a python list'})
+            third = self.app.post('/chatgpt', json={'action': 'answer_query', 'query': 'What is the capital of France?'})
+        self.assertNotIn('X-Cache', first.headers)
+        self.assertEqual(second.headers['X-Cache-Match'], 'semantic')
+        self.assertGreater(float(second.headers['X-Cache-Similarity']), 0.8)
+        self.assertEqual(json.loads(second.data)['answer'], 'Use reversed()')
+        self.assertNotIn('X-Cache', third.headers)
+        self.assertEqual(mock_post.call_count, 2)
+
+    def test_other_prompt_fields_must_match(self):
+        with patch('app.upstream_client.post') as mock_post:
+            mock_post.return_value.json.return_value = {'choices': [{'message': {'content': 'code'}}]}
+            self.app.post('/chatgpt', json={'action': 'generate_code', 'description': 'binary search', 'language': 'python'})
+            rust = self.app.post('/chatgpt', json={'action': 'generate_code', 'description': 'binary search', 'language': 'rust'})
+            again = self.app.post('/chatgpt', json={'action': 'generate_code', 'description': 'a binary search'})
+        self.assertNotIn('X-Cache-Match', rust.headers)
+        self.assertEqual(again.headers['X-Cache-Match'], 'semantic')
+        self.assertEqual(mock_post.call_count, 2)
+
+    def test_exact_hit_skips_the_semantic_scan(self):
+        with patch('app.response_cache', ResponseCache(MemoryBackend())), patch('app.upstream_client.post') as mock_post:
+            mock_post.return_value.json.return_value = {'choices': [{'message': {'content': 'xs[::-1]'}}]}
+            query = {'action': 'generate_code', 'description': 'reverse a list in Python'}
+            self.app.post('/chatgpt', json=query)
+            with patch('app.semantic_lookup') as lookup:
+                again = self.app.post('/chatgpt', json=query)
+        lookup.assert_not_called()
+        self.assertEqual(again.headers['X-Cache'], 'HIT')
+        self.assertNotIn('X-Cache-Match', again.headers)
+        self.assertEqual(mock_post.call_count, 1)
+
+class TestBackgroundJobs(unittest.TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.app.testing = True
+        create_response = self.app.post('/devin', json={'action': 'create_project', 'name': 'Background Project'})
+        self.project_id = json.loads(create_response.data)['project_id']
+
+    def wait_for_job(self, status_url):
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            job = json.loads(self.app.get(status_url).data)['job']
+            if job['status'] not in ('queued', 'running'):
+                return job
+            time.sleep(0.02)
+        self.fail("Job did not finish")
+
+    @patch('app.blackbox_ai')
+    @patch('app.chatgpt')
+    def test_background_integrate(self, mock_chatgpt, mock_blackbox):
+        mock_chatgpt.return_value = {'status': 'OK', 'code': 'def f(): pass'}
+        mock_blackbox.return_value = {'status': 'OK', 'optimized_code': 'def f():\n    pass'}
+        response = self.app.post('/integrate', json={
+            'project_id': self.project_id, 'code_description': 'f', 'background': True, 'priority': 3})
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(data['status_url'], f"/jobs/{data['job_id']}")
+
+        job = self.wait_for_job(data['status_url'])
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(job['priority'], 3)
+        self.assertEqual(job['result']['task_id'], data['task_id'])
+        self.assertEqual(job['result']['optimized_code'], 'def f():\n    pass')
+        from app import project_store
+        self.assertEqual(project_store.get(self.project_id)['progress'], 10)
+
+        # A retry of the same job (its worker died before completing it)
+        # does not count the task twice
+        from app import integrate_job
+        result, status_code = integrate_job({'project_id': self.project_id, 'task_id': data['task_id'],
+                                             'code_description': 'f'})
+        self.assertEqual((status_code, result['project_progress']), (200, 10))
+
+    @patch('app.blackbox_ai')
+    @patch('app.chatgpt')
+    def test_synchronous_integrate_stores_no_progress_keys(self, mock_chatgpt, mock_blackbox):
+        mock_chatgpt.return_value = {'status': 'OK', 'code': 'def f(): pass'}
+        mock_blackbox.return_value = {'status': 'OK', 'optimized_code': 'def f(): pass'}
+        for _ in range(2):
+            response = self.app.post('/integrate', json={'project_id': self.project_id, 'code_description': 'f'})
+        self.assertEqual(json.loads(response.data)['project_progress'], 20)
+        from app import project_store
+        self.assertFalse(project_store._progress_keys.get(self.project_id))
+
+    @patch('app.chatgpt')
+    def test_jobs_for_missing_projects_fail_without_upstream_calls(self, mock_chatgpt):
+        from app import documentation_job, integrate_job
+        from jobqueue import retryable
+        result, status_code = integrate_job({'project_id': 'gone', 'task_id': 1, 'code_description': 'f'})
+        self.assertEqual((status_code, result['message']), (404, 'Project not found'))
+        self.assertFalse(retryable(status_code))
+        result, status_code = documentation_job({'project_id': 'gone', 'description': 'd'})
+        self.assertEqual(status_code, 404)
+        mock_chatgpt.assert_not_called()
+
+    @patch('app.chatgpt')
+    def test_background_documentation(self, mock_chatgpt):
+        mock_chatgpt.return_value = {'status': 'OK', 'documentation': 'Docs'}
+        response = self.app.post('/devin', json={
+            'action': 'generate_documentation', 'project_id': self.project_id, 'description': 'd', 'background': True})
+        self.assertEqual(response.status_code, 202)
+        job = self.wait_for_job(json.loads(response.data)['status_url'])
+        self.assertEqual(job['result']['documentation']['documentation'], 'Docs')
+        from app import project_store
+        self.assertEqual(project_store.get(self.project_id)['documentation']['documentation'], 'Docs')
+
+    def test_background_validation(self):
+        response = self.app.post('/integrate', json={
+            'project_id': self.project_id, 'code_description': 'f', 'background': True, 'webhook_url': 'file:///etc'})
+        self.assertEqual(response.status_code, 400)
+        response = self.app.post('/integrate', json={
+            'project_id': self.project_id, 'code_description': 'f', 'background': True,
+            'webhook_url': 'http://169.254.169.254/latest/meta-data'})
+        self.assertEqual(json.loads(response.data)['message'], 'webhook_url must point to a public address')
+        response = self.app.post('/devin', json={
+            'action': 'generate_documentation', 'project_id': self.project_id, 'background': True, 'priority': 'high'})
+        self.assertEqual(json.loads(response.data)['message'], 'Invalid priority')
+
 if __name__ == '__main__':
     unittest.main()
 
     def test_chatgpt_api_error(self):
         # Test ChatGPT API error handling
-        with patch('app.requests.post') as mock_post:
+        with patch('app.upstream_client.post') as mock_post:
             mock_post.side_effect = requests.exceptions.RequestException("API Error")
             response = self.app.post('/chatgpt', json={
                 'action': 'generate_code',
@@ -323,7 +1071,7 @@ if __name__ == '__main__':
             self.assertNotIn('error_details', data)  # We don't expose internal error details
 
         # Test unexpected error
-        with patch('app.requests.post') as mock_post:
+        with patch('app.upstream_client.post') as mock_post:
             mock_post.side_effect = Exception("Unexpected error")
             response = self.app.post('/chatgpt', json={
                 'action': 'generate_code',
@@ -349,7 +1097,7 @@ def test_blackbox_api_error(self):
         self.assertEqual(data['status'], 'Error')
         self.assertEqual(data['message'], 'Blackbox API key not configured')
 
-    with patch('app.requests.post') as mock_post:
+    with patch('app.upstream_client.post') as mock_post:
         mock_post.side_effect = requests.exceptions.RequestException("API Error")
         response = self.app.post('/blackbox', json={
             'action': 'search_code',
@@ -362,7 +1110,7 @@ def test_blackbox_api_error(self):
         self.assertEqual(data['message'], 'An error occurred while processing your request')
 
     # Test rate limit error
-    with patch('app.requests.post') as mock_post:
+    with patch('app.upstream_client.post') as mock_post:
         mock_post.side_effect = requests.exceptions.HTTPError(response=mock_post.return_value)
         mock_post.return_value.status_code = 429
         response = self.app.post('/blackbox', json={
@@ -387,7 +1135,7 @@ def test_blackbox_api_error(self):
     self.assertEqual(data['message'], 'Invalid action for Blackbox AI')
 
     # Test unexpected error
-    with patch('app.requests.post') as mock_post:
+    with patch('app.upstream_client.post') as mock_post:
         mock_post.side_effect = Exception("Unexpected error")
         response = self.app.post('/blackbox', json={
             'action': 'search_code',
@@ -400,7 +1148,7 @@ def test_blackbox_api_error(self):
         self.assertEqual(data['message'], 'An unexpected error occurred')
 
     # Test optimize_code action
-    with patch('app.requests.post') as mock_post:
+    with patch('app.upstream_client.post') as mock_post:
         mock_post.return_value.json.return_value = {'optimized_code': 'optimized code'}
         response = self.app.post('/blackbox', json={
             'action': 'optimize_code',
@@ -414,7 +1162,7 @@ def test_blackbox_api_error(self):
         self.assertIn('optimized_code', data)
 
     # Test analyze_complexity action
-    with patch('app.requests.post') as mock_post:
+    with patch('app.upstream_client.post') as mock_post:
         mock_post.return_value.json.return_value = {'analysis': 'complexity analysis'}
         response = self.app.post('/blackbox', json={
             'action': 'analyze_complexity',
@@ -0,0 +1,245 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+import requests
+import app as fusion
+from asgi import create_asgi_app
+from cache import ResponseCache, MemoryBackend
+from tokens import TokenBudget
+
+# Background jobs go to a throwaway queue file, never one in the repo
+os.environ['JOB_QUEUE_PATH'] = os.path.join(tempfile.mkdtemp(), 'jobs.sqlite3')
+asgi_app = create_asgi_app()
+
+
+def upstream_response(payload, status_code=200):
+    response = MagicMock()
+    response.status_code = status_code
+    response.json.return_value = payload
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.exceptions.HTTPError(response=response)
+    return response
+
+
+class TestAsyncFusionAPI(unittest.TestCase):
+    def setUp(self):
+        self.client = asgi_app.test_client()
+        self.patchers = [
+            patch('app.CHATGPT_API_KEY', 'mock_chatgpt_key'),
+            patch('app.BLACKBOX_API_KEY', 'mock_blackbox_key'),
+            patch('app.response_cache', ResponseCache(None)),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def run_async(self, coro):
+        return asyncio.run(coro)
+
+    def post(self, path, body):
+        async def go():
+            response = await self.client.post(path, json=body)
+            return response.status_code, await response.get_json(), response.headers
+        return self.run_async(go())
+
+    def test_health_check(self):
+        async def go():
+            response = await self.client.get('/')
+            return await response.get_json()
+        self.assertEqual(self.run_async(go())['status'], 'OK')
+
+    def test_chatgpt_generate_code(self):
+        with patch('asgi.upstream_client.post', new=AsyncMock(return_value=upstream_response(
+                {'choices': [{'message': {'content': 'print("hi")'}}]}))):
+            status, data, _ = self.post('/chatgpt', {'action': 'generate_code', 'description': 'hi'})
+        self.assertEqual(status, 200)
+        self.assertEqual(data['message'], 'Generate code completed')
+        self.assertEqual(data['code'], 'print("hi")')
+
+    def test_chatgpt_invalid_action_and_rate_limit(self):
+        status, data, _ = self.post('/chatgpt', {'action': 'invalid_action'})
+        self.assertEqual(status, 400)
+        self.assertEqual(data['message'], 'Invalid action for ChatGPT')
+
+        with patch('asgi.upstream_client.post', new=AsyncMock(return_value=upstream_response({}, 429))):
+            status, data, _ = self.post('/chatgpt', {'action': 'answer_query', 'query': 'q'})
+        self.assertEqual(status, 429)
+        self.assertEqual(data['message'], 'API rate limit exceeded. Please try again later.')
+
+    def test_blackbox_actions(self):
+        with patch('asgi.upstream_client.post', new=AsyncMock(return_value=upstream_response({'analysis': 'O(n)'}))):
+            status, data, _ = self.post('/blackbox', {'action': 'analyze_complexity', 'code': 'def f(): pass'})
+        self.assertEqual(status, 200)
+        self.assertEqual(data['analysis'], 'O(n)')
+
+        with patch('asgi.upstream_client.post', new=AsyncMock(return_value=upstream_response({}))):
+            status, data, _ = self.post('/blackbox', {'action': 'search_code', 'query': 'nothing'})
+        self.assertEqual(status, 404)
+        self.assertEqual(data['message'], 'No code found')
+
+        with patch('asgi.upstream_client.post', new=AsyncMock(side_effect=requests.exceptions.ConnectionError())):
+            status, data, _ = self.post('/blackbox', {'action': 'optimize_code', 'code': 'x'})
+        self.assertEqual(status, 500)
+        self.assertEqual(data['message'], 'An error occurred while processing your request')
+
+    def test_integrate(self):
+        status, data, _ = self.post('/devin', {'action': 'create_project', 'name': 'Async Project'})
+        project_id = data['project_id']
+
+        responses = [
+            upstream_response({'choices': [{'message': {'content': 'def f(): pass'}}]}),
+            upstream_response({'optimized_code': 'def f():\n    pass'}),
+        ]
+        with patch('asgi.upstream_client.post', new=AsyncMock(side_effect=responses)):
+            status, data, _ = self.post('/integrate', {'project_id': project_id, 'code_description': 'f'})
+        self.assertEqual(status, 200)
+        self.assertEqual(data['generated_code'], 'def f(): pass')
+        self.assertEqual(data['optimized_code'], 'def f():\n    pass')
+        self.assertEqual(data['project_progress'], 10)
+        self.assertEqual(data['task_count'], 1)
+        self.assertEqual(fusion.project_store.list_tasks(project_id)['tasks'],
+                         [{'task_id': data['task_id'], 'task': 'Implement: f'}])
+
+        status, data, _ = self.post('/integrate', {'project_id': 'invalid_id', 'code_description': 'f'})
+        self.assertEqual(status, 404)
+
+    def test_speculative_integrate(self):
+        status, data, _ = self.post('/devin', {'action': 'create_project', 'name': 'Speculative'})
+        project_id = data['project_id']
+        stream = [f'data: {json.dumps({"choices": [{"delta": {"content": fragment}}]})}'.encode()
+                  for fragment in ('def a():\n    return 1\n', '\ndef b():', '\n    return 2')] + [b'data: [DONE]']
+
+        def optimize(data):
+            return {'status': 'OK', 'optimized_code': data['code'].strip('\n') + '  # optimized'}
+
+        with patch('app.upstream_client.post') as mock_post, \
+                patch('app.blackbox_ai', side_effect=optimize) as mock_blackbox, \
+                patch('asgi.upstream_client.post', new=AsyncMock()) as async_post:
+            mock_post.return_value.iter_lines.return_value = stream
+            status, data, _ = self.post('/integrate', {
+                'project_id': project_id, 'code_description': 'two functions', 'speculative': True})
+        self.assertEqual(status, 200)
+        self.assertEqual(data['generated_code'], 'def a():\n    return 1\n\ndef b():\n    return 2')
+        self.assertEqual(data['optimized_code'],
+                         'def a():\n    return 1  # optimized\n\n\ndef b():\n    return 2  # optimized')
+        # Each block is optimized on its own, from a streamed completion
+        self.assertEqual(mock_blackbox.call_count, 2)
+        self.assertTrue(mock_post.call_args.kwargs['json']['stream'])
+        async_post.assert_not_called()
+        self.assertEqual((data['project_progress'], data['task_count']), (10, 1))
+
+    def test_large_code_is_chunked_concurrently(self):
+        in_flight = []
+        peak = []
+
+        async def analyze(upstream, action, url, headers=None, json=None):
+            in_flight.append(1)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.pop()
+            return upstream_response({'analysis': f"O(1) for {json['code'].split('(')[0]}"})
+
+        code = "".join(f"def f{i}(value):\n    return value * {i} + len(str(value))\n\n\n" for i in range(12))
+        with patch('app.token_budget', TokenBudget(max_tokens=60, max_chunks=100)), \
+                patch('asgi.upstream_client.post', new=analyze):
+            status, data, headers = self.post('/blackbox', {'action': 'analyze_complexity', 'code': code})
+        self.assertEqual(status, 200)
+        chunks = int(headers['X-Input-Chunks'])
+        self.assertEqual(len(peak), chunks)
+        self.assertEqual(max(peak), chunks)
+        self.assertTrue(data['analysis'].startswith('O(1) for def f0'))
+
+    def test_concurrent_identical_requests_are_coalesced(self):
+        calls = []
+
+        async def slow_post(*args, **kwargs):
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return upstream_response({'analysis': 'O(1)'})
+
+        async def go():
+            responses = await asyncio.gather(*(
+                self.client.post('/blackbox', json={'action': 'analyze_complexity', 'code': 'same'})
+                for _ in range(5)))
+            return [r.headers.get('X-Coalesced') for r in responses]
+
+        with patch('asgi.upstream_client.post', new=slow_post):
+            coalesced = self.run_async(go())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(coalesced.count('true'), 4)
+
+    def test_exact_hit_skips_the_semantic_scan(self):
+        query = {'action': 'generate_code', 'description': 'reverse a list in Python'}
+        with patch('app.response_cache', ResponseCache(MemoryBackend())), \
+                patch('asgi.upstream_client.post', new=AsyncMock(return_value=upstream_response(
+                    {'choices': [{'message': {'content': 'xs[::-1]'}}]}))) as post:
+            self.post('/chatgpt', query)
+            with patch('app.semantic_lookup') as lookup:
+                status, _, headers = self.post('/chatgpt', query)
+        lookup.assert_not_called()
+        self.assertEqual((status, headers['X-Cache']), (200, 'HIT'))
+        self.assertEqual(post.await_count, 1)
+
+    def test_blocking_store_does_not_stall_the_loop(self):
+        project_id = fusion.project_store.create('Slow')
+        get = fusion.project_store.get
+
+        def slow_get(pid):
+            # A read waiting on another writer's lock
+            time.sleep(0.5)
+            return get(pid)
+
+        async def go():
+            started = time.perf_counter()
+            slow = asyncio.ensure_future(self.client.get(f'/projects/{project_id}'))
+            await asyncio.sleep(0.05)
+            health = await self.client.get('/')
+            elapsed = time.perf_counter() - started
+            return health.status_code, elapsed, (await slow).status_code
+
+        with patch.object(fusion.project_store, 'get', side_effect=slow_get):
+            health_status, elapsed, slow_status = self.run_async(go())
+        self.assertEqual((health_status, slow_status), (200, 200))
+        self.assertLess(elapsed, 0.3)
+
+    def test_chatgpt_stream(self):
+        class FakeStream:
+            status_code = 200
+            closed = False
+
+            def raise_for_status(self):
+                pass
+
+            async def iter_lines(self):
+                for line in [b'data: {"choices": [{"delta": {"content": "x = "}}]}',
+                             b'data: {"choices": [{"delta": {"content": "1"}}]}', b'data: [DONE]']:
+                    yield line
+
+            def close(self):
+                self.closed = True
+
+        fake = FakeStream()
+
+        async def go():
+            response = await self.client.post('/chatgpt', json={
+                'action': 'generate_code', 'description': 'x', 'stream': True
+            }, headers={'Accept': 'application/x-ndjson'})
+            return await response.get_data(as_text=True)
+
+        with patch('asgi.upstream_client.stream', new=AsyncMock(return_value=fake)):
+            body = self.run_async(go())
+        events = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([e['type'] for e in events], ['delta', 'delta', 'done'])
+        self.assertEqual(events[-1]['result']['code'], 'x = 1')
+        self.assertTrue(fake.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
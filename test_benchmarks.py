@@ -0,0 +1,50 @@
+import unittest
+from benchmarks.load import compare
+from benchmarks.mock_upstream import MockUpstream
+
+
+class TestMockUpstream(unittest.TestCase):
+    def test_fault_injection(self):
+        upstream = MockUpstream(error_rate=0.1, throttle_rate=0.2, retry_after=3, seed=7)
+        statuses = {}
+        for _ in range(2000):
+            status, _, headers = upstream.respond('POST', '/v1/analyze', {'code': 'x'})
+            statuses[status[:3]] = statuses.get(status[:3], 0) + 1
+            if status.startswith('429'):
+                self.assertEqual(headers['Retry-After'], '3')
+        self.assertTrue(300 < statuses['429'] < 500)
+        self.assertTrue(120 < statuses['500'] < 280)
+        self.assertEqual(statuses['429'] + statuses['500'], upstream.throttled + upstream.errors)
+
+    def test_unknown_path(self):
+        status, _, _ = MockUpstream(error_rate=1.0).respond('POST', '/v1/unknown', {})
+        self.assertTrue(status.startswith('404'))
+
+
+class TestBaselineComparison(unittest.TestCase):
+    def row(self, **overrides):
+        row = {'rps': 100.0, 'p50': 50.0, 'p95': 80.0, 'p99': 100.0, 'peak_rss_mb': 60.0, 'error_rate': 0.0}
+        row.update(overrides)
+        return row
+
+    def test_within_tolerance(self):
+        baseline = {'sync /chatgpt c8': self.row()}
+        results = {'sync /chatgpt c8': self.row(rps=85.0, p95=95.0), 'sync /devin c8': self.row(rps=1.0)}
+        self.assertEqual(compare(results, baseline, tolerance=0.2, min_delta_ms=5.0), [])
+
+    def test_regressions_are_flagged(self):
+        baseline = {'sync /chatgpt c8': self.row()}
+        results = {'sync /chatgpt c8': self.row(rps=70.0, p99=200.0, peak_rss_mb=90.0, error_rate=0.05)}
+        messages = compare(results, baseline, tolerance=0.2, min_delta_ms=5.0)
+        self.assertEqual(len(messages), 4)
+        self.assertTrue(any('rps' in m for m in messages))
+        self.assertTrue(any('p99' in m for m in messages))
+
+    def test_small_latency_changes_are_ignored(self):
+        baseline = {'sync /devin c8': self.row(p50=2.0)}
+        results = {'sync /devin c8': self.row(p50=6.0)}
+        self.assertEqual(compare(results, baseline, tolerance=0.2, min_delta_ms=5.0), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
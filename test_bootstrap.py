@@ -0,0 +1,194 @@
+import asyncio
+import json
+import threading
+import unittest
+
+from werkzeug.test import Client
+
+from benchmarks.importtime import BUDGETS, check, measure
+from bootstrap import HEALTH_BODY, LOAD_FAILED_BODY, LazyASGIApp, LazyWSGIApp, load_flask_app, load_quart_app
+
+
+class GatedLoad:
+    # A load() that blocks until released, standing in for the app import
+    def __init__(self, app):
+        self.app = app
+        self.release = threading.Event()
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        self.release.wait(5)
+        return self.app
+
+
+def wsgi_request(app, path, method='GET'):
+    started = {}
+
+    def start_response(status, headers):
+        started['status'] = status
+
+    body = b''.join(app({'REQUEST_METHOD': method, 'PATH_INFO': path}, start_response))
+    return started['status'], body
+
+
+class TestLazyWSGIApp(unittest.TestCase):
+    def test_health_is_served_while_loading(self):
+        def real_app(environ, start_response):
+            start_response('201 Created', [])
+            return [b'real ' + environ['PATH_INFO'].encode()]
+
+        load = GatedLoad(real_app)
+        app = LazyWSGIApp(load)
+        self.assertEqual(wsgi_request(app, '/'), ('200 OK', HEALTH_BODY))
+        self.assertEqual(json.loads(HEALTH_BODY)['status'], 'OK')
+
+        # Other requests wait for the load and then reach the real app
+        results = []
+        waiting = threading.Thread(target=lambda: results.append(wsgi_request(app, '/chatgpt', 'POST')))
+        waiting.start()
+        waiting.join(0.1)
+        self.assertTrue(waiting.is_alive())
+        load.release.set()
+        waiting.join(5)
+        self.assertEqual(results, [('201 Created', b'real /chatgpt')])
+        self.assertEqual(wsgi_request(app, '/'), ('201 Created', b'real /'))
+        self.assertEqual(load.calls, 1)
+
+    def test_load_errors_reach_requests(self):
+        def broken():
+            raise RuntimeError("missing config")
+
+        app = LazyWSGIApp(broken)
+        with self.assertRaisesRegex(RuntimeError, "missing config"):
+            wsgi_request(app, '/projects')
+        # A worker whose load failed reports unhealthy instead of OK
+        self.assertEqual(wsgi_request(app, '/'), ('503 Service Unavailable', LOAD_FAILED_BODY))
+
+    def test_with_flask_app(self):
+        client = Client(LazyWSGIApp(load_flask_app, preload=False))
+        self.assertEqual(client.get('/upstream/limits').status_code, 200)
+
+
+class FakeQuart:
+    def __init__(self):
+        self.events = []
+
+    async def startup(self):
+        self.events.append('startup')
+
+    async def shutdown(self):
+        self.events.append('shutdown')
+
+    async def __call__(self, scope, receive, send):
+        self.events.append(scope['path'])
+        await send({'type': 'http.response.start', 'status': 201, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b'real'})
+
+
+def asgi_request(app, path):
+    sent = []
+    incoming = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+    async def receive():
+        if incoming:
+            return incoming.pop(0)
+        # The client goes away once the response is complete
+        while not sent or sent[-1]['type'] != 'http.response.body' or sent[-1].get('more_body'):
+            await asyncio.sleep(0.01)
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    async def go():
+        await app({'type': 'http', 'method': 'GET', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+                   'root_path': '', 'scheme': 'http', 'http_version': '1.1', 'headers': [(b'host', b'test')],
+                   'server': ('127.0.0.1', 80), 'client': ('127.0.0.1', 1234)}, receive, send)
+    return go(), sent
+
+
+async def lifespan(app, *events):
+    incoming = [{'type': f'lifespan.{event}'} for event in events]
+    sent = []
+
+    async def receive():
+        return incoming.pop(0)
+
+    async def send(message):
+        sent.append(message['type'])
+
+    await app({'type': 'lifespan'}, receive, send)
+    return sent
+
+
+class TestLazyASGIApp(unittest.TestCase):
+    def test_health_is_served_while_loading(self):
+        real = FakeQuart()
+        load = GatedLoad(real)
+        app = LazyASGIApp(load)
+
+        async def scenario():
+            health, sent = asgi_request(app, '/')
+            await health
+            self.assertEqual(sent[0]['status'], 200)
+            self.assertEqual(sent[1]['body'], HEALTH_BODY)
+
+            request, sent = asgi_request(app, '/projects')
+            task = asyncio.ensure_future(request)
+            await asyncio.sleep(0.05)
+            self.assertFalse(task.done())
+            load.release.set()
+            await task
+            self.assertEqual(sent[0]['status'], 201)
+            await asgi_request(app, '/')[0]
+            self.assertEqual(await lifespan(app, 'shutdown'), ['lifespan.shutdown.complete'])
+
+        asyncio.run(scenario())
+        self.assertEqual(real.events, ['startup', '/projects', '/', 'shutdown'])
+
+    def test_failed_load_is_unhealthy(self):
+        def broken():
+            raise RuntimeError("missing config")
+
+        app = LazyASGIApp(broken)
+        with self.assertRaisesRegex(RuntimeError, "missing config"):
+            app.loader.wait()
+        health, sent = asgi_request(app, '/')
+        asyncio.run(health)
+        self.assertEqual(sent[0]['status'], 503)
+        self.assertEqual(sent[1]['body'], LOAD_FAILED_BODY)
+
+    def test_lifespan_without_requests(self):
+        real = FakeQuart()
+        app = LazyASGIApp(lambda: real)
+        sent = asyncio.run(lifespan(app, 'startup', 'shutdown'))
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+        # The app never served, so it has no startup to undo
+        self.assertEqual(real.events, [])
+
+    def test_with_quart_app(self):
+        app = LazyASGIApp(load_quart_app, preload=False)
+
+        async def scenario():
+            request, sent = asgi_request(app, '/upstream/limits')
+            await request
+            await lifespan(app, 'shutdown')
+            return sent
+
+        sent = asyncio.run(scenario())
+        self.assertEqual(sent[0]['status'], 200)
+
+
+class TestImportBudget(unittest.TestCase):
+    def test_entry_points_import_nothing_forbidden(self):
+        for module, limits in BUDGETS.items():
+            with self.subTest(module=module):
+                rows, total_ms = measure(module)
+                # Timing is left to benchmarks.importtime; only imports are checked here
+                self.assertEqual(check(module, float('inf'), limits['forbidden'], rows, total_ms), [])
+                self.assertIn(module, {name for name, _, _, _ in rows})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import os
+import tempfile
+import time
+import unittest
+from cache import MemoryBackend, RedisBackend, SQLiteBackend, ResponseCache, make_cache_key
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class TestCacheKey(unittest.TestCase):
+    def test_key_normalizes_whitespace_and_order(self):
+        a = make_cache_key('chatgpt', 'generate_code', {'model': 'm', 'prompt': 'hi\r\n'}, 'm')
+        b = make_cache_key('chatgpt', 'generate_code', {'prompt': 'hi', 'model': 'm'}, 'm')
+        self.assertEqual(a, b)
+
+    def test_key_depends_on_upstream_action_and_model(self):
+        base = make_cache_key('chatgpt', 'generate_code', {'prompt': 'hi'}, 'm1')
+        self.assertNotEqual(base, make_cache_key('blackbox', 'generate_code', {'prompt': 'hi'}, 'm1'))
+        self.assertNotEqual(base, make_cache_key('chatgpt', 'generate_documentation', {'prompt': 'hi'}, 'm1'))
+        self.assertNotEqual(base, make_cache_key('chatgpt', 'generate_code', {'prompt': 'hi'}, 'm2'))
+
+
+class TestLocalBackends(unittest.TestCase):
+    # Behaviour shared by the memory and SQLite backends, checked on each
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.opened = 0
+
+    def backends(self, **kwargs):
+        # (name, backend) pairs, each backend with empty storage of its own
+        self.opened += 1
+        yield 'memory', MemoryBackend(**kwargs)
+        yield 'sqlite', SQLiteBackend(os.path.join(self.tmpdir.name, f'cache-{self.opened}.sqlite3'), **kwargs)
+
+    def test_get_set(self):
+        for name, backend in self.backends():
+            with self.subTest(backend=name):
+                backend.set('k', b'value')
+                self.assertEqual(backend.get('k'), b'value')
+                self.assertIsNone(backend.get('missing'))
+
+    def test_ttl_expiry(self):
+        for name, backend in self.backends():
+            with self.subTest(backend=name):
+                backend.set('k', b'value', ttl=0.01)
+                time.sleep(0.02)
+                self.assertIsNone(backend.get('k'))
+
+    def test_lru_eviction_by_entries(self):
+        for name, backend in self.backends(max_entries=2):
+            with self.subTest(backend=name):
+                backend.set('a', b'1')
+                backend.set('b', b'2')
+                time.sleep(0.001)
+                backend.get('a')
+                backend.set('c', b'3')
+                self.assertIsNotNone(backend.get('a'))
+                self.assertIsNone(backend.get('b'))
+                self.assertIsNotNone(backend.get('c'))
+
+    def test_byte_cap(self):
+        for name, backend in self.backends(max_bytes=10):
+            with self.subTest(backend=name):
+                backend.set('a', b'12345')
+                backend.set('b', b'12345')
+                backend.set('c', b'12345')
+                self.assertIsNone(backend.get('a'))
+                self.assertEqual(backend.size(), (2, 10))
+                backend.set('huge', b'x' * 11)
+                self.assertIsNone(backend.get('huge'))
+
+
+class TestSQLiteBackend(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'cache.sqlite3')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_survives_restart(self):
+        backend = SQLiteBackend(self.path)
+        backend.set('k', b'persisted')
+        backend.close()
+        self.assertEqual(SQLiteBackend(self.path).get('k'), b'persisted')
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class TestRedisBackend(unittest.TestCase):
+    # Eviction is the server's job, so only the shared behaviour is covered
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.backends = []
+
+    def tearDown(self):
+        for backend in self.backends:
+            backend.close()
+            backend.client.close()
+
+    def make_backend(self, **kwargs):
+        # Each backend has its own client, like a separate node
+        backend = RedisBackend(fakeredis.FakeRedis(server=self.server), **kwargs)
+        self.backends.append(backend)
+        return backend
+
+    def wait_live(self, backend):
+        backend.get('warmup')
+        deadline = time.monotonic() + 5
+        while not backend._near._subscriber.live.is_set():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_shared_between_nodes(self):
+        first, second = self.make_backend(), self.make_backend()
+        first.set('k', b'value', ttl=60)
+        self.assertEqual(second.get('k'), b'value')
+        self.assertIsNone(second.get('missing'))
+        self.assertIsNone(first.size())
+        self.assertIsNone(ResponseCache(first).stats()['entries'])
+        self.make_backend(max_bytes=10).set('too big', b'x' * 11)
+        self.assertIsNone(first.get('too big'))
+
+    def test_ttl_expiry(self):
+        backend = self.make_backend(near_entries=0)
+        backend.set('k', b'v', ttl=0.05)
+        time.sleep(0.1)
+        self.assertIsNone(backend.get('k'))
+
+    def test_delete_and_clear_invalidate_other_nodes(self):
+        first, second = self.make_backend(), self.make_backend()
+        self.wait_live(second)
+        first.set('a', b'1')
+        first.set('b', b'2')
+        self.assertEqual(second.get('a'), b'1')
+        self.assertEqual(second.get('b'), b'2')
+        self.assertEqual(len(second._near), 2)
+
+        first.delete('a')
+        deadline = time.monotonic() + 5
+        while len(second._near) != 1:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        self.assertIsNone(second.get('a'))
+        first.clear()
+        while len(second._near):
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        self.assertIsNone(second.get('b'))
+        self.assertEqual(list(second.client.scan_iter(match=second.prefix + '*')), [])
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_round_trip_and_stats(self):
+        cache = ResponseCache(MemoryBackend())
+        self.assertIsNone(cache.get('k'))
+        cache.set('k', {'status': 'OK', 'code': 'x'})
+        self.assertEqual(cache.get('k'), {'status': 'OK', 'code': 'x'})
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+
+    def test_disabled_cache(self):
+        cache = ResponseCache(None)
+        cache.set('k', {'status': 'OK'})
+        self.assertIsNone(cache.get('k'))
+        self.assertFalse(cache.enabled)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import gzip
+import unittest
+from flask import Flask, jsonify
+from compress import Compressor, parse_accept_encoding
+
+
+class TestCompressor(unittest.TestCase):
+    def test_parse_accept_encoding(self):
+        self.assertEqual(parse_accept_encoding('gzip, br;q=0.5, zstd;q=0'), {'gzip': 1.0, 'br': 0.5, 'zstd': 0.0})
+        self.assertEqual(parse_accept_encoding('x-gzip;q=bad'), {'gzip': 0.0})
+        self.assertEqual(parse_accept_encoding(None), {})
+
+    def test_negotiate_prefers_server_order(self):
+        compressor = Compressor()
+        self.assertEqual(compressor.negotiate('gzip'), 'gzip')
+        self.assertIsNone(compressor.negotiate('gzip;q=0'))
+        self.assertIsNone(compressor.negotiate('identity'))
+        self.assertIsNone(compressor.negotiate(''))
+        self.assertEqual(compressor.negotiate('*'), compressor.encodings[0])
+        self.assertIsNone(Compressor(encodings=('unknown',)).negotiate('unknown, gzip'))
+
+    def test_encode(self):
+        app = Flask(__name__)
+        compressor = Compressor(min_size=100)
+        with app.app_context():
+            small = jsonify(status='OK')
+            compressor.encode(small, small.get_data(), 'gzip')
+            self.assertNotIn('Content-Encoding', small.headers)
+
+            large = jsonify(documentation='x' * 1000)
+            body = large.get_data()
+            large.set_etag('abc')
+            compressor.encode(large, body, 'gzip')
+            self.assertEqual(large.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(gzip.decompress(large.get_data()), body)
+            self.assertEqual(large.headers['Content-Length'], str(len(large.get_data())))
+            self.assertEqual(large.get_etag(), ('abc-gzip', False))
+            self.assertIn('Accept-Encoding', large.headers['Vary'])
+
+            errored = jsonify(message='x' * 1000)
+            errored.status_code = 500
+            compressor.encode(errored, errored.get_data(), 'gzip')
+            self.assertNotIn('Content-Encoding', errored.headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from actions import ActionTable
+from benchmarks.bench_async import free_port, server_env, start_upstream
+from jobqueue import JobQueue, JobWorker, deliver_webhook, sign_webhook, webhook_url_error
+from store import SQLiteProjectStore
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+class WebhookReceiver:
+    # Local HTTP server recording the webhooks it receives
+    def __init__(self, statuses=(200,)):
+        self.calls = []
+        statuses = list(statuses)
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                receiver.calls.append((dict(self.headers), body))
+                self.send_response(statuses.pop(0) if len(statuses) > 1 else statuses[0])
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/hook"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.queue = JobQueue(visibility_timeout=60, max_attempts=2, retry_delay=0)
+
+    def tearDown(self):
+        self.queue.close()
+
+    def test_claims_by_priority_then_age(self):
+        low = self.queue.enqueue('work', {'n': 1})
+        high = self.queue.enqueue('work', {'n': 2}, priority=5)
+        later = self.queue.enqueue('work', {'n': 3})
+        self.assertEqual([self.queue.claim()['job_id'] for _ in range(3)], [high, low, later])
+        self.assertIsNone(self.queue.claim())
+        self.assertEqual(self.queue.stats(), {'jobs': {'running': 3}})
+
+    def test_complete_and_lost_lease(self):
+        job_id = self.queue.enqueue('work', {'n': 1})
+        job = self.queue.claim()
+        self.assertEqual(job['payload'], {'n': 1})
+        self.assertFalse(self.queue.complete(job_id, 'stale lease', {'ok': True}))
+        self.assertTrue(self.queue.complete(job_id, job['lease'], {'ok': True}))
+        stored = self.queue.get(job_id)
+        self.assertEqual((stored['status'], stored['status_code'], stored['result']), ('succeeded', 200, {'ok': True}))
+        self.assertIsNone(self.queue.get('missing'))
+
+    def test_visibility_timeout_and_attempts(self):
+        self.queue.visibility_timeout = 0
+        job_id = self.queue.enqueue('work', {})
+        first = self.queue.claim()
+        second = self.queue.claim()
+        self.assertEqual(second['job_id'], job_id)
+        self.assertEqual(second['attempt'], 2)
+        self.assertFalse(self.queue.complete(job_id, first['lease'], {}))
+        # Both attempts used and the lease expired again
+        self.assertIsNone(self.queue.claim())
+        self.assertEqual(self.queue.get(job_id)['status'], 'failed')
+
+    def test_fail_retries_then_fails(self):
+        job_id = self.queue.enqueue('work', {})
+        job = self.queue.claim()
+        self.assertEqual(self.queue.fail(job_id, job['lease'], 'boom'), 'queued')
+        job = self.queue.claim()
+        self.assertEqual(self.queue.fail(job_id, job['lease'], 'boom', result={'status': 'Error'}, status_code=503),
+                         'failed')
+        stored = self.queue.get(job_id)
+        self.assertEqual((stored['status'], stored['attempts'], stored['error']), ('failed', 2, 'boom'))
+        self.assertEqual(stored['status_code'], 503)
+
+    def test_prune(self):
+        job_id = self.queue.enqueue('work', {})
+        self.queue.complete(job_id, self.queue.claim()['lease'], {})
+        self.queue.retention = -1
+        self.assertEqual(self.queue.prune(), 1)
+        self.assertIsNone(self.queue.get(job_id))
+
+
+class TestJobWorker(unittest.TestCase):
+    def setUp(self):
+        self.queue = JobQueue(max_attempts=2, retry_delay=0)
+        self.handlers = ActionTable('jobs')
+        self.worker = JobWorker(self.queue, self.handlers, webhook_secret='secret', webhook_hosts=('127.0.0.1',))
+
+    def tearDown(self):
+        self.queue.close()
+
+    def test_outcomes(self):
+        outcomes = iter([({'status': 'Error'}, 503), ({'status': 'OK'}, 200)])
+        self.handlers.add('flaky', lambda payload: next(outcomes))
+        self.handlers.add('invalid', lambda payload: ({'status': 'Error', 'message': 'Bad input'}, 400))
+        self.handlers.add('broken', lambda payload: 1 / 0)
+
+        flaky = self.queue.enqueue('flaky', {})
+        invalid = self.queue.enqueue('invalid', {})
+        broken = self.queue.enqueue('broken', {})
+        unknown = self.queue.enqueue('unknown', {})
+        while self.worker.run_once():
+            pass
+        self.assertEqual(self.queue.get(flaky)['status'], 'succeeded')
+        self.assertEqual(self.queue.get(flaky)['attempts'], 2)
+        self.assertEqual((self.queue.get(invalid)['status'], self.queue.get(invalid)['attempts']), ('failed', 1))
+        self.assertEqual(self.queue.get(broken)['error'], 'ZeroDivisionError: division by zero')
+        self.assertEqual(self.queue.get(unknown)['status'], 'queued')
+
+    def test_webhook_is_signed_and_recorded(self):
+        receiver = WebhookReceiver()
+        self.addCleanup(receiver.close)
+        self.handlers.add('work', lambda payload: ({'status': 'OK', 'n': payload['n']}, 200))
+        job_id = self.queue.enqueue('work', {'n': 7}, webhook_url=receiver.url)
+        self.worker.run_once()
+        headers, body = receiver.calls[0]
+        self.assertEqual(headers['X-Fusion-Signature'], sign_webhook('secret', body))
+        self.assertEqual(json.loads(body)['job']['result'], {'status': 'OK', 'n': 7})
+        self.assertEqual(self.queue.get(job_id)['webhook_status'], 'delivered')
+
+    def test_webhook_retries(self):
+        receiver = WebhookReceiver(statuses=(500, 204))
+        self.addCleanup(receiver.close)
+        self.assertTrue(deliver_webhook(receiver.url, {'job_id': 'j'}, backoff=0, allowed_hosts=('127.0.0.1',)))
+        self.assertEqual(len(receiver.calls), 2)
+        self.assertFalse(deliver_webhook('http://127.0.0.1:9/hook', {'job_id': 'j'}, attempts=2, timeout=1, backoff=0,
+                                         allowed_hosts=('127.0.0.1',)))
+
+    def test_webhook_url_must_be_public(self):
+        for url in ('http://127.0.0.1/hook', 'http://localhost/hook', 'http://169.254.169.254/latest',
+                    'http://10.0.0.1/hook', 'http://[::1]/hook', 'http://[::ffff:127.0.0.1]/hook', 'http://0.0.0.0/'):
+            with self.subTest(url=url):
+                self.assertIsNotNone(webhook_url_error(url))
+        for url in ('file:///etc/passwd', 'http:///hook', 'http://host:port/', 42):
+            with self.subTest(url=url):
+                self.assertEqual(webhook_url_error(url), "Invalid webhook_url")
+        self.assertIsNone(webhook_url_error('https://8.8.8.8/hook'))
+        self.assertIsNone(webhook_url_error('http://LocalHost:8080/hook', allowed_hosts=('localhost',)))
+
+    def test_webhook_is_not_sent_to_private_hosts(self):
+        receiver = WebhookReceiver()
+        self.addCleanup(receiver.close)
+        self.assertFalse(deliver_webhook(receiver.url, {'job_id': 'j'}, backoff=0))
+        self.assertEqual(receiver.calls, [])
+
+    def test_webhook_redirects_are_not_followed(self):
+        receiver = WebhookReceiver(statuses=(307,))
+        self.addCleanup(receiver.close)
+        self.assertFalse(deliver_webhook(receiver.url, {'job_id': 'j'}, attempts=1, allowed_hosts=('127.0.0.1',)))
+        self.assertEqual(len(receiver.calls), 1)
+
+
+class TestWorkerProcess(unittest.TestCase):
+    def test_worker_process_runs_queued_integration(self):
+        tmp = tempfile.mkdtemp()
+        queue_path, store_path = os.path.join(tmp, 'jobs.sqlite3'), os.path.join(tmp, 'projects.sqlite3')
+        store = SQLiteProjectStore(store_path)
+        project_id = store.create('Worker Project')
+        task_id = store.append_task(project_id, 'Implement: f')
+        queue = JobQueue(queue_path)
+        job_id = queue.enqueue('integrate', {'project_id': project_id, 'task_id': task_id, 'code_description': 'f'})
+
+        upstream_port = free_port()
+        upstream = start_upstream(upstream_port, 0.0)
+        env = server_env(upstream_port, 4)
+        env.update({'JOB_QUEUE_PATH': queue_path, 'PROJECT_STORE': 'sqlite', 'PROJECT_STORE_PATH': store_path})
+        worker = subprocess.Popen([sys.executable, 'worker.py', '--processes', '1'], cwd=ROOT, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = time.monotonic() + 30
+            while queue.get(job_id)['status'] in ('queued', 'running') and time.monotonic() < deadline:
+                time.sleep(0.1)
+            job = queue.get(job_id)
+        finally:
+            worker.terminate()
+            worker.wait(timeout=30)
+            upstream.terminate()
+            upstream.wait()
+        self.assertEqual(job['status'], 'succeeded', job)
+        self.assertEqual(job['result']['task_id'], task_id)
+        self.assertEqual(job['result']['project_progress'], 10)
+        self.assertEqual(worker.returncode, 0)
+        queue.close()
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
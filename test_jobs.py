@@ -0,0 +1,68 @@
+import threading
+import unittest
+from jobs import JobQueueFull, JobRunner
+
+
+class TestJobRunner(unittest.TestCase):
+    def setUp(self):
+        self.runner = JobRunner('test', workers=1, max_queued=1)
+
+    def tearDown(self):
+        self.runner.shutdown()
+
+    def test_job_reports_progress_and_result(self):
+        def work(value, report):
+            report(stage='receiving', percent=50.0)
+            report(percent=100.0)
+            return {'value': value}
+
+        job_id = self.runner.submit('demo', work, 42)
+        job = self.runner.wait(job_id, timeout=5)
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(job['kind'], 'demo')
+        self.assertEqual(job['result'], {'value': 42})
+        self.assertEqual(job['progress'], {'stage': 'receiving', 'percent': 100.0})
+        self.assertIsNotNone(job['finished_at'])
+
+    def test_failed_job(self):
+        def work(report):
+            raise RuntimeError('clone failed')
+
+        job = self.runner.wait(self.runner.submit('demo', work), timeout=5)
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(job['error'], 'clone failed')
+
+    def test_queue_is_bounded(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def block(report):
+            started.set()
+            release.wait(5)
+
+        first = self.runner.submit('demo', block)
+        started.wait(5)
+        second = self.runner.submit('demo', block)
+        self.assertEqual(self.runner.status(first)['status'], 'running')
+        self.assertEqual(self.runner.status(second)['status'], 'queued')
+        with self.assertRaises(JobQueueFull):
+            self.runner.submit('demo', block)
+        release.set()
+        self.assertEqual(self.runner.wait(second, timeout=5)['status'], 'succeeded')
+        self.assertEqual(self.runner.stats()['jobs'], {'succeeded': 2})
+
+    def test_finished_jobs_expire(self):
+        runner = JobRunner('expiring', workers=1, retention=0)
+        job_id = runner.submit('demo', lambda report: None)
+        runner.wait(job_id, timeout=5)
+        runner.submit('demo', lambda report: None)
+        self.assertIsNone(runner.status(job_id))
+        runner.shutdown()
+
+    def test_unknown_job(self):
+        self.assertIsNone(self.runner.status('missing'))
+        self.assertIsNone(self.runner.wait('missing'))
+
+
+if __name__ == '__main__':
+    unittest.main()
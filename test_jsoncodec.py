@@ -0,0 +1,69 @@
+import datetime
+import json
+import math
+import unittest
+import uuid
+from flask import Flask
+import jsoncodec
+
+
+class TestJSONCodec(unittest.TestCase):
+    def test_round_trip(self):
+        value = {'code': 'def f():\n    return "→"', 'tasks': [{'task_id': 1}], 'progress': 12.5, 'done': None}
+        self.assertEqual(jsoncodec.loads(jsoncodec.dumps_bytes(value)), value)
+        self.assertEqual(json.loads(jsoncodec.dumps(value)), value)
+
+    def test_values_outside_orjson_range_fall_back(self):
+        self.assertEqual(jsoncodec.loads(jsoncodec.dumps({'big': 2 ** 70})), {'big': 2 ** 70})
+        self.assertTrue(math.isnan(jsoncodec.loads('{"x": NaN}')['x']))
+        with self.assertRaises(ValueError):
+            jsoncodec.loads('{"x": ')
+
+    def test_sort_keys_and_non_string_keys(self):
+        self.assertEqual(jsoncodec.dumps({'b': 1, 'a': 2}, sort_keys=True), '{"a":2,"b":1}')
+        self.assertEqual(json.loads(jsoncodec.dumps({1: 'one'})), {'1': 'one'})
+
+
+class TestProvider(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.json = jsoncodec.provider_for(self.app)
+
+        @self.app.route('/echo', methods=['POST'])
+        def echo():
+            from flask import jsonify, request
+            return jsonify(request.get_json())
+
+        @self.app.route('/typed')
+        def typed():
+            from flask import jsonify
+            return jsonify(id=uuid.UUID(int=1), day=datetime.date(2024, 1, 2))
+
+        self.client = self.app.test_client()
+
+    def test_matches_stdlib_provider(self):
+        stdlib = Flask('stdlib')
+        payload = {'z': [1, 2, {'b': 'é', 'a': None}], 'a': True}
+        with self.app.app_context(), stdlib.app_context():
+            fast = self.app.json.response(payload)
+            slow = stdlib.json.response(payload)
+        self.assertEqual(json.loads(fast.get_data()), json.loads(slow.get_data()))
+        self.assertEqual(list(json.loads(fast.get_data())), ['a', 'z'])
+        self.assertEqual(fast.mimetype, 'application/json')
+
+    def test_request_and_response(self):
+        response = self.client.post('/echo', json={'action': 'add_task', 'task': 'Ünïcode'})
+        self.assertEqual(response.get_json(), {'action': 'add_task', 'task': 'Ünïcode'})
+
+    def test_invalid_request_body(self):
+        response = self.client.post('/echo', data='{"action": ', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_default_types(self):
+        data = self.client.get('/typed').get_json()
+        self.assertEqual(data['id'], str(uuid.UUID(int=1)))
+        self.assertEqual(data['day'], 'Tue, 02 Jan 2024 00:00:00 GMT')
+
+
+if __name__ == '__main__':
+    unittest.main()
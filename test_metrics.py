@@ -0,0 +1,96 @@
+import contextvars
+import threading
+import unittest
+from metrics import HTTP_DURATION, HTTP_LOCAL_DURATION, UPSTREAM_REQUESTS, Registry, RequestTimer, UpstreamTimer
+
+
+class TestRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_render(self):
+        counter = self.registry.counter('calls_total', 'Calls', ('upstream', 'status'))
+        counter.inc('chatgpt', '200')
+        counter.inc('chatgpt', '200', amount=2)
+        counter.inc('blackbox', '500')
+        self.assertEqual(counter.value('chatgpt', '200'), 3)
+        text = self.registry.render()
+        self.assertIn('# TYPE calls_total counter', text)
+        self.assertIn('calls_total{upstream="chatgpt",status="200"} 3', text)
+        self.assertIn('calls_total{upstream="blackbox",status="500"} 1', text)
+
+    def test_label_values_are_escaped(self):
+        counter = self.registry.counter('calls_total', 'Calls', ('action',))
+        counter.inc('a"b\\c')
+        self.assertIn('calls_total{action="a\\"b\\\\c"} 1', self.registry.render())
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.histogram('latency_seconds', 'Latency', ('route',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 5.0):
+            histogram.observe(value, '/x')
+        text = self.registry.render()
+        self.assertIn('latency_seconds_bucket{route="/x",le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{route="/x",le="1.0"} 3', text)
+        self.assertIn('latency_seconds_bucket{route="/x",le="+Inf"} 4', text)
+        self.assertIn('latency_seconds_sum{route="/x"} 6.250000', text)
+        self.assertEqual(histogram.count('/x'), 4)
+
+    def test_thread_shards_are_merged(self):
+        counter = self.registry.counter('calls_total', 'Calls')
+        barrier = threading.Barrier(4)
+
+        def record():
+            barrier.wait()
+            for _ in range(1000):
+                counter.inc()
+
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.inc()
+        # The exited threads' shards have been folded into the retired totals
+        self.assertEqual(counter.value(), 4001)
+        self.assertEqual(len(counter._shards), 1)
+        self.assertEqual(counter.value(), 4001)
+
+    def test_gauge_dec_from_other_thread(self):
+        gauge = self.registry.gauge('in_flight', 'In flight', ('route',))
+        gauge.inc('/x')
+        thread = threading.Thread(target=gauge.dec, args=('/x',))
+        thread.start()
+        thread.join()
+        self.assertEqual(gauge.value('/x'), 0)
+
+    def test_collectors(self):
+        self.registry.add_collector(lambda: [('queue_depth', 'gauge', 'Queued', [({'upstream': 'chatgpt'}, 2), ({}, 5)])])
+        text = self.registry.render()
+        self.assertIn('queue_depth{upstream="chatgpt"} 2', text)
+        self.assertIn('queue_depth 5', text)
+
+
+class TestTimers(unittest.TestCase):
+    def test_upstream_time_is_excluded_from_local_time(self):
+        timer = RequestTimer('/test-split', 'split')
+
+        def serve():
+            timer.start()
+            with UpstreamTimer('test-upstream', 'split') as upstream:
+                upstream.started -= 10.0  # as if the call took ten seconds
+
+        contextvars.copy_context().run(serve)
+        timer.finish(200)
+        self.assertGreaterEqual(timer.upstream[0], 10.0)
+        self.assertEqual(HTTP_DURATION.count('/test-split', 'split'), 1)
+        local_seconds = HTTP_LOCAL_DURATION._merged()[('/test-split', 'split')][-2]
+        self.assertLess(local_seconds, 1.0)
+
+    def test_upstream_timer_outside_a_request(self):
+        with UpstreamTimer('test-upstream', 'background') as upstream:
+            upstream.record(None)
+        self.assertEqual(UPSTREAM_REQUESTS.value('test-upstream', 'background', 'error'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import threading
+import time
+import unittest
+from codeblocks import CodeBlockSplitter, split_blocks
+from pipeline import StagedExecutor, StageTimings
+
+SOURCE = (
+    "import os\n"
+    "\n"
+    "def first():\n"
+    "    return 1\n"
+    "\n"
+    "@decorator\n"
+    "@other(arg)\n"
+    "def second():\n"
+    "    pass\n"
+    "\n"
+    "class Third:\n"
+    "    def method(self):\n"
+    "        return 3\n"
+    "\n"
+    "print(first())\n"
+)
+
+
+class TestCodeBlocks(unittest.TestCase):
+    def test_split_at_top_level_definitions(self):
+        blocks = split_blocks(SOURCE)
+        self.assertEqual(len(blocks), 3)
+        self.assertTrue(blocks[0].startswith('import os'))
+        self.assertTrue(blocks[1].startswith('@decorator\n@other(arg)\ndef second'))
+        self.assertTrue(blocks[2].startswith('class Third'))
+        self.assertEqual(''.join(blocks), SOURCE)
+
+    def test_streamed_feed_matches_whole_split(self):
+        splitter = CodeBlockSplitter()
+        blocks = []
+        for i in range(0, len(SOURCE), 7):
+            blocks.extend(splitter.feed(SOURCE[i:i + 7]))
+        blocks.extend(splitter.close())
+        self.assertEqual(blocks, split_blocks(SOURCE))
+
+    def test_blocks_are_emitted_once_complete(self):
+        splitter = CodeBlockSplitter()
+        self.assertEqual(splitter.feed("def a():\n    return 1\n"), [])
+        self.assertEqual(splitter.feed("def b():\n"), ["def a():\n    return 1\n"])
+
+
+class TestStagedExecutor(unittest.TestCase):
+    def test_stage_pools_bound_concurrency_and_record_timings(self):
+        executor = StagedExecutor({'generate': 2, 'optimize': 1})
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def work():
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.pop()
+            return 'done'
+
+        timings = StageTimings()
+        futures = [executor.submit('generate', work, timings=timings) for _ in range(4)]
+        self.assertEqual([f.result() for f in futures], ['done'] * 4)
+        self.assertEqual(max(peak), 2)
+
+        stats = timings.as_dict()['stages']['generate']
+        self.assertGreater(stats['run_ms'], 0)
+        self.assertGreater(stats['queued_ms'], 0)
+        executor.shutdown()
+
+    def test_context_wraps_each_call(self):
+        entered = []
+
+        class Context:
+            def __enter__(self):
+                entered.append(True)
+
+            def __exit__(self, *exc):
+                pass
+
+        executor = StagedExecutor({'optimize': 1}, context=Context)
+        self.assertEqual(executor.run('optimize', lambda x: x * 2, 21), 42)
+        self.assertEqual(entered, [True])
+        executor.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
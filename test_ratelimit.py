@@ -0,0 +1,257 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from ratelimit import (AIMDController, Histogram, RateLimiter, RateLimitExceeded, RedisCounters, SQLiteCounters,
+                       TokenBucket, UpstreamLimiter, estimate_tokens, parse_rate_limits)
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class TestRateLimitConfig(unittest.TestCase):
+    def test_parse_rate_limits(self):
+        limits = parse_rate_limits('chatgpt=rpm:3500,tpm:90000; blackbox=rpm:600,latency:2.5')
+        self.assertEqual(limits['chatgpt'], {'rpm': 3500.0, 'tpm': 90000.0})
+        self.assertEqual(limits['blackbox'], {'rpm': 600.0, 'latency': 2.5})
+
+    def test_estimate_tokens(self):
+        self.assertEqual(estimate_tokens(None), 1)
+        small = estimate_tokens({'messages': [{'content': 'x' * 400}]})
+        self.assertGreaterEqual(small, 100)
+        self.assertEqual(estimate_tokens({'messages': [{'content': 'x' * 400}], 'max_tokens': 50}),
+                         estimate_tokens({'messages': [{'content': 'x' * 400}], 'max_tokens': 0}) + 50)
+
+    def test_limiters_are_per_upstream_and_key(self):
+        registry = RateLimiter({'chatgpt': {'rpm': 60}})
+        a = registry.limiter('chatgpt', {'Authorization': 'Bearer a'})
+        self.assertIs(a, registry.limiter('chatgpt', {'Authorization': 'Bearer a'}))
+        self.assertIsNot(a, registry.limiter('chatgpt', {'Authorization': 'Bearer b'}))
+        self.assertIsNone(registry.limiter('blackbox', {}))
+        self.assertEqual(len(registry.stats()), 2)
+        self.assertNotIn('Bearer', ''.join(registry.stats()))
+
+
+class TestPrimitives(unittest.TestCase):
+    def test_token_bucket(self):
+        bucket = TokenBucket(60, capacity=2)
+        now = bucket.updated
+        self.assertEqual(bucket.wait_time(1, now), 0.0)
+        bucket.take(2)
+        self.assertAlmostEqual(bucket.wait_time(1, now), 1.0)
+        self.assertAlmostEqual(bucket.wait_time(1, now + 0.5), 0.5)
+
+    def test_aimd(self):
+        aimd = AIMDController(initial=8, maximum=10, latency_target=1.0)
+        aimd.on_result(False, 0.1, now=10.0)
+        self.assertAlmostEqual(aimd.limit, 8.125)
+        aimd.on_result(True, 0.1, now=10.0)
+        self.assertAlmostEqual(aimd.limit, 4.0625)
+        # A burst of 429s within the cooldown only counts once
+        aimd.on_result(True, 0.1, now=10.5)
+        self.assertAlmostEqual(aimd.limit, 4.0625)
+        aimd.on_result(False, 2.0, now=11.5)
+        self.assertAlmostEqual(aimd.limit, 2.03125)
+
+    def test_histogram(self):
+        histogram = Histogram((10, 100))
+        for value in (1, 50, 500):
+            histogram.observe(value)
+        self.assertEqual(histogram.snapshot(), {"buckets": {"10": 1, "100": 2, "+Inf": 3}, "count": 3, "sum": 551})
+
+
+class TestUpstreamLimiter(unittest.TestCase):
+    def test_requests_queue_for_budget(self):
+        limiter = UpstreamLimiter('chatgpt', rpm=600, burst=1)
+        started = time.monotonic()
+        for _ in range(3):
+            limiter.release(limiter.acquire())
+        self.assertGreaterEqual(time.monotonic() - started, 0.15)
+        stats = limiter.stats()
+        self.assertEqual(stats['wait_ms']['count'], 3)
+        self.assertEqual(stats['queue_depth'], 0)
+
+    def test_rejects_after_max_wait(self):
+        limiter = UpstreamLimiter('chatgpt', rpm=1, burst=1, max_wait=0.1)
+        limiter.acquire()
+        with self.assertRaises(RateLimitExceeded) as raised:
+            limiter.acquire()
+        self.assertEqual(raised.exception.response.status_code, 429)
+        self.assertEqual(limiter.stats()['rejected'], 1)
+
+    def test_concurrency_limit_and_throttle(self):
+        limiter = UpstreamLimiter('blackbox', concurrency=1)
+        permit = limiter.acquire()
+        acquired = threading.Event()
+
+        def second():
+            limiter.release(limiter.acquire())
+            acquired.set()
+
+        thread = threading.Thread(target=second)
+        thread.start()
+        time.sleep(0.1)
+        self.assertFalse(acquired.is_set())
+        self.assertEqual(limiter.stats()['queue_depth'], 1)
+        limiter.release(permit, status_code=429, retry_after=0.2)
+        thread.join(5)
+        self.assertTrue(acquired.is_set())
+        stats = limiter.stats()
+        self.assertEqual(stats['throttled'], 1)
+        self.assertGreaterEqual(stats['wait_ms']['sum'], 250)
+
+    def test_token_budget_uses_reported_usage(self):
+        limiter = UpstreamLimiter('chatgpt', tpm=6000)
+        permit = limiter.acquire(tokens=100)
+        limiter.release(permit, status_code=200, used_tokens=1100)
+        self.assertLess(limiter.tokens.level, 5000)
+
+    def test_async_acquire(self):
+        limiter = UpstreamLimiter('chatgpt', rpm=600, burst=1)
+
+        async def run():
+            for _ in range(2):
+                limiter.release(await limiter.acquire_async())
+
+        started = time.monotonic()
+        asyncio.run(run())
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+
+
+class SlowCounters:
+    # Counters whose every round trip takes delay seconds
+    def __init__(self, delay):
+        self.delay = delay
+        self.values = {}
+
+    def get(self, key):
+        time.sleep(self.delay)
+        return self.values.get(key, 0)
+
+    def incr(self, key, amount, ttl):
+        time.sleep(self.delay)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class TestSharedLimiterIO(unittest.TestCase):
+    def test_async_acquire_keeps_counter_io_off_the_loop(self):
+        counters = SlowCounters(0.1)
+        limiter = UpstreamLimiter('chatgpt', rpm=60, tpm=1000, counters=counters)
+        ticks = []
+
+        async def ticker():
+            for _ in range(20):
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        async def run():
+            tick = asyncio.ensure_future(ticker())
+            await limiter.release_async(await limiter.acquire_async(tokens=10), status_code=200, used_tokens=20)
+            await tick
+
+        asyncio.run(run())
+        # Five counter round trips took 0.5s; the loop kept running meanwhile
+        self.assertLess(max(b - a for a, b in zip(ticks, ticks[1:])), 0.08)
+        # One request; the token estimate of 10 corrected to the 20 used
+        self.assertEqual(sorted(counters.values.values()), [1, 20])
+
+    def test_counter_io_is_not_made_under_the_lock(self):
+        limiter = UpstreamLimiter('chatgpt', rpm=60, counters=SlowCounters(0.2))
+        thread = threading.Thread(target=lambda: limiter.release(limiter.acquire()))
+        thread.start()
+        time.sleep(0.05)
+        started = time.monotonic()
+        limiter.stats()
+        self.assertLess(time.monotonic() - started, 0.1)
+        thread.join(5)
+
+
+class TestSharedCounters(unittest.TestCase):
+    # Counters that nodes share, checked as a subTest on each backend. A
+    # backend's storage() sets up empty storage and returns connect(), which
+    # opens one node's counters on it.
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.opened = 0
+        self.backends = [('sqlite', self.sqlite_storage)]
+        if fakeredis is not None:
+            self.backends.insert(0, ('redis', self.redis_storage))
+
+    def redis_storage(self):
+        server = fakeredis.FakeServer()
+
+        def connect():
+            client = fakeredis.FakeRedis(server=server)
+            self.addCleanup(client.close)
+            return RedisCounters(client)
+        return connect
+
+    def sqlite_storage(self):
+        self.opened += 1
+        path = os.path.join(self.tmp.name, f'ratelimit-{self.opened}.sqlite3')
+
+        def connect():
+            counters = SQLiteCounters(path)
+            self.addCleanup(counters.close)
+            return counters
+        return connect
+
+    def test_counters(self):
+        for name, storage in self.backends:
+            with self.subTest(counters=name):
+                connect = storage()
+                counters = connect()
+                self.assertEqual(counters.get('k'), 0)
+                counters.incr('k', 5, ttl=60)
+                counters.incr('k', -2, ttl=60)
+                self.assertEqual(counters.get('k'), 3)
+                counters.incr('short', 1, ttl=0.05)
+                time.sleep(0.1)
+                self.assertEqual(counters.get('short'), 0)
+
+    def test_nodes_share_one_budget(self):
+        for name, storage in self.backends:
+            with self.subTest(counters=name):
+                # Keep clear of a window boundary so the budget does not reset mid-test
+                if 60 - time.time() % 60 < 2:
+                    time.sleep(2.1)
+                connect = storage()
+                nodes = [RateLimiter({'chatgpt': {'rpm': 3, 'tpm': 100}}, max_wait=0.1, counters=connect())
+                         for _ in range(2)]
+                headers = {'Authorization': 'Bearer key'}
+                first, second = (node.limiter('chatgpt', headers) for node in nodes)
+                for limiter in (first, second, first):
+                    limiter.release(limiter.acquire(tokens=10), used_tokens=20)
+                self.assertEqual(second.tokens.counters.get(f"{second.tokens.key}:{int(time.time() // 60)}"), 60)
+                with self.assertRaises(RateLimitExceeded) as raised:
+                    second.acquire()
+                self.assertGreaterEqual(int(raised.exception.response.headers['Retry-After']), 1)
+                # Another API key has its own budget
+                other = nodes[1].limiter('chatgpt', {'Authorization': 'Bearer other'})
+                other.release(other.acquire())
+
+
+class TestRegistryRelease(unittest.TestCase):
+    def test_release_reads_response(self):
+        registry = RateLimiter({'chatgpt': {'tpm': 60000}})
+        limiter = registry.limiter('chatgpt', {})
+        response = MagicMock(status_code=200)
+        response.json.return_value = {'usage': {'total_tokens': 10}}
+        permit = limiter.acquire(tokens=50)
+        registry.release(limiter, permit, response)
+        self.assertAlmostEqual(limiter.tokens.level, 60000 - 10, delta=5)
+
+        limited = MagicMock(status_code=429, headers={'Retry-After': '1'})
+        registry.release(limiter, limiter.acquire(), limited)
+        self.assertGreater(limiter.blocked_until, time.monotonic())
+
+
+if __name__ == '__main__':
+    unittest.main()
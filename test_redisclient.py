@@ -0,0 +1,101 @@
+import time
+import unittest
+
+from redisclient import NearCache, Subscriber
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not reached")
+        time.sleep(0.01)
+
+
+def drop_connections(server):
+    # Every client of server sees its connection fail until it comes back
+    server.connected = False
+    time.sleep(0.5)
+    server.connected = True
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class TestSubscriber(unittest.TestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.client = fakeredis.FakeRedis(server=self.server)
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_subscriber_reconnects(self):
+        received, resets = [], []
+        subscriber = Subscriber(self.client, 'events', received.append, lambda: resets.append(1), retry_delay=0.05)
+        self.addCleanup(subscriber.close)
+        wait_until(subscriber.live.is_set)
+        self.client.publish('events', 'first')
+        wait_until(lambda: received == [b'first'])
+
+        drop_connections(self.server)
+        wait_until(lambda: resets)
+        wait_until(subscriber.live.is_set)
+        self.client.publish('events', 'second')
+        wait_until(lambda: received == [b'first', b'second'])
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class TestNearCache(unittest.TestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.clients = [fakeredis.FakeRedis(server=self.server) for _ in range(2)]
+        self.caches = [NearCache(client, 'invalidate', max_entries=2) for client in self.clients]
+
+    def tearDown(self):
+        for cache in self.caches:
+            cache.close()
+        for client in self.clients:
+            client.close()
+
+    def live(self, cache):
+        # The cache only serves once its subscription is up
+        cache.get('warmup')
+        wait_until(lambda: cache._subscriber.live.is_set())
+
+    def test_invalidation_reaches_other_nodes(self):
+        first, second = self.caches
+        self.live(first)
+        self.live(second)
+        second.put('project', 'v1', second.generation())
+        self.assertEqual(second.get('project'), 'v1')
+        first.invalidate('project')
+        wait_until(lambda: second.get('project') is None)
+        second.put('other', 'v1', second.generation())
+        first.invalidate()
+        wait_until(lambda: len(second) == 0)
+
+    def test_stale_read_is_not_cached(self):
+        cache = self.caches[0]
+        self.live(cache)
+        generation = cache.generation()
+        cache.invalidate('project')
+        cache.put('project', 'stale', generation)
+        self.assertIsNone(cache.get('project'))
+
+    def test_lru_and_reset(self):
+        cache = self.caches[0]
+        self.live(cache)
+        for key in ('a', 'b', 'c'):
+            cache.put(key, key, cache.generation())
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), 'c')
+        drop_connections(self.server)
+        wait_until(lambda: len(cache) == 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
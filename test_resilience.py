@@ -0,0 +1,180 @@
+import asyncio
+import contextvars
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+import requests
+from resilience import CircuitBreaker, CircuitOpenError, Resilience, RetryBudget, UpstreamPolicy
+
+request_id = contextvars.ContextVar('request_id', default=None)
+
+
+def response(status_code, headers=None):
+    return MagicMock(status_code=status_code, headers=headers or {})
+
+
+class Sequence:
+    # send() stand-in returning (or raising) the given outcomes in order
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_and_recovers(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        breaker.record(False)
+        breaker.check('chatgpt')
+        breaker.record(False)
+        self.assertEqual(breaker.state, 'open')
+        with self.assertRaises(CircuitOpenError):
+            breaker.check('chatgpt')
+        time.sleep(0.06)
+        breaker.check('chatgpt')
+        self.assertEqual(breaker.state, 'half_open')
+        # Only one trial call while half open
+        with self.assertRaises(CircuitOpenError):
+            breaker.check('chatgpt')
+        breaker.record(True)
+        self.assertEqual(breaker.state, 'closed')
+        self.assertEqual(breaker.trips, 1)
+
+    def test_failed_trial_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+        breaker.record(False)
+        time.sleep(0.02)
+        breaker.check('chatgpt')
+        breaker.record(False)
+        self.assertEqual(breaker.state, 'open')
+
+
+class TestRetryBudget(unittest.TestCase):
+    def test_budget(self):
+        budget = RetryBudget(ratio=0.5, minimum=1)
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+
+
+class TestUpstreamPolicy(unittest.TestCase):
+    def policy(self, **kwargs):
+        kwargs.setdefault('base_delay', 0.001)
+        return UpstreamPolicy('chatgpt', **kwargs)
+
+    def test_retries_retryable_status_then_succeeds(self):
+        send = Sequence(response(503), response(502), response(200))
+        policy = self.policy()
+        self.assertEqual(policy.call(send).status_code, 200)
+        self.assertEqual(send.calls, 3)
+        self.assertEqual(policy.stats()['retries'], 2)
+
+    def test_gives_up_after_attempts(self):
+        send = Sequence(response(503), response(503))
+        self.assertEqual(self.policy(attempts=2).call(send).status_code, 503)
+        send = Sequence(requests.exceptions.ConnectionError(), requests.exceptions.Timeout())
+        with self.assertRaises(requests.exceptions.Timeout):
+            self.policy(attempts=2).call(send)
+
+    def test_does_not_retry_client_errors(self):
+        send = Sequence(response(400))
+        self.assertEqual(self.policy().call(send).status_code, 400)
+        send = Sequence(requests.exceptions.HTTPError('bad'))
+        with self.assertRaises(requests.exceptions.HTTPError):
+            self.policy().call(send)
+        self.assertEqual(send.calls, 1)
+
+    def test_honours_retry_after(self):
+        policy = self.policy(max_delay=1.0)
+        self.assertEqual(policy.backoff(1, response(429, {'Retry-After': '0.5'})), 0.5)
+        self.assertIsNone(policy.backoff(1, response(429, {'Retry-After': '60'})))
+        self.assertLessEqual(policy.backoff(10), 1.0)
+        send = Sequence(response(429, {'Retry-After': '60'}))
+        self.assertEqual(policy.call(send).status_code, 429)
+        self.assertEqual(send.calls, 1)
+
+    def test_retry_budget_limits_retries(self):
+        policy = self.policy(attempts=5)
+        policy.budget.balance = 1.0
+        send = Sequence(response(503), response(503), response(200))
+        self.assertEqual(policy.call(send).status_code, 503)
+        self.assertEqual(send.calls, 2)
+
+    def test_circuit_fails_fast(self):
+        policy = self.policy(attempts=1, failure_threshold=2)
+        for _ in range(2):
+            policy.call(Sequence(response(500)))
+        send = Sequence(response(200))
+        with self.assertRaises(CircuitOpenError):
+            policy.call(send)
+        self.assertEqual(send.calls, 0)
+        self.assertEqual(policy.stats()['circuit'], 'open')
+
+    def test_hedged_request_wins_over_slow_primary(self):
+        policy = self.policy(hedge=True)
+        for _ in range(20):
+            policy.latency.observe(0.01)
+        calls = []
+        lock = threading.Lock()
+
+        def send():
+            with lock:
+                calls.append(request_id.get())
+                first = len(calls) == 1
+            time.sleep(1.0 if first else 0.01)
+            return response(200, {'which': 'primary' if first else 'hedge'})
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            started = time.monotonic()
+            token = request_id.set('r1')
+            try:
+                result = policy.call(send, hedgeable=True, pool=pool)
+            finally:
+                request_id.reset(token)
+            self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(result.headers['which'], 'hedge')
+        self.assertEqual((policy.hedges, policy.hedge_wins), (1, 1))
+        # Both attempts ran in the caller's context
+        self.assertEqual(calls, ['r1', 'r1'])
+
+    def test_async_retry_and_hedge(self):
+        policy = self.policy(hedge=True)
+        for _ in range(20):
+            policy.latency.observe(0.01)
+        attempts = []
+
+        async def send():
+            attempts.append(None)
+            if len(attempts) == 1:
+                return response(503)
+            await asyncio.sleep(1.0 if len(attempts) == 2 else 0.01)
+            return response(200)
+
+        started = time.monotonic()
+        result = asyncio.run(policy.call_async(send, hedgeable=True))
+        self.assertEqual(result.status_code, 200)
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual((policy.retries, policy.hedges), (1, 1))
+
+
+class TestResilience(unittest.TestCase):
+    def test_policies_from_settings(self):
+        resilience = Resilience({'chatgpt': {'attempts': 5, 'hedge': 1}})
+        self.assertEqual(resilience.policy('chatgpt').attempts, 5)
+        self.assertTrue(resilience.policy('chatgpt').hedge)
+        self.assertEqual(resilience.policy('blackbox').attempts, 3)
+        self.assertEqual(set(resilience.stats()), {'chatgpt', 'blackbox'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import math
+import time
+import unittest
+from semantic import SemanticCache, SemanticIndex, embed, load_numpy, scope_id
+
+
+def cosine(a, b):
+    return sum(weight * b.get(index, 0.0) for index, weight in a.items())
+
+
+class TestEmbedding(unittest.TestCase):
+    def test_unit_length_and_stable(self):
+        vector = embed("How do I reverse a list in Python?")
+        self.assertAlmostEqual(math.sqrt(sum(w * w for w in vector.values())), 1.0, places=6)
+        self.assertEqual(vector, embed("How do I reverse a list in Python?"))
+        self.assertEqual(embed("the of a"), {})
+
+    def test_paraphrases_are_closer_than_unrelated_questions(self):
+        question = embed("How do I reverse a list in Python?")
+        paraphrase = embed("how can I reverse a python list")
+        unrelated = embed("What is the capital of France?")
+        self.assertGreater(cosine(question, paraphrase), 0.8)
+        self.assertLess(cosine(question, unrelated), 0.3)
+
+
+class SemanticIndexTests:
+    use_numpy = False
+
+    def index(self, **kwargs):
+        return SemanticIndex(dim=64, use_numpy=self.use_numpy, **kwargs)
+
+    def test_search_respects_scope_and_threshold(self):
+        index = self.index()
+        index.add(embed("reverse a list", 64), 1, b'"reversed"')
+        index.add(embed("sort a dictionary by value", 64), 1, b'"sorted"')
+        value, similarity = index.search(embed("reverse the list", 64), 1, 0.5)
+        self.assertEqual(value, b'"reversed"')
+        self.assertLessEqual(similarity, 1.0 + 1e-6)
+        self.assertIsNone(index.search(embed("reverse a list", 64), 2, 0.5))
+        self.assertIsNone(index.search(embed("parse a date string", 64), 1, 0.9))
+        self.assertIsNone(index.search({}, 1, 0.0))
+
+    def test_lru_eviction_by_entries_and_bytes(self):
+        index = self.index(max_entries=2)
+        for i, text in enumerate(["alpha query", "beta query", "gamma query"]):
+            index.add(embed(text, 64), 1, str(i).encode())
+        self.assertEqual(len(index), 2)
+        self.assertIsNone(index.search(embed("alpha query", 64), 1, 0.99))
+        self.assertEqual(index.search(embed("gamma query", 64), 1, 0.99)[0], b'2')
+
+        index = self.index(max_bytes=10)
+        index.add(embed("alpha query", 64), 1, b'123456')
+        index.add(embed("beta query", 64), 1, b'123456')
+        self.assertEqual(index.size(), (1, 6))
+        index.add(embed("gamma query", 64), 1, b'x' * 11)
+        self.assertEqual(index.size(), (1, 6))
+
+    def test_slots_are_reused_and_expire(self):
+        index = self.index(max_entries=1000)
+        for i in range(1500):
+            index.add(embed(f"question number {i}", 64), 1, b'v')
+        self.assertEqual(len(index), 1000)
+        index.clear()
+        self.assertEqual(index.size(), (0, 0))
+
+        index.add(embed("stale", 64), 1, b'v', expires_at=time.time() - 1)
+        self.assertIsNone(index.search(embed("stale", 64), 1, 0.5))
+        self.assertEqual(len(index), 0)
+
+
+class TestPythonIndex(SemanticIndexTests, unittest.TestCase):
+    use_numpy = False
+
+
+@unittest.skipIf(load_numpy() is None, "numpy is not installed")
+class TestNumpyIndex(SemanticIndexTests, unittest.TestCase):
+    use_numpy = True
+
+
+class TestSemanticCache(unittest.TestCase):
+    def test_get_and_set(self):
+        cache = SemanticCache(SemanticIndex(use_numpy=False), threshold=0.8)
+        self.assertIsNone(cache.get('scope', "How do I reverse a list in Python?"))
+        cache.set('scope', "How do I reverse a list in Python?", {"answer": "reversed(xs)"})
+        result, similarity = cache.get('scope', "how can I reverse a python list")
+        self.assertEqual(result, {"answer": "reversed(xs)"})
+        self.assertGreater(similarity, 0.8)
+        self.assertIsNone(cache.get('other scope', "How do I reverse a list in Python?"))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 2)
+
+    def test_disabled(self):
+        cache = SemanticCache(None)
+        self.assertFalse(cache.enabled)
+        cache.set('scope', 'text', {})
+        self.assertIsNone(cache.get('scope', 'text'))
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.assertNotEqual(scope_id('a'), scope_id('b'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import threading
+import time
+import unittest
+from singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_share_one_execution(self):
+        group = SingleFlight()
+        calls = []
+        release = threading.Event()
+
+        def slow():
+            calls.append(1)
+            release.wait(2)
+            return 'result'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(group.do('key', slow))) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        while group.stats()['coalesced'] < 9:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([r for r, _ in results], ['result'] * 10)
+        self.assertEqual(sum(1 for _, shared in results if not shared), 1)
+        self.assertEqual(group.in_flight(), 0)
+
+    def test_errors_propagate_to_all_waiters(self):
+        group = SingleFlight()
+        release = threading.Event()
+
+        def failing():
+            release.wait(2)
+            raise ValueError('upstream down')
+
+        errors = []
+
+        def worker():
+            try:
+                group.do('key', failing)
+            except ValueError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        while group.stats()['coalesced'] < 4:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 5)
+
+    def test_sequential_calls_execute_again(self):
+        group = SingleFlight()
+        self.assertEqual(group.do('key', lambda: 1), (1, False))
+        self.assertEqual(group.do('key', lambda: 2), (2, False))
+        self.assertEqual(group.stats()['executed'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,330 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+import requests
+
+from benchmarks.bench_async import free_port, server_env, start_server
+from benchmarks.bench_store import hammer
+from store import MemoryProjectStore, RedisProjectStore, SQLiteProjectStore, VersionConflict
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+def task_values(store, project_id):
+    return [entry['task'] for entry in store.list_tasks(project_id, limit=1000)['tasks']]
+
+
+class TestProjectStores(unittest.TestCase):
+    # Behaviour every store shares, checked as a subTest on each of them.
+    # Each make_store() call returns a new, empty store.
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.opened = 0
+        self.factories = [('memory', MemoryProjectStore), ('memory, one lock', lambda: MemoryProjectStore(stripes=1)),
+                          ('sqlite', self.sqlite_store)]
+        if fakeredis is not None:
+            self.factories.append(('redis', self.redis_store))
+
+    def sqlite_store(self):
+        self.opened += 1
+        store = SQLiteProjectStore(os.path.join(self.tmp.name, f'projects-{self.opened}.sqlite3'))
+        self.addCleanup(store.close)
+        return store
+
+    def redis_store(self):
+        store = RedisProjectStore(fakeredis.FakeRedis(server=fakeredis.FakeServer()))
+        self.addCleanup(store.client.close)
+        self.addCleanup(store.close)
+        return store
+
+    def test_create_and_get(self):
+        for name, make_store in self.factories:
+            with self.subTest(store=name):
+                store = make_store()
+                project_id = store.create('Demo')
+                project = store.get(project_id)
+                self.assertEqual(project, {'name': 'Demo', 'status': 'Created', 'progress': 0, 'task_count': 0,
+                                           'documentation': '', 'version': 1})
+                self.assertTrue(store.exists(project_id))
+                self.assertFalse(store.exists('missing'))
+                self.assertIsNone(store.get('missing'))
+
+    def test_get_returns_a_copy(self):
+        for name, make_store in self.factories:
+            with self.subTest(store=name):
+                store = make_store()
+                project_id = store.create('Demo')
+                store.update(project_id, documentation={'documentation': 'docs'})
+                store.get(project_id)['documentation']['documentation'] = 'leak'
+                self.assertEqual(store.get(project_id)['documentation'], {'documentation': 'docs'})
+
+    def test_update_and_progress(self):
+        for name, make_store in self.factories:
+            with self.subTest(store=name):
+                store = make_store()
+                project_id = store.create('Demo')
+                self.assertTrue(store.update(project_id, status='Active', documentation={'documentation': 'docs'}))
+                self.assertFalse(store.update('missing', status='Active'))
+                self.assertEqual(store.increment_progress(project_id, 60), 60)
+                self.assertEqual(store.increment_progress(project_id, 60), 100)
+                self.assertIsNone(store.increment_progress('missing', 10))
+                project = store.get(project_id)
+                self.assertEqual((project['status'], project['progress']), ('Active', 100))
+                self.assertEqual(project['documentation'], {'documentation': 'docs'})
+
+    def test_keyed_progress_is_applied_once(self):
+        for name, make_store in self.factories:
+            with self.subTest(store=name):
+                store = make_store()
+                project_id, other_id = store.create('Demo'), store.create('Other')
+                self.assertEqual(store.increment_progress(project_id, 10, key='1'), 10)
+                self.assertEqual(store.increment_progress(project_id, 10, key='1'), 10)
+                self.assertEqual(store.increment_progress(project_id, 10, key='2'), 20)
+                self.assertEqual(store.increment_progress(other_id, 10, key='1'), 10)
+                self.assertIsNone(store.increment_progress('missing', 10, key='1'))
+                self.assertEqual(store.get(project_id)['progress'], 20)
+
+    def test_append_tasks(self):
+        for name, make_store in self.factories:
+            with self.subTest(store=name):
+                store = make_store()
+                project_id = store.create('Demo')
+                first_id = store.append_task(project_id, 'first')
+                self.assertIsNotNone(first_id)
+                self.assertIsNone(store.append_task('missing', 'lost'))
+                self.assertEqual(store.append_tasks(project_id, ['second', {'title': 'third'}], progress_delta=20), 20)
+                self.assertIsNone(store.append_tasks('missing', ['lost']))
+                self.assertEqual(store.get(project_id)['task_count'], 3)
+                self.assertEqual(task_values(store, project_id), ['first', 'second', {'title': 'third'}])
+                self.assertEqual(store.list_tasks(project_id)['tasks'][0], {'task_id': first_id, 'task': 'first'})
+
+    def test_task_pages(self):
+        for name, make_store in self.factories:
+            with self.subTest(store=name):
+                store = make_store()
+                project_id = store.create('Demo')
+                other = store.create('Other')
+                for i in range(7):
+                    store.append_task(project_id, i)
+                    store.append_task(other, -i)
+                seen, cursor = [], 0
+                while True:
+                    page = store.list_tasks(project_id, cursor=cursor, limit=3)
+                    seen.extend(entry['task'] for entry in page['tasks'])
+                    if not page['has_more']:
+                        break
+                    cursor = page['next_cursor']
+                self.assertEqual(seen, list(range(7)))
+                self.assertIsNone(store.list_tasks('missing'))
+
+    def test_concurrent_appends(self):
+        for name, make_store in self.factories:
+            with self.subTest(store=name):
+                store = make_store()
+                project_id = store.create('Demo')
+
+                def append(worker):
+                    for i in range(25):
+                        store.append_task(project_id, f"{worker}-{i}")
+
+                threads = [threading.Thread(target=append, args=(w,)) for w in range(8)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                tasks = task_values(store, project_id)
+                self.assertEqual(len(tasks), 200)
+                self.assertEqual(store.get(project_id)['task_count'], 200)
+                for w in range(8):
+                    own = [t for t in tasks if t.startswith(f"{w}-")]
+                    self.assertEqual(own, [f"{w}-{i}" for i in range(25)])
+
+    def test_compare_and_swap(self):
+        for name, make_store in self.factories:
+            with self.subTest(store=name):
+                store = make_store()
+                project_id = store.create('Demo')
+                self.assertEqual(store.update(project_id, expected_version=1, status='Active'), 2)
+                with self.assertRaises(VersionConflict) as conflict:
+                    store.update(project_id, expected_version=1, status='Stale')
+                self.assertEqual(conflict.exception.version, 2)
+                store.increment_progress(project_id, 10)
+                self.assertEqual(store.update(project_id), 3)
+                self.assertIsNone(store.update('missing', expected_version=1, status='Active'))
+                project = store.get(project_id)
+                self.assertEqual((project['status'], project['progress'], project['version']), ('Active', 10, 3))
+
+    def test_no_lost_updates_under_contention(self):
+        for name, make_store in self.factories:
+            with self.subTest(store=name):
+                for projects in (1, 4):
+                    result = hammer(make_store(), threads=16, ops=40, projects=projects)
+                    self.assertEqual(result['lost'], 0)
+
+    def test_list_projects_by_status(self):
+        for name, make_store in self.factories:
+            with self.subTest(store=name):
+                store = make_store()
+                a = store.create('A')
+                b = store.create('B')
+                store.update(b, status='Done')
+                self.assertEqual({p['project_id'] for p in store.list_projects()}, {a, b})
+                self.assertEqual([p['name'] for p in store.list_projects('Done')], ['B'])
+                self.assertEqual([p['name'] for p in store.list_projects('Created')], ['A'])
+
+
+class TestSQLiteProjectStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'projects.sqlite3')
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        self.tmp.cleanup()
+
+    def make_store(self):
+        store = SQLiteProjectStore(self.path)
+        self.stores.append(store)
+        return store
+
+    def test_survives_reopen(self):
+        store = self.make_store()
+        project_id = store.create('Durable')
+        store.append_task(project_id, 'task')
+        store.close()
+        self.stores.remove(store)
+        self.assertEqual(task_values(self.make_store(), project_id), ['task'])
+
+    def test_cache_invalidated_by_other_connection(self):
+        first = self.make_store()
+        second = self.make_store()
+        project_id = first.create('Shared')
+        self.assertEqual(second.get(project_id)['status'], 'Created')
+        first.update(project_id, status='Active')
+        first.append_task(project_id, 'from first')
+        project = second.get(project_id)
+        self.assertEqual(project['status'], 'Active')
+        self.assertEqual(project['task_count'], 1)
+        with self.assertRaises(VersionConflict):
+            second.update(project_id, expected_version=1, status='Stale')
+
+    def test_adds_version_and_task_count_to_older_files(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute('CREATE TABLE projects (id TEXT PRIMARY KEY, name TEXT, status TEXT, progress INTEGER NOT NULL'
+                     ' DEFAULT 0, documentation TEXT NOT NULL DEFAULT \'""\', created_at REAL NOT NULL)')
+        conn.execute("INSERT INTO projects VALUES ('old', 'Old', 'Created', 0, '\"\"', 0)")
+        conn.execute('CREATE TABLE tasks (seq INTEGER PRIMARY KEY AUTOINCREMENT, project_id TEXT NOT NULL, task TEXT)')
+        conn.executemany('INSERT INTO tasks (project_id, task) VALUES (?, ?)', [('old', '"a"'), ('old', '"b"')])
+        conn.commit()
+        conn.close()
+        store = self.make_store()
+        self.assertEqual(store.get('old')['version'], 1)
+        self.assertEqual(store.get('old')['task_count'], 2)
+        store.append_task('old', 'c')
+        self.assertEqual(self.make_store().get('old')['task_count'], 3)
+        self.assertEqual(store.update('old', status='Active'), 2)
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class TestRedisProjectStore(unittest.TestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+            store.client.close()
+
+    def make_store(self):
+        # Each store has its own client, like a separate node
+        store = RedisProjectStore(fakeredis.FakeRedis(server=self.server))
+        self.stores.append(store)
+        return store
+
+    def test_projects_without_a_status_set_are_indexed(self):
+        store = self.make_store()
+        project_id = store.create('Old')
+        store.update(project_id, status='Active')
+        # As left by a version that kept no per-status sets
+        store.client.delete(store._status_key('Active'))
+        self.assertEqual([p['project_id'] for p in store.list_projects('Active')], [project_id])
+        self.assertEqual(self.make_store().list_projects('Done'), [])
+
+    def test_nodes_see_each_others_writes(self):
+        first = self.make_store()
+        second = self.make_store()
+        project_id = first.create('Shared')
+        # Warm second's local cache, then change the project through first
+        self.assertEqual(second.get(project_id)['status'], 'Created')
+        deadline = time.monotonic() + 5
+        while second.get(project_id)['version'] != 1 or not second._cache._subscriber.live.is_set():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        self.assertEqual(len(second._cache), 1)
+        first.update(project_id, status='Active')
+        first.append_task(project_id, 'from first')
+        while second.get(project_id)['task_count'] != 1:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        self.assertEqual(second.get(project_id)['status'], 'Active')
+        with self.assertRaises(VersionConflict):
+            second.update(project_id, expected_version=1, status='Stale')
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class TestSharedStateAcrossNodes(unittest.TestCase):
+    def test_two_app_nodes_share_projects(self):
+        # fakeredis served over TCP, so separate app processes can share it
+        server = fakeredis.TcpFakeServer(('127.0.0.1', 0))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        env = server_env(free_port(), 4)
+        env.update({'PROJECT_STORE': 'redis', 'REDIS_URL': f"redis://127.0.0.1:{server.server_address[1]}/0"})
+        nodes = []
+        for _ in range(2):
+            port = free_port()
+            nodes.append((start_server('sync', port, env, 4), f"http://127.0.0.1:{port}"))
+        try:
+            (_, a), (_, b) = nodes
+            project_id = requests.post(f"{a}/devin", json={'action': 'create_project', 'name': 'Shared'}).json()['project_id']
+            self.assertEqual(requests.get(f"{a}/projects/{project_id}").json()['project']['status'], 'Created')
+            for i in range(5):
+                node = (a, b)[i % 2]
+                response = requests.post(f"{node}/devin", json={'action': 'add_task', 'project_id': project_id,
+                                                                'task': f"task {i}"})
+                self.assertEqual(response.json()['status'], 'OK')
+            response = requests.post(f"{b}/devin", json={'action': 'update_status', 'project_id': project_id,
+                                                         'status': 'Active', 'version': 1})
+            self.assertEqual(response.json()['version'], 2)
+            stale = requests.post(f"{a}/devin", json={'action': 'update_status', 'project_id': project_id,
+                                                      'status': 'Stale', 'version': 1})
+            self.assertEqual(stale.status_code, 409)
+
+            deadline = time.monotonic() + 5
+            while True:
+                project = requests.get(f"{a}/projects/{project_id}").json()['project']
+                if (project['status'], project['task_count']) == ('Active', 5) or time.monotonic() > deadline:
+                    break
+                time.sleep(0.05)
+            self.assertEqual((project['status'], project['task_count']), ('Active', 5))
+            tasks = requests.post(f"{a}/devin", json={'action': 'list_tasks', 'project_id': project_id}).json()
+            self.assertEqual([entry['task'] for entry in tasks['tasks']], [f"task {i}" for i in range(5)])
+        finally:
+            for proc, _ in nodes:
+                proc.terminate()
+                proc.wait(timeout=30)
+
+
+if __name__ == '__main__':
+    unittest.main()
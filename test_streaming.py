@@ -0,0 +1,34 @@
+import json
+import unittest
+from streaming import NDJSON_MIMETYPE, SSE_MIMETYPE, encode_event, openai_deltas, parse_openai_line, stream_format
+
+
+class TestStreaming(unittest.TestCase):
+    def test_openai_deltas(self):
+        lines = [
+            b'data: {"choices": [{"delta": {"role": "assistant"}}]}',
+            b'',
+            b'data: {"choices": [{"delta": {"content": "def "}}]}',
+            b'data: {"choices": [{"delta": {"content": "f(): pass"}}]}',
+            b'data: [DONE]',
+            b'data: {"choices": [{"delta": {"content": "ignored"}}]}',
+        ]
+        self.assertEqual(list(openai_deltas(lines)), ['def ', 'f(): pass'])
+
+    def test_parse_openai_line(self):
+        self.assertEqual(parse_openai_line(': keep-alive'), (False, None))
+        self.assertEqual(parse_openai_line('data: [DONE]'), (True, None))
+
+    def test_stream_format(self):
+        self.assertEqual(stream_format('application/x-ndjson'), NDJSON_MIMETYPE)
+        self.assertEqual(stream_format('text/event-stream'), SSE_MIMETYPE)
+        self.assertEqual(stream_format(None), SSE_MIMETYPE)
+
+    def test_encode_event(self):
+        event = {'type': 'delta', 'content': 'x'}
+        self.assertEqual(json.loads(encode_event(NDJSON_MIMETYPE, event)), event)
+        self.assertEqual(encode_event(SSE_MIMETYPE, event), 'event: delta\ndata: {"type":"delta","content":"x"}\n\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
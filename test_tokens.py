@@ -0,0 +1,61 @@
+import unittest
+from tokens import OversizeError, TokenBudget, chunk_code, chunk_text, count_tokens, truncate_tokens
+
+
+def module(functions):
+    return "import os\n\n" + "".join(
+        f"def f{i}(value):\n    total = value * {i}\n    return os.path.join(str(total), 'x')\n\n\n" for i in range(functions))
+
+
+class TestTokens(unittest.TestCase):
+    def test_count_and_truncate(self):
+        self.assertEqual(count_tokens(''), 0)
+        self.assertLess(count_tokens('hello world'), count_tokens('hello world, hello again'))
+        text = 'word ' * 100
+        head = truncate_tokens(text, 10)
+        self.assertTrue(text.startswith(head))
+        self.assertLessEqual(count_tokens(head), 10)
+        self.assertEqual(truncate_tokens('short', 10), 'short')
+
+    def test_chunk_code_splits_at_blocks(self):
+        code = module(12)
+        chunks = chunk_code(code, 60)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(''.join(chunks), code)
+        for chunk in chunks:
+            self.assertLessEqual(count_tokens(chunk), 60)
+            self.assertTrue(chunk.startswith(('import', 'def')), chunk)
+
+    def test_chunk_oversized_block_and_text(self):
+        block = "def big():\n" + "".join(f"    x{i} = {i}\n" for i in range(200))
+        chunks = chunk_code(block, 50)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(''.join(chunks), block)
+        self.assertTrue(all(count_tokens(chunk) <= 50 for chunk in chunks))
+
+        text = "\n\n".join(f"Paragraph {i} " + "about things " * 10 for i in range(10))
+        chunks = chunk_text(text, 100)
+        self.assertEqual(''.join(chunks), text)
+        self.assertTrue(all(chunk.startswith('Paragraph') for chunk in chunks))
+        self.assertEqual(''.join(chunk_text('x' * 1000, 20)), 'x' * 1000)
+
+    def test_budget_plan(self):
+        code = module(12)
+        budget = TokenBudget(max_tokens=60, max_chunks=100)
+        self.assertEqual(budget.plan('def f(): pass', kind='code'), ['def f(): pass'])
+        self.assertEqual(budget.plan(None), [None])
+        self.assertEqual(''.join(budget.plan(code, kind='code')), code)
+        truncated, = budget.plan(code, kind='code', mode='truncate')
+        self.assertTrue(code.startswith(truncated))
+        with self.assertRaises(OversizeError) as caught:
+            budget.plan(code, mode='reject')
+        self.assertEqual(caught.exception.limit, 60)
+        with self.assertRaises(OversizeError):
+            TokenBudget(max_tokens=60, max_chunks=2).plan(code, kind='code')
+        with self.assertRaises(ValueError):
+            budget.plan(code, mode='summarize')
+        self.assertEqual(TokenBudget(max_tokens=0).plan(code), [code])
+
+
+if __name__ == '__main__':
+    unittest.main()
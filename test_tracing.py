@@ -0,0 +1,129 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from tracing import FileExporter, NO_SPAN, Tracer, activate, deactivate, parse_traceparent, span, traced
+
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, payload):
+        for resource in payload['resourceSpans']:
+            for scope in resource['scopeSpans']:
+                self.spans.extend(scope['spans'])
+
+
+def attributes(exported):
+    return {a['key']: list(a['value'].values())[0] for a in exported['attributes']}
+
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        self.exporter = ListExporter()
+        self.tracer = Tracer(exporter=self.exporter)
+
+    def test_parse_traceparent(self):
+        trace_id, span_id = '4bf92f3577b34da6a3ce929d0e0e4736', '00f067aa0ba902b7'
+        self.assertEqual(parse_traceparent(f'00-{trace_id}-{span_id}-01'), (trace_id, span_id, True))
+        self.assertEqual(parse_traceparent(f'00-{trace_id}-{span_id}-00'), (trace_id, span_id, False))
+        self.assertIsNone(parse_traceparent('00-' + '0' * 32 + f'-{span_id}-01'))
+        self.assertIsNone(parse_traceparent('garbage'))
+        self.assertIsNone(parse_traceparent(None))
+
+    def test_children_share_the_trace(self):
+        root = self.tracer.start_span('GET /', 'server')
+        token = activate(root)
+        try:
+            with span('outer') as outer:
+                with span('inner', 'client', {'fusion.upstream': 'chatgpt'}):
+                    pass
+        finally:
+            deactivate(token)
+        root.end()
+        self.tracer.flush()
+        by_name = {s['name']: s for s in self.exporter.spans}
+        self.assertEqual(set(by_name), {'GET /', 'outer', 'inner'})
+        self.assertEqual({s['traceId'] for s in self.exporter.spans}, {root.trace_id})
+        self.assertNotIn('parentSpanId', by_name['GET /'])
+        self.assertEqual(by_name['outer']['parentSpanId'], root.span_id)
+        self.assertEqual(by_name['inner']['parentSpanId'], outer.span_id)
+        self.assertEqual(by_name['inner']['kind'], 3)
+        self.assertEqual(attributes(by_name['inner'])['fusion.upstream'], 'chatgpt')
+
+    def test_errors_are_recorded(self):
+        root = self.tracer.start_span('root')
+        token = activate(root)
+        with self.assertRaises(ValueError):
+            with span('failing'):
+                raise ValueError('boom')
+        deactivate(token)
+        root.end()
+        self.tracer.flush()
+        failing = next(s for s in self.exporter.spans if s['name'] == 'failing')
+        self.assertEqual(failing['status'], {'code': 2, 'message': 'ValueError: boom'})
+
+    def test_span_outside_a_trace_is_a_no_op(self):
+        with span('orphan') as orphan:
+            self.assertIs(orphan, NO_SPAN)
+
+    def test_remote_parent(self):
+        trace_id, span_id = '4bf92f3577b34da6a3ce929d0e0e4736', '00f067aa0ba902b7'
+        root = self.tracer.start_span('POST /chatgpt', 'server', f'00-{trace_id}-{span_id}-01')
+        self.assertEqual((root.trace_id, root.parent_id, root.sampled), (trace_id, span_id, True))
+        unsampled = self.tracer.start_span('POST /chatgpt', 'server', f'00-{trace_id}-{span_id}-00')
+        self.assertFalse(unsampled.sampled)
+
+    def test_sampling(self):
+        never = Tracer(exporter=self.exporter, sample_ratio=0.0)
+        self.assertFalse(any(never.start_span('x').sampled for _ in range(50)))
+        half = Tracer(exporter=self.exporter, sample_ratio=0.5)
+        sampled = sum(half.start_span('x').sampled for _ in range(2000))
+        self.assertTrue(800 < sampled < 1200)
+        # Without an exporter trace ids are issued, but nothing is recorded
+        self.assertFalse(Tracer().start_span('x').sampled)
+
+    def test_full_queue_drops_spans(self):
+        tracer = Tracer(exporter=self.exporter, max_queue=2, batch_size=100, flush_interval=60)
+        for _ in range(5):
+            tracer.start_span('x').end()
+        tracer.flush()
+        self.assertEqual(len(self.exporter.spans), 2)
+        self.assertEqual(tracer.stats()['dropped'], 3)
+
+    def test_traced_decorator(self):
+        @traced('sync_work')
+        def work():
+            return 1
+
+        @traced('async_work')
+        async def async_work():
+            return 2
+
+        root = self.tracer.start_span('root')
+        token = activate(root)
+        self.assertEqual(work(), 1)
+        self.assertEqual(asyncio.run(async_work()), 2)
+        deactivate(token)
+        root.end()
+        self.tracer.flush()
+        self.assertEqual({s['name'] for s in self.exporter.spans}, {'root', 'sync_work', 'async_work'})
+
+    def test_file_exporter_writes_otlp_json(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'traces.jsonl')
+            tracer = Tracer(service_name='fusion-test', exporter=FileExporter(path))
+            tracer.start_span('root').end()
+            tracer.flush()
+            with open(path) as f:
+                payload = json.loads(f.readline())
+        resource = payload['resourceSpans'][0]
+        self.assertEqual(resource['resource']['attributes'][0],
+                         {'key': 'service.name', 'value': {'stringValue': 'fusion-test'}})
+        self.assertEqual(resource['scopeSpans'][0]['spans'][0]['name'], 'root')
+
+
+if __name__ == '__main__':
+    unittest.main()
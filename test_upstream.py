@@ -0,0 +1,119 @@
+import asyncio
+import unittest
+import threading
+from unittest.mock import patch
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import ratelimit
+from ratelimit import RateLimiter
+from upstream import AsyncUpstreamClient, UpstreamClient, parse_timeouts, DEFAULT_TIMEOUT
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = b'{"ok": true}'
+        self.send_response(429 if self.path.endswith('/limited') else 200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestUpstreamClient(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _KeepAliveHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v1"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_parse_timeouts(self):
+        timeouts = parse_timeouts('chatgpt=5,120; blackbox.search_code=3')
+        self.assertEqual(timeouts[('chatgpt', None)], (5.0, 120.0))
+        self.assertEqual(timeouts[('blackbox', 'search_code')], (3.0, 3.0))
+
+    def test_timeout_resolution(self):
+        client = UpstreamClient(timeouts=parse_timeouts('chatgpt=5,120;chatgpt.interpret_command=2,10'))
+        self.assertEqual(client.timeout_for('chatgpt', 'interpret_command'), (2.0, 10.0))
+        self.assertEqual(client.timeout_for('chatgpt', 'generate_code'), (5.0, 120.0))
+        self.assertEqual(client.timeout_for('blackbox', 'optimize_code'), DEFAULT_TIMEOUT)
+
+    def test_keep_alive_reuses_connections(self):
+        client = UpstreamClient()
+        for _ in range(3):
+            response = client.post('blackbox', 'search_code', self.url, json={'query': 'x'})
+            self.assertEqual(response.json(), {'ok': True})
+        stats = client.stats()['blackbox']
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 2)
+        client.close()
+
+    def test_sessions_are_per_upstream(self):
+        client = UpstreamClient()
+        client.post('chatgpt', 'generate_code', self.url, json={})
+        client.post('blackbox', 'optimize_code', self.url, json={})
+        stats = client.stats()
+        self.assertEqual(stats['chatgpt']['misses'], 1)
+        self.assertEqual(stats['blackbox']['misses'], 1)
+        client.close()
+
+    def test_async_client_shares_one_pool(self):
+        async def go():
+            client = AsyncUpstreamClient()
+            try:
+                responses = await asyncio.gather(*(
+                    client.post('blackbox', 'search_code', self.url, json={'query': str(i)}) for i in range(5)))
+                limited = await client.post('blackbox', 'search_code', self.url + '/limited', json={})
+                return responses, limited, client.stats()['blackbox']
+            finally:
+                await client.aclose()
+
+        responses, limited, stats = asyncio.run(go())
+        self.assertEqual([r.json() for r in responses], [{'ok': True}] * 5)
+        with self.assertRaises(requests.exceptions.HTTPError) as ctx:
+            limited.raise_for_status()
+        self.assertEqual(ctx.exception.response.status_code, 429)
+        self.assertLessEqual(stats['active'] + stats['idle'], 5)
+
+    def test_rate_limited_client_backs_off_on_429(self):
+        client = UpstreamClient(limiter=RateLimiter({'chatgpt': {'rpm': 6000, 'concurrency': 4}}))
+        headers = {'Authorization': 'Bearer key'}
+        client.post('chatgpt', 'generate_code', self.url, headers=headers, json={})
+        client.post('chatgpt', 'generate_code', self.url + '/limited', headers=headers, json={})
+        limits, = client.limits().values()
+        self.assertEqual(limits['throttled'], 1)
+        self.assertEqual(limits['in_flight'], 0)
+        self.assertLess(limits['concurrency_limit'], 4)
+        self.assertEqual(limits['wait_ms']['count'], 2)
+        client.close()
+
+    def test_clients_share_one_limiter(self):
+        # Under ASGI the job workers use the sync client; both must draw on one budget
+        with patch.dict('os.environ', {'UPSTREAM_RATE_LIMITS': 'chatgpt=rpm:60'}), patch.dict(ratelimit._shared, clear=True):
+            sync_client, async_client = UpstreamClient.from_env(), AsyncUpstreamClient.from_env()
+        self.assertIsNotNone(sync_client.limiter)
+        self.assertIs(sync_client.limiter, async_client.limiter)
+
+    def test_async_client_maps_connection_errors(self):
+        async def go():
+            client = AsyncUpstreamClient()
+            try:
+                await client.post('chatgpt', 'generate_code', 'http://127.0.0.1:9/unreachable', json={})
+            finally:
+                await client.aclose()
+
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            asyncio.run(go())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import os
+import re
+
+from codeblocks import split_blocks
+
+# What to do with an input over the token budget: fail with 413, send its
+# first max_tokens tokens, or split it and send the chunks concurrently
+OVERSIZE_MODES = ('reject', 'truncate', 'chunk')
+
+# Without tiktoken, tokens are estimated from words, punctuation and
+# whitespace runs; the estimate errs on the high side for code and prose
+_PIECE = re.compile(r'\s+|\w+|[^\w\s]')
+
+_encoding = None
+
+
+def _tiktoken_encoding():
+    # tiktoken is imported on first use rather than with the app
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(os.getenv('TOKENIZER_ENCODING', 'cl100k_base'))
+        except Exception:
+            # Not installed, or the encoding files (fetched on first use)
+            # are unavailable; estimate offline
+            _encoding = False
+    return _encoding or None
+
+
+def _estimate(piece):
+    if piece.isspace():
+        # A single space merges into the following word
+        return 0 if piece == ' ' else 1
+    return (len(piece) + 3) // 4
+
+
+def count_tokens(text):
+    encoding = _tiktoken_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return sum(_estimate(piece) for piece in _PIECE.findall(text))
+
+
+def truncate_tokens(text, max_tokens):
+    # The longest prefix of text that fits in max_tokens
+    encoding = _tiktoken_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    total = 0
+    for match in _PIECE.finditer(text):
+        piece = match.group()
+        cost = _estimate(piece)
+        if total + cost > max_tokens:
+            # Keep the part of a long word that still fits
+            return text[:match.start()] + piece[:max(0, max_tokens - total) * 4]
+        total += cost
+    return text
+
+
+def _pack(pieces, max_tokens, split):
+    # Greedily joins consecutive pieces into chunks of at most max_tokens;
+    # a piece that is too large on its own is broken up with split()
+    chunks = []
+    current, current_tokens = [], 0
+    for piece in pieces:
+        tokens = count_tokens(piece)
+        if tokens > max_tokens:
+            parts = split(piece, max_tokens)
+        else:
+            parts = [(piece, tokens)]
+        for part, part_tokens in parts:
+            if current and current_tokens + part_tokens > max_tokens:
+                chunks.append(''.join(current))
+                current, current_tokens = [], 0
+            current.append(part)
+            current_tokens += part_tokens
+    if current:
+        chunks.append(''.join(current))
+    return chunks
+
+
+def _split_hard(text, max_tokens):
+    # Cuts text into max_tokens pieces wherever the budget runs out
+    parts = []
+    while text:
+        head = truncate_tokens(text, max_tokens) or text[:1]
+        parts.append((head, count_tokens(head)))
+        text = text[len(head):]
+    return parts
+
+
+def _split_lines(text, max_tokens):
+    lines = text.splitlines(keepends=True)
+    if len(lines) == 1:
+        return _split_hard(text, max_tokens)
+    return [(chunk, count_tokens(chunk)) for chunk in _pack(lines, max_tokens, _split_hard)]
+
+
+def chunk_code(code, max_tokens):
+    # Splits Python source at top-level def/class boundaries (see
+    # codeblocks.py), packing small neighbouring blocks together
+    return _pack(split_blocks(code), max_tokens, _split_lines)
+
+
+def chunk_text(text, max_tokens):
+    # Splits prose at paragraph boundaries, then lines
+    paragraphs = re.split(r'(?<=\n\n)', text)
+    return _pack([p for p in paragraphs if p], max_tokens, _split_lines)
+
+
+class OversizeError(Exception):
+    def __init__(self, tokens, limit):
+        super().__init__(f"Input is {tokens} tokens, over the limit of {limit}")
+        self.tokens = tokens
+        self.limit = limit
+
+
+class TokenBudget:
+    # Per-request input budget for the budgeted field of an action (see
+    # actions.py). max_tokens=0 disables the check. Chunks are at most
+    # chunk_tokens (default max_tokens); inputs needing more than
+    # max_chunks chunks are rejected.
+
+    def __init__(self, max_tokens=6000, mode='chunk', chunk_tokens=None, max_chunks=16):
+        if mode not in OVERSIZE_MODES:
+            raise ValueError(f"Unknown oversize mode {mode}")
+        self.max_tokens = max_tokens
+        self.mode = mode
+        self.chunk_tokens = chunk_tokens or max_tokens
+        self.max_chunks = max_chunks
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_tokens=int(os.getenv('PROMPT_MAX_TOKENS', '6000')),
+            mode=os.getenv('PROMPT_OVERSIZE', 'chunk'),
+            chunk_tokens=int(os.getenv('PROMPT_CHUNK_TOKENS', '0')) or None,
+            max_chunks=int(os.getenv('PROMPT_MAX_CHUNKS', '16'))
+        )
+
+    def plan(self, text, kind='text', mode=None):
+        # The inputs to send upstream in place of text: [text] when it fits,
+        # otherwise its truncated prefix or its chunks, in order. Raises
+        # OversizeError when the input has to be rejected and ValueError
+        # for an unknown mode.
+        mode = mode or self.mode
+        if mode not in OVERSIZE_MODES:
+            raise ValueError(f"Unknown oversize mode {mode}")
+        if not isinstance(text, str) or self.max_tokens <= 0:
+            return [text]
+        tokens = count_tokens(text)
+        if tokens <= self.max_tokens:
+            return [text]
+        if mode == 'truncate':
+            return [truncate_tokens(text, self.max_tokens)]
+        if mode == 'chunk':
+            chunks = (chunk_code if kind == 'code' else chunk_text)(text, self.chunk_tokens)
+            if len(chunks) <= self.max_chunks:
+                return chunks
+        raise OversizeError(tokens, self.max_tokens)
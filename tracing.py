@@ -0,0 +1,291 @@
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Response header carrying the trace id of the request
+TRACE_HEADER = 'X-Trace-Id'
+
+# OTLP span kinds
+SPAN_KINDS = {'internal': 1, 'server': 2, 'client': 3}
+
+_TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+# The span currently open in this context (request, task or stage thread)
+_current_span = contextvars.ContextVar('fusion_span', default=None)
+
+
+def parse_traceparent(value):
+    # W3C trace context header; returns (trace_id, span_id, sampled) or None
+    match = _TRACEPARENT.match((value or '').strip().lower())
+    if match is None or match.group(1) == '0' * 32 or match.group(2) == '0' * 16:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
+
+
+class Span:
+    def __init__(self, tracer, name, trace_id, parent_id, kind, sampled, attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.kind = kind
+        self.sampled = sampled
+        self.attributes = dict(attributes or {})
+        self.status = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_error(self, message):
+        self.status = message
+
+    def end(self):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self.sampled:
+            self.tracer.on_end(self)
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': SPAN_KINDS[self.kind],
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [_attribute(k, v) for k, v in self.attributes.items() if v is not None],
+            'status': {'code': 2, 'message': self.status} if self.status is not None else {'code': 0}
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+class _NoSpan:
+    # Stands in for a span where there is no trace to join
+    trace_id = None
+    sampled = False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_error(self, message):
+        pass
+
+
+NO_SPAN = _NoSpan()
+
+
+def otlp_payload(spans, service_name):
+    # OTLP/JSON ExportTraceServiceRequest
+    return {
+        'resourceSpans': [{
+            'resource': {'attributes': [_attribute('service.name', service_name)]},
+            'scopeSpans': [{'scope': {'name': 'fusion'}, 'spans': [span.to_otlp() for span in spans]}]
+        }]
+    }
+
+
+class FileExporter:
+    # Appends one OTLP/JSON export request per line, which collectors (or
+    # a plain jq) can read back
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, payload):
+        line = json.dumps(payload, separators=(',', ':'))
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+
+class OTLPExporter:
+    # OTLP/HTTP with a JSON body, as accepted on a collector's /v1/traces
+    def __init__(self, endpoint, timeout=5.0):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def export(self, payload):
+        response = self._session.post(self.endpoint, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+
+
+class Tracer:
+    # Creates spans and exports sampled ones in batches from a background
+    # thread, so ending a span never waits on the exporter. Sampling is
+    # decided once per trace from its id (like OpenTelemetry's
+    # TraceIdRatioBased sampler) unless the caller's traceparent decides.
+    # Without an exporter, trace ids are still issued but nothing is kept.
+
+    def __init__(self, service_name='fusion-ai', exporter=None, sample_ratio=1.0,
+                 batch_size=512, max_queue=2048, flush_interval=5.0):
+        self.service_name = service_name
+        self.exporter = exporter
+        self.sample_ratio = sample_ratio
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self.flush_interval = flush_interval
+        self.exported = 0
+        self.dropped = 0
+        self._queue = []
+        self._cond = threading.Condition()
+        self._export_lock = threading.Lock()
+        self._worker = None
+
+    @classmethod
+    def from_env(cls):
+        kind = os.getenv('TRACE_EXPORTER', 'none').lower()
+        if kind == 'file':
+            exporter = FileExporter(os.getenv('TRACE_FILE', '/tmp/fusion-traces.jsonl'))
+        elif kind == 'otlp':
+            exporter = OTLPExporter(os.getenv('OTEL_EXPORTER_OTLP_TRACES_ENDPOINT', 'http://localhost:4318/v1/traces'))
+        else:
+            exporter = None
+        return cls(
+            service_name=os.getenv('OTEL_SERVICE_NAME', 'fusion-ai'),
+            exporter=exporter,
+            sample_ratio=float(os.getenv('TRACE_SAMPLE_RATIO', '1.0'))
+        )
+
+    def _sample(self, trace_id):
+        return self.exporter is not None and int(trace_id[16:], 16) < self.sample_ratio * 2 ** 64
+
+    def start_span(self, name, kind='internal', traceparent=None, attributes=None):
+        # Starts a span under the current one, else under the remote parent
+        # in `traceparent`, else as the root of a new trace. The span is not
+        # made current; see activate().
+        parent = _current_span.get()
+        remote = parse_traceparent(traceparent) if parent is None else None
+        if parent is not None:
+            trace_id, parent_id, sampled = parent.trace_id, parent.span_id, parent.sampled
+        elif remote is not None:
+            trace_id, parent_id, sampled = remote
+            sampled = sampled and self.exporter is not None
+        else:
+            trace_id, parent_id = f"{random.getrandbits(128):032x}", None
+            sampled = self._sample(trace_id)
+        return Span(self, name, trace_id, parent_id, kind, sampled, attributes)
+
+    def on_end(self, span):
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                self.dropped += 1
+                return
+            self._queue.append(span)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='trace-export', daemon=True)
+                self._worker.start()
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._queue) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        # Exports everything queued so far; also called at shutdown and by tests
+        with self._export_lock:
+            with self._cond:
+                batch, self._queue = self._queue, []
+            if not batch:
+                return
+            try:
+                self.exporter.export(otlp_payload(batch, self.service_name))
+                self.exported += len(batch)
+            except Exception as e:
+                self.dropped += len(batch)
+                logger.warning(f"Failed to export {len(batch)} spans: {str(e)}")
+
+    def stats(self):
+        with self._cond:
+            queued = len(self._queue)
+        return {"exported": self.exported, "dropped": self.dropped, "queued": queued,
+                "sample_ratio": self.sample_ratio, "exporter": type(self.exporter).__name__ if self.exporter else None}
+
+
+def activate(span):
+    # Makes span the parent of spans started in this context; returns a
+    # token for deactivate()
+    return _current_span.set(span)
+
+
+def deactivate(token):
+    _current_span.reset(token)
+
+
+def current_span():
+    return _current_span.get()
+
+
+@contextmanager
+def span(name, kind='internal', attributes=None):
+    # Child span of the current one; a no-op outside a trace
+    parent = _current_span.get()
+    if parent is None:
+        yield NO_SPAN
+        return
+    child = parent.tracer.start_span(name, kind, attributes=attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.set_error(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+
+def traced(name):
+    # Decorator wrapping each call of a function or coroutine function in
+    # a child span
+    def decorate(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
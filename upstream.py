@@ -0,0 +1,328 @@
+import asyncio
+import functools
+import os
+import threading
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import jsoncodec
+from metrics import UpstreamTimer
+from ratelimit import estimate_tokens, shared_limiter
+from resilience import Resilience
+import tracing
+
+# Default (connect, read) timeout in seconds for any upstream call
+DEFAULT_TIMEOUT = (3.05, 60.0)
+
+
+def parse_timeouts(spec):
+    # Parses "chatgpt=5,120;blackbox.search_code=3,10" into
+    # {('chatgpt', None): (5.0, 120.0), ('blackbox', 'search_code'): (3.0, 10.0)}
+    timeouts = {}
+    for entry in (spec or '').split(';'):
+        entry = entry.strip()
+        if not entry or '=' not in entry:
+            continue
+        name, value = entry.split('=', 1)
+        upstream, _, action = name.strip().partition('.')
+        parts = [float(v) for v in value.split(',') if v.strip()]
+        if len(parts) == 1:
+            parts = parts * 2
+        timeouts[(upstream, action or None)] = (parts[0], parts[1])
+    return timeouts
+
+
+@contextmanager
+def observe(upstream, action, url):
+    # Metrics and a client span for one logical upstream call, retries
+    # included; yields record(response), which returns the response
+    attributes = {'http.request.method': 'POST', 'url.full': url, 'fusion.upstream': upstream,
+                  'fusion.action': action}
+    with UpstreamTimer(upstream, action) as timer, tracing.span(f"POST {upstream}", 'client', attributes) as span:
+        def record(response):
+            span.set_attribute('http.response.status_code', response.status_code)
+            if response.status_code >= 400:
+                span.set_error(f"HTTP {response.status_code}")
+            return timer.record(response)
+        yield record
+
+
+class UpstreamClient:
+    def __init__(self, pool_connections=4, pool_maxsize=20, pool_block=False,
+                 keep_alive=True, timeouts=None, default_timeout=DEFAULT_TIMEOUT, limiter=None,
+                 resilience=None):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.keep_alive = keep_alive
+        self.timeouts = dict(timeouts or {})
+        self.default_timeout = default_timeout
+        self.limiter = limiter
+        self.resilience = resilience
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            pool_connections=int(os.getenv('UPSTREAM_POOL_CONNECTIONS', '4')),
+            pool_maxsize=int(os.getenv('UPSTREAM_POOL_MAXSIZE', '20')),
+            pool_block=os.getenv('UPSTREAM_POOL_BLOCK', 'false').lower() == 'true',
+            keep_alive=os.getenv('UPSTREAM_KEEP_ALIVE', 'true').lower() != 'false',
+            timeouts=parse_timeouts(os.getenv('UPSTREAM_TIMEOUTS', '')),
+            limiter=shared_limiter(),
+            resilience=Resilience.from_env(),
+        )
+
+    def timeout_for(self, upstream, action=None):
+        for key in ((upstream, action), (upstream, None)):
+            if key in self.timeouts:
+                return self.timeouts[key]
+        return self.default_timeout
+
+    def session(self, upstream):
+        # One session (and so one set of per-host pools) per upstream
+        session = self._sessions.get(upstream)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(upstream)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                                          pool_maxsize=self.pool_maxsize,
+                                          pool_block=self.pool_block)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    if not self.keep_alive:
+                        session.headers['Connection'] = 'close'
+                    self._sessions[upstream] = session
+        return session
+
+    def post(self, upstream, action, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout_for(upstream, action))
+        with observe(upstream, action, url) as record:
+            if self.resilience is None:
+                return record(self._send(upstream, url, kwargs))
+            policy = self.resilience.policy(upstream)
+            hedgeable = policy.hedge and not kwargs.get('stream')
+            send = functools.partial(self._send, upstream, url, kwargs)
+            pool = self.resilience.pool() if hedgeable else None
+            return record(policy.call(send, hedgeable=hedgeable, pool=pool))
+
+    def _send(self, upstream, url, kwargs):
+        # One attempt, inside the rate limiter when one is configured
+        limiter = self.limiter.limiter(upstream, kwargs.get('headers')) if self.limiter else None
+        if limiter is None:
+            return self.session(upstream).post(url, **kwargs)
+        permit = limiter.acquire(estimate_tokens(kwargs.get('json')))
+        response = None
+        try:
+            response = self.session(upstream).post(url, **kwargs)
+            return response
+        finally:
+            self.limiter.release(limiter, permit, response, streamed=kwargs.get('stream', False))
+
+    def limits(self):
+        return self.limiter.stats() if self.limiter else {}
+
+    def resilience_stats(self):
+        return self.resilience.stats() if self.resilience else {}
+
+    def stats(self):
+        # A pool "miss" is a request that had to open a new connection;
+        # every other request reused a kept-alive one.
+        stats = {}
+        with self._lock:
+            sessions = list(self._sessions.items())
+        for upstream, session in sessions:
+            pools = session.get_adapter('https://').poolmanager.pools
+            hosts = {}
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                requests_made = getattr(pool, 'num_requests', 0)
+                misses = getattr(pool, 'num_connections', 0)
+                hosts[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                    "requests": requests_made,
+                    "hits": max(0, requests_made - misses),
+                    "misses": misses,
+                    "idle": pool.pool.qsize() if pool.pool is not None else 0,
+                    "maxsize": self.pool_maxsize,
+                }
+            stats[upstream] = {
+                "hits": sum(h["hits"] for h in hosts.values()),
+                "misses": sum(h["misses"] for h in hosts.values()),
+                "hosts": hosts,
+            }
+        return stats
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+class AsyncUpstreamResponse:
+    # Fully-read aiohttp response exposing the parts of the requests.Response
+    # interface the handlers use, so sync and async paths share error handling.
+
+    def __init__(self, status_code, headers, content, url):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.url = url
+
+    def json(self):
+        return jsoncodec.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+
+class AsyncUpstreamStream:
+    # Streaming aiohttp response; the caller iterates lines and must close() it
+
+    def __init__(self, response, url):
+        self._response = response
+        self.status_code = response.status
+        self.headers = response.headers
+        self.url = url
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            self.close()
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+    async def iter_lines(self):
+        import aiohttp
+
+        try:
+            async for line in self._response.content:
+                yield line
+        except asyncio.TimeoutError as e:
+            raise requests.exceptions.Timeout(f"Timed out reading {self.url}") from e
+        except aiohttp.ClientError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+
+    def close(self):
+        self._response.release()
+
+
+class AsyncUpstreamClient(UpstreamClient):
+    # aiohttp-backed counterpart used by the ASGI app; one ClientSession (and
+    # so one connection pool) per upstream, shared by all in-flight requests.
+    # Transport errors are re-raised as requests exceptions.
+
+    def __init__(self, max_connections=1000, keepalive_timeout=30.0,
+                 timeouts=None, default_timeout=DEFAULT_TIMEOUT, limiter=None, resilience=None):
+        super().__init__(pool_maxsize=max_connections, timeouts=timeouts, default_timeout=default_timeout,
+                         limiter=limiter, resilience=resilience)
+        self.keepalive_timeout = keepalive_timeout
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_connections=int(os.getenv('ASYNC_UPSTREAM_MAX_CONNECTIONS', '1000')),
+            keepalive_timeout=float(os.getenv('ASYNC_UPSTREAM_KEEPALIVE_TIMEOUT', '30')),
+            timeouts=parse_timeouts(os.getenv('UPSTREAM_TIMEOUTS', '')),
+            limiter=shared_limiter(),
+            resilience=Resilience.from_env(),
+        )
+
+    def session(self, upstream):
+        import aiohttp
+
+        session = self._sessions.get(upstream)
+        if session is None or session.closed:
+            with self._lock:
+                session = self._sessions.get(upstream)
+                if session is None or session.closed:
+                    connector = aiohttp.TCPConnector(limit=self.pool_maxsize,
+                                                     keepalive_timeout=self.keepalive_timeout)
+                    session = self._sessions[upstream] = aiohttp.ClientSession(connector=connector)
+        return session
+
+    async def post(self, upstream, action, url, json=None, headers=None, timeout=None):
+        send = functools.partial(self._send_async, upstream, action, url, json, headers, timeout)
+        with observe(upstream, action, url) as record:
+            if self.resilience is None:
+                return record(await send())
+            policy = self.resilience.policy(upstream)
+            return record(await policy.call_async(send, hedgeable=policy.hedge))
+
+    async def _send_async(self, upstream, action, url, json, headers, timeout):
+        limiter = self.limiter.limiter(upstream, headers) if self.limiter else None
+        if limiter is None:
+            return await self._post(upstream, action, url, json, headers, timeout)
+        permit = await limiter.acquire_async(estimate_tokens(json))
+        response = None
+        try:
+            response = await self._post(upstream, action, url, json, headers, timeout)
+            return response
+        finally:
+            await self.limiter.release_async(limiter, permit, response)
+
+    async def _post(self, upstream, action, url, json, headers, timeout):
+        import aiohttp
+
+        connect, read = timeout or self.timeout_for(upstream, action)
+        client_timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+        try:
+            async with self.session(upstream).post(url, json=json, headers=headers, timeout=client_timeout) as response:
+                content = await response.read()
+                return AsyncUpstreamResponse(response.status, response.headers, content, url)
+        except asyncio.TimeoutError as e:
+            raise requests.exceptions.Timeout(f"Timed out calling {url}") from e
+        except aiohttp.ClientError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+
+    async def stream(self, upstream, action, url, json=None, headers=None, timeout=None):
+        # Timed until the response headers arrive, not while the body streams
+        send = functools.partial(self._stream, upstream, action, url, json, headers, timeout)
+        with observe(upstream, action, url) as record:
+            if self.resilience is None:
+                return record(await send())
+            return record(await self.resilience.policy(upstream).call_async(send))
+
+    async def _stream(self, upstream, action, url, json, headers, timeout):
+        import aiohttp
+
+        connect, read = timeout or self.timeout_for(upstream, action)
+        client_timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+        limiter = self.limiter.limiter(upstream, headers) if self.limiter else None
+        permit = await limiter.acquire_async(estimate_tokens(json)) if limiter else None
+        stream = None
+        try:
+            response = await self.session(upstream).post(url, json=json, headers=headers, timeout=client_timeout)
+            stream = AsyncUpstreamStream(response, url)
+        except asyncio.TimeoutError as e:
+            raise requests.exceptions.Timeout(f"Timed out calling {url}") from e
+        except aiohttp.ClientError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+        finally:
+            if limiter:
+                await self.limiter.release_async(limiter, permit, stream, streamed=True)
+        return stream
+
+    def stats(self):
+        with self._lock:
+            sessions = list(self._sessions.items())
+        stats = {}
+        for upstream, session in sessions:
+            connector = session.connector
+            idle = sum(len(conns) for conns in getattr(connector, '_conns', {}).values())
+            acquired = len(getattr(connector, '_acquired', ()))
+            stats[upstream] = {"active": acquired, "idle": idle, "maxsize": self.pool_maxsize}
+        return stats
+
+    async def aclose(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            await session.close()
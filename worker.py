@@ -0,0 +1,65 @@
+import argparse
+import multiprocessing
+import os
+import signal
+import threading
+
+from dotenv import load_dotenv
+
+# Worker processes for the durable job queue (see jobqueue.py). The web tier
+# only enqueues background /integrate and generate_documentation requests;
+# these processes run them, so worker capacity scales on its own:
+#
+#   PROJECT_STORE=sqlite JOB_INLINE_WORKERS=0 hypercorn 'asgi:create_asgi_app()'
+#   PROJECT_STORE=sqlite python worker.py --processes 4
+#
+# Web and worker processes must share a file-backed JOB_QUEUE_PATH and the
+# project store.
+# SIGTERM lets each process finish its current jobs before exiting.
+
+
+def serve(threads):
+    # Imported and set up here so the app's thread pools start after the fork
+    import app as fusion
+
+    fusion.create_app()
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    fusion.job_queue.prune()
+    workers = [threading.Thread(target=fusion.job_worker().run, args=(stop,), name=f"jobs-{i}")
+               for i in range(threads - 1)]
+    for worker in workers:
+        worker.start()
+    fusion.job_worker().run(stop)
+    for worker in workers:
+        worker.join()
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Run job queue workers")
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--threads', type=int, default=1, help="workers per process")
+    args = parser.parse_args()
+    if os.getenv('JOB_QUEUE_PATH', ':memory:') == ':memory:':
+        parser.error("set JOB_QUEUE_PATH to the SQLite file the web processes enqueue to")
+
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=serve, args=(max(1, args.threads),), name=f"fusion-worker-{i}")
+                 for i in range(args.processes)]
+    for process in processes:
+        process.start()
+
+    def stop(*_):
+        for process in processes:
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for process in processes:
+        process.join()
+
+
+if __name__ == '__main__':
+    main()